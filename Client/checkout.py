@@ -0,0 +1,201 @@
+import os
+import json
+import shutil
+import tempfile
+from concurrent.futures import ThreadPoolExecutor
+from object_cache import CACHE_DIR
+from sparse import PathFilter
+
+# Files downloaded and staged at the same time during a pull.
+PULL_WORKERS = 8
+
+# Patterns of a sparse checkout, kept with the rest of the client state.
+SPARSE_PATH = os.path.join(CACHE_DIR, 'sparse.json')
+
+# Branch, tree and manifest the working tree was last pulled or pushed at.
+BASE_PATH = os.path.join(CACHE_DIR, 'base.json')
+
+
+def load_sparse(path=SPARSE_PATH):
+    """Return the PathFilter of the sparse checkout; an empty one selects every file."""
+    try:
+        with open(path, 'r') as f:
+            return PathFilter(json.load(f).get('paths', []))
+    except (FileNotFoundError, ValueError):
+        return PathFilter()
+
+
+def save_sparse(paths, path=SPARSE_PATH):
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    tmp_path = path + '.tmp'
+    with open(tmp_path, 'w') as f:
+        json.dump({'paths': paths.patterns}, f)
+    os.replace(tmp_path, path)
+
+
+class Checkout:
+    """
+    Bring the working tree in line with a branch manifest.
+
+    Changed files are found by hash (see StatusEngine), downloaded through
+    the object cache and written in parallel to a staging directory inside
+    the tree. Only once everything is staged are the renames and deletions
+    applied, driven by a journal so an interrupted pull is rolled forward on
+    the next run instead of leaving a half-written tree.
+
+    In a sparse checkout the manifest only holds the selected paths and the
+    status engine only scans them, so files outside are never deleted.
+
+    The tree and manifest last pulled are kept as the working tree's base:
+    local changes are what differs from the base, not from whatever the
+    branch holds on the server by now.
+    """
+
+    def __init__(self, cache, status, root='files', journal_path=os.path.join(CACHE_DIR, 'pull_journal.json'),
+                 workers=PULL_WORKERS, base_path=BASE_PATH):
+        self.cache = cache
+        self.status = status
+        self.root = root
+        self.journal_path = journal_path
+        self.workers = workers
+        self.base_path = base_path
+        self.base_entry = self.load_base()
+
+    def load_base(self):
+        try:
+            with open(self.base_path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return None
+
+    def base(self, paths=None):
+        """
+        Return (tree, manifest) of what the working tree was last pulled or pushed at, or None.
+
+        One base serves every branch: the server accepts a push only while
+        the branch's tip is still the base tree. A base recorded for other
+        sparse paths does not count, since its manifest covers other files.
+        """
+        entry = self.base_entry
+        if entry is None or entry['paths'] != str(paths or ''):
+            return None
+        return entry['tree'], entry['manifest']
+
+    def record_base(self, branch, paths, tree, manifest):
+        """Remember that the working tree now matches a branch's tree and manifest."""
+        entry = {'branch': branch, 'paths': str(paths or ''), 'tree': tree, 'manifest': manifest}
+        os.makedirs(os.path.dirname(self.base_path) or '.', exist_ok=True)
+        tmp_path = self.base_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(entry, f)
+        os.replace(tmp_path, self.base_path)
+        self.base_entry = entry
+
+    def plan(self, manifest, progress=None):
+        """Return (names to write, names to delete) to turn the tree into manifest."""
+        local = self.status.scan(progress)
+        writes = sorted(name for name, file_hash in manifest.items() if local.get(name) != file_hash)
+        deletes = sorted(name for name in local if name not in manifest)
+        return writes, deletes
+
+    def pull(self, api, manifest, progress=None, cancelled=None, base=None):
+        """
+        Update the tree to the manifest and return (written, deleted) counts.
+
+        progress(done, total, name) is called as files are staged; if
+        cancelled() becomes true before the commit point the tree is left as
+        it was. base is the (branch, paths, tree) the manifest belongs to,
+        recorded as the working tree's base once the tree matches it.
+        """
+        self.recover()
+        os.makedirs(self.root, exist_ok=True)
+        writes, deletes = self.plan(manifest)
+        if not writes and not deletes:
+            if base is not None:
+                self.record_base(*base, manifest)
+            return 0, 0
+
+        # Staging inside the tree keeps the final renames on one filesystem
+        staging = tempfile.mkdtemp(dir=self.root, prefix='.pull-')
+        try:
+            staged = self.stage(api, manifest, writes, staging, progress, cancelled)
+            if cancelled and cancelled():
+                raise InterruptedError("Pull cancelled.")
+            self.write_journal({'staging': staging, 'writes': staged, 'deletes': deletes,
+                                'base': list(base) + [manifest] if base is not None else None})
+        except BaseException:
+            shutil.rmtree(staging, ignore_errors=True)
+            raise
+
+        # Commit point: from here the journal finishes the pull even after a crash
+        self.apply()
+        for name in writes:
+            self.status.record(name, manifest[name])
+        for name in deletes:
+            self.status.forget(name)
+        self.status.save()
+        return len(writes), len(deletes)
+
+    def stage(self, api, manifest, writes, staging, progress=None, cancelled=None):
+        """Download and write every changed file into the staging directory in parallel."""
+        def write(name):
+            if cancelled and cancelled():
+                raise InterruptedError("Pull cancelled.")
+            data = self.cache.fetch(api, manifest[name])
+            staged_path = os.path.join(staging, name)
+            os.makedirs(os.path.dirname(staged_path), exist_ok=True)
+            with open(staged_path, 'wb') as f:
+                f.write(data)
+                f.flush()
+                os.fsync(f.fileno())
+            return [staged_path, name]
+
+        staged = []
+        with ThreadPoolExecutor(max_workers=self.workers) as pool:
+            for done, entry in enumerate(pool.map(write, writes), 1):
+                staged.append(entry)
+                if progress:
+                    progress(done, len(writes), entry[1])
+        return staged
+
+    def write_journal(self, journal):
+        os.makedirs(os.path.dirname(self.journal_path) or '.', exist_ok=True)
+        tmp_path = self.journal_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            json.dump(journal, f)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, self.journal_path)
+
+    def apply(self):
+        """Apply the journaled renames and deletions; safe to repeat after an interruption."""
+        try:
+            with open(self.journal_path, 'r') as f:
+                journal = json.load(f)
+        except FileNotFoundError:
+            return False
+
+        for staged_path, name in journal['writes']:
+            # Already renamed if an earlier attempt got this far
+            if os.path.exists(staged_path):
+                target_path = os.path.join(self.root, name)
+                os.makedirs(os.path.dirname(target_path), exist_ok=True)
+                os.replace(staged_path, target_path)
+        for name in journal['deletes']:
+            try:
+                os.remove(os.path.join(self.root, name))
+            except FileNotFoundError:
+                pass
+        if journal.get('base'):
+            self.record_base(*journal['base'])
+        shutil.rmtree(journal['staging'], ignore_errors=True)
+        os.remove(self.journal_path)
+        return True
+
+    def recover(self):
+        """Finish a pull that was interrupted after its commit point, and drop stale staging."""
+        self.apply()
+        if os.path.isdir(self.root):
+            for name in os.listdir(self.root):
+                if name.startswith('.pull-'):
+                    shutil.rmtree(os.path.join(self.root, name), ignore_errors=True)
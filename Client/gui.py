@@ -3,13 +3,27 @@ from PyQt6.QtWidgets import (QApplication, QMainWindow, QWidget, QVBoxLayout,
                            QHBoxLayout, QPushButton, QLineEdit, QTextEdit, 
                            QLabel, QComboBox, QFileDialog, QMessageBox, 
                            QListWidget, QTabWidget, QSplitter, QGroupBox,
-                           QDialog, QListWidgetItem, QSizePolicy)
-from PyQt6.QtCore import Qt, QThread, pyqtSignal
+                           QDialog, QListWidgetItem, QSizePolicy, QProgressBar)
+from PyQt6.QtCore import Qt, QThread, QTimer, pyqtSignal
 from PyQt6.QtGui import QFont, QPalette, QColor
 import os
-import requests
+import time
 import re
-import difflib
+
+# The diff engine lives at the repository root, next to the server modules
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+from diff_engine import DiffEngine, is_binary
+from chunking import CHUNK_THRESHOLD, build_manifest
+from worker import ApiClient, TaskRunner
+from object_cache import ObjectCache
+from status import StatusEngine
+from checkout import Checkout, load_sparse, save_sparse
+from sparse import PathFilter
+
+# Seconds a request for branch events waits on the server, and milliseconds
+# before reconnecting when the server cannot be reached
+EVENTS_POLL_TIMEOUT = 25
+EVENTS_RETRY_MS = 5000
 
 class GitClientGUI(QMainWindow):
 
@@ -18,6 +32,27 @@ class GitClientGUI(QMainWindow):
         self.setWindowTitle("Modern Git Client")
         self.setMinimumSize(900, 600)
         self.resize(1200, 1000)
+
+        # All server calls run on a thread pool over one keep-alive session
+        self.api = ApiClient(SERVER_URL)
+        self.tasks = TaskRunner()
+        self.named_tasks = {}
+
+        # File versions by hash, so reopening files or branches skips the download
+        self.cache = ObjectCache()
+
+        # Local changes against the branch tip, hashing only files whose stat data changed
+        # A sparse checkout only pulls, lists and compares the paths it selects
+        self.sparse_paths = load_sparse()
+        self.status = StatusEngine('files', include=self.sparse_paths)
+
+        # Pulls stage files and apply them in one journaled step; finish any interrupted one
+        self.checkout = Checkout(self.cache, self.status, 'files')
+        self.checkout.recover()
+
+        # Branch changes arrive as events instead of being polled for
+        self.events_cursor = None
+        self.events_connected = False
         
         # Set the style
         self.setStyleSheet("""
@@ -103,11 +138,16 @@ class GitClientGUI(QMainWindow):
         self.new_branch_input.setPlaceholderText("New branch name")
         create_branch_btn = QPushButton("Create Branch")
         create_branch_btn.clicked.connect(self.create_branch)
+        self.sparse_input = QLineEdit(str(self.sparse_paths))
+        self.sparse_input.setPlaceholderText("All paths (or e.g. src/, docs/*.md)")
+        self.sparse_input.editingFinished.connect(self.set_sparse_paths)
         
         branch_layout.addWidget(QLabel("Current Branch:"))
         branch_layout.addWidget(self.branch_combo)
         branch_layout.addWidget(self.new_branch_input)
         branch_layout.addWidget(create_branch_btn)
+        branch_layout.addWidget(QLabel("Paths:"))
+        branch_layout.addWidget(self.sparse_input)
         branch_layout.addStretch()
         repo_layout.addLayout(branch_layout)
 
@@ -120,6 +160,9 @@ class GitClientGUI(QMainWindow):
         file_layout.addWidget(QLabel("Files:"))
         self.file_list = QListWidget()
         file_layout.addWidget(self.file_list)
+        file_layout.addWidget(QLabel("Local Changes:"))
+        self.status_list = QListWidget()
+        file_layout.addWidget(self.status_list)
         
         # File content
         content_widget = QWidget()
@@ -239,8 +282,19 @@ class GitClientGUI(QMainWindow):
         tab_widget.addTab(repo_tab, "Repository")
         tab_widget.addTab(merge_tab, "Merge")
 
+        # Progress of the running push or pull, hidden while idle
+        self.progress_bar = QProgressBar()
+        self.progress_bar.setMaximumWidth(240)
+        self.cancel_transfer_btn = QPushButton("Cancel")
+        self.cancel_transfer_btn.clicked.connect(self.cancel_transfer)
+        self.statusBar().addPermanentWidget(self.progress_bar)
+        self.statusBar().addPermanentWidget(self.cancel_transfer_btn)
+        self.progress_bar.hide()
+        self.cancel_transfer_btn.hide()
+
         # Initialize data
         self.refresh_repo()
+        self.watch_events()
         self.file_list.itemClicked.connect(self.show_file_content)
         
         # Connect branch selection change events
@@ -255,56 +309,126 @@ class GitClientGUI(QMainWindow):
         return text
 
     def refresh_repo(self):
-        try:
-            response = requests.get(f"{SERVER_URL}/clone")
-            if response.status_code == 200:
-                branches = response.json()
-                self.branch_combo.clear()
-                self.source_branch_combo.clear()
-                self.target_branch_combo.clear()
-                
-                for branch in branches.keys():
-                    self.branch_combo.addItem(branch)
-                    self.source_branch_combo.addItem(branch)
-                    self.target_branch_combo.addItem(branch)
-                
-                self.refresh_files()
-            else:
-                self.show_error("Failed to refresh repository")
-        except Exception as e:
-            self.show_error(f"Error refreshing repository: {str(e)}")
+        # Only the branch names are shown, so one commit per branch is enough
+        def fetch(task):
+            return self.api.json('GET', "/clone", params={'depth': 1})
+
+        self.tasks.start(fetch, on_result=self.show_branches,
+                         on_error=lambda message: self.show_error(f"Error refreshing repository: {message}"))
+
+    def watch_events(self):
+        """Long-poll the server for branch changes, one open request at a time."""
+        def fetch(task):
+            return self.api.json('GET', "/events", params={'after': self.events_cursor, 'timeout': EVENTS_POLL_TIMEOUT},
+                                 timeout=EVENTS_POLL_TIMEOUT + 10)
+
+        def failed(message):
+            self.events_connected = False
+            print(f"Event stream unavailable, retrying: {message}")
+            QTimer.singleShot(EVENTS_RETRY_MS, self.watch_events)
+
+        self.replace_task('events', fetch, on_result=self.apply_events, on_error=failed)
+
+    def apply_events(self, result):
+        """Update only what the announced branch changes touch, then wait for the next ones."""
+        self.events_cursor = result['cursor']
+        self.events_connected = True
+        if result['reset']:
+            # Events were missed, e.g. the server restarted
+            self.refresh_repo()
+        for event in result['events']:
+            if event['type'] != 'ref':
+                continue
+            branch = event['branch']
+            if self.branch_combo.findText(branch) < 0:
+                for combo in (self.branch_combo, self.source_branch_combo, self.target_branch_combo):
+                    combo.addItem(branch)
+            if branch == self.branch_combo.currentText():
+                paths = (event['changed'] or []) + (event['deleted'] or [])
+                # The event lists every path unless there were too many to send
+                if event['changed'] is None or any(self.sparse_paths.matches(path) for path in paths):
+                    self.refresh_files()
+            if branch in (self.source_branch_combo.currentText(), self.target_branch_combo.currentText()):
+                self.update_branch_info()
+        self.watch_events()
+
+    def show_branches(self, branches):
+        self.branch_combo.clear()
+        self.source_branch_combo.clear()
+        self.target_branch_combo.clear()
+
+        for branch in branches.keys():
+            self.branch_combo.addItem(branch)
+            self.source_branch_combo.addItem(branch)
+            self.target_branch_combo.addItem(branch)
+
+        self.refresh_files()
+
+    def set_sparse_paths(self):
+        """Change the paths of the sparse checkout; files outside the new set are left on disk untouched."""
+        paths = PathFilter.parse(self.sparse_input.text())
+        if paths.patterns == self.sparse_paths.patterns:
+            return
+        save_sparse(paths)
+        self.sparse_paths = paths
+        self.status.include = paths
+        self.refresh_files()
 
     def refresh_files(self):
         current_branch = self.branch_combo.currentText()
         if not current_branch:
             return
 
-        try:
-            response = requests.get(f"{SERVER_URL}/pull/{current_branch}")
-            if response.status_code == 200:
-                files = response.json()
-                self.file_list.clear()
-                for filename in files.keys():
-                    self.file_list.addItem(filename)
-            else:
-                self.show_error("Failed to fetch files")
-        except Exception as e:
-            self.show_error(f"Error fetching files: {str(e)}")
+        # Only the path -> hash manifest is needed to list the files and local changes
+        def fetch(task):
+            manifest = self.cache.fetch_manifest(self.api, current_branch, self.sparse_paths)
+            task.check_cancelled()
+            # Local changes are those since the last pull, as a push would send them
+            _, base_manifest = self.checkout.base(self.sparse_paths) or (None, {})
+            return manifest, self.status.status(base_manifest)
+
+        def show(result):
+            manifest, status = result
+            self.file_list.clear()
+            for filename in manifest.keys():
+                self.file_list.addItem(filename)
+            self.show_status(status)
+
+        # A newer listing makes any older one still in flight irrelevant
+        self.replace_task('files', fetch, on_result=show,
+                          on_error=lambda message: self.show_error(f"Error fetching files: {message}"))
+
+    def show_status(self, status):
+        self.status_list.clear()
+        for label, key, color in (("Added", 'added', "green"), ("Modified", 'modified', "#ffc107"),
+                                  ("Deleted", 'deleted', "red")):
+            for filename in status[key]:
+                item = QListWidgetItem(f"{label}: {filename}")
+                item.setForeground(QColor(color))
+                self.status_list.addItem(item)
+        if not self.status_list.count():
+            self.status_list.addItem("No local changes")
 
     def show_file_content(self, item):
         current_branch = self.branch_combo.currentText()
         filename = item.text()
-        
-        try:
-            response = requests.get(f"{SERVER_URL}/pull/{current_branch}")
-            if response.status_code == 200:
-                files = response.json()
-                if filename in files:
-                    self.content_edit.setText(files[filename])
-            else:
-                self.show_error("Failed to fetch file content")
-        except Exception as e:
-            self.show_error(f"Error fetching file content: {str(e)}")
+
+        # The manifest is revalidated by ETag and the content comes from the
+        # cache when it was seen before, so a repeat view transfers no content
+        def fetch(task):
+            manifest = self.cache.fetch_manifest(self.api, current_branch, self.sparse_paths)
+            file_hash = manifest.get(filename)
+            if file_hash is None:
+                return None
+            task.check_cancelled()
+            return self.cache.read_text(self.api, file_hash)
+
+        def show(content):
+            if content is not None:
+                self.content_edit.setText(content)
+
+        self.replace_task('content', fetch, on_result=show,
+                          on_error=lambda message: self.show_error(f"Error fetching file content: {message}"))
 
     def create_branch(self):
         branch_name = self.new_branch_input.text().strip()
@@ -312,17 +436,55 @@ class GitClientGUI(QMainWindow):
             self.show_error("Please enter a branch name")
             return
 
-        try:
-            response = requests.post(f"{SERVER_URL}/create_branch", 
-                                  json={'branch_name': branch_name})
-            if response.status_code == 200:
-                self.show_message("Success", f"Branch '{branch_name}' created successfully")
+        def send(task):
+            return self.api.json('POST', "/create_branch", json={'branch_name': branch_name})
+
+        def done(result):
+            self.show_message("Success", f"Branch '{branch_name}' created successfully")
+            # The new branch is announced as an event when the server sends them
+            if not self.events_connected:
                 self.refresh_repo()
-                self.new_branch_input.clear()
-            else:
-                self.show_error("Failed to create branch")
-        except Exception as e:
-            self.show_error(f"Error creating branch: {str(e)}")
+            self.new_branch_input.clear()
+
+        self.tasks.start(send, on_result=done,
+                         on_error=lambda message: self.show_error(f"Error creating branch: {message}"))
+
+    def replace_task(self, name, fn, *args, **callbacks):
+        """Start a task under a name, cancelling the previous task with that name."""
+        previous = self.named_tasks.get(name)
+        if previous is not None:
+            previous.cancel()
+        self.named_tasks[name] = self.tasks.start(fn, *args, **callbacks)
+        return self.named_tasks[name]
+
+    def start_transfer(self, label, fn, *args, on_result, on_error):
+        """Run a long push or pull with progress shown in the status bar."""
+        if self.named_tasks.get('transfer') in self.tasks.active:
+            self.show_error("Another push or pull is still running")
+            return
+
+        def progress(done, total, message):
+            self.progress_bar.setMaximum(max(total, 1))
+            self.progress_bar.setValue(done)
+            self.statusBar().showMessage(f"{label}: {message}")
+
+        def finished():
+            self.progress_bar.hide()
+            self.cancel_transfer_btn.hide()
+            self.statusBar().clearMessage()
+
+        self.progress_bar.setValue(0)
+        self.progress_bar.show()
+        self.cancel_transfer_btn.show()
+        self.statusBar().showMessage(f"{label}...")
+        self.replace_task('transfer', fn, *args, on_result=on_result, on_error=on_error,
+                          on_progress=progress, on_finished=finished)
+
+    def cancel_transfer(self):
+        task = self.named_tasks.get('transfer')
+        if task is not None:
+            task.cancel()
+            self.statusBar().showMessage("Cancelling...")
 
     def pull_changes(self):
         current_branch = self.branch_combo.currentText()
@@ -330,56 +492,32 @@ class GitClientGUI(QMainWindow):
             self.show_error("Please select a branch")
             return
 
-        try:
-            response = requests.get(f"{SERVER_URL}/pull/{current_branch}")
-            if response.status_code == 200:
-                files = response.json()
-                if not files:
-                    print(f"No files found for branch '{current_branch}'.")
-                    return
-
-                # Ensure 'files' folder exists
-                target_dir = 'files'
-                os.makedirs(target_dir, exist_ok=True)
-
-                # Get the current set of files in the 'files' directory
-                local_files = set(os.listdir(target_dir))
-
-                # Set of files pulled from the server (branch snapshot)
-                pulled_files = set(files.keys())
-
-                # Remove files that exist locally but are not present in the pulled branch
-                for filename in local_files - pulled_files:
-                    file_path = os.path.join(target_dir, filename)
-                    os.remove(file_path)
-                    print(f"Removed '{filename}' (not in branch '{current_branch}').")
-
-                # Process and update pulled files
-                for filename in pulled_files:
-                    file_path = os.path.join(target_dir, filename)
-                    new_content = files[filename]
-
-                    # Only write file if content has changed (to minimize file writes)
-                    if os.path.exists(file_path):
-                        with open(file_path, 'r') as f:
-                            current_content = f.read()
-                        if current_content == new_content:
-                            print(f"'{filename}' is up-to-date.")
-                            continue
-
-                    # Write updated/new content
-                    with open(file_path, 'w') as f:
-                        f.write(new_content)
-                    print(f"Updated/created '{filename}' with content from branch '{current_branch}'.")
+        def done(pulled):
+            if pulled:
                 self.show_message("Success", "Changes pulled successfully")
                 self.refresh_files()
-            else:
-                self.show_error("Failed to pull changes")
-        except Exception as e:
-            self.show_error(f"Error pulling changes: {str(e)}")
+
+        self.start_transfer("Pulling", self.pull_files, current_branch, on_result=done,
+                            on_error=lambda message: self.show_error(f"Error pulling changes: {message}"))
+
+    def pull_files(self, task, current_branch):
+        """Worker body for pull_changes; returns False when the branch has no files."""
+        tree, manifest = self.cache.fetch_tip(self.api, current_branch, self.sparse_paths)
+        if not manifest:
+            print(f"No files found for branch '{current_branch}'.")
+            # Nothing to write, but pushes now start from this tree
+            self.checkout.record_base(current_branch, self.sparse_paths, tree, manifest)
+            return False
+
+        # Only files whose hash differs are downloaded and written
+        written, deleted = self.checkout.pull(self.api, manifest,
+                                              progress=lambda done, total, name: task.report(done, total, name),
+                                              cancelled=lambda: task.cancelled,
+                                              base=(current_branch, str(self.sparse_paths), tree))
+        print(f"Pulled branch '{current_branch}': {written} file(s) written, {deleted} removed.")
+        return True
 
     def push_changes(self):
-        url = f"{SERVER_URL}/push"
         branch = self.branch_combo.currentText()
         if not branch:
             self.show_error("Please select a branch")
@@ -388,53 +526,115 @@ class GitClientGUI(QMainWindow):
             print("No 'files' directory found. Please create it and add files to push.")
             return
 
-        # Iterate through all files in the 'files' directory
-        for filename in os.listdir('files'):
-            file_path = os.path.join('files', filename)
-            # Skip if it's not a file
-            if not os.path.isfile(file_path):
-                continue
-            
-            # Read the content of the file
-            with open(file_path, 'r') as f:
-                content = f.read()
-            
-            # Prepare data to push
-            data = {'filename': filename, 'content': content, 'branch': branch}
-            
-            # Send POST request to push changes
-            response = requests.post(url, json=data)
-            
-        if response.status_code == 200:
+        def done(pushed):
+            if pushed:
                 self.show_message("Success", "Changes pushed successfully")
                 self.refresh_files()
-        else:
-            self.show_error("Failed to push changes")
+            else:
+                self.show_message("Push", "Nothing to push")
+
+        self.start_transfer("Pushing", self.push_files, branch, on_result=done,
+                            on_error=lambda message: self.show_error(f"Failed to push changes: {message}"))
+
+    def push_files(self, task, branch):
+        """
+        Worker body for push_changes; uploads only changed files as one commit and returns their count.
+
+        Changes are taken against the checkout's base, the tree last pulled or
+        pushed, and the server refuses the push unless the branch is still at
+        that tree. Without a base every file counts as added, which only an
+        empty branch accepts.
+        """
+        base_tree, base_manifest = self.checkout.base(self.sparse_paths) or ('empty', {})
+        status = self.status.status(base_manifest,
+                                    progress=lambda done, total, name: task.report(done, total, f"checking {name}"))
+        changed = status['added'] + status['modified']
+        if not changed and not status['deleted']:
+            return 0
+
+        objects = {}
+        chunked = {}
+        for done, filename in enumerate(changed):
+            task.report(done, len(changed), filename)
+            file_path = os.path.join('files', filename)
+
+            # Large files only upload the chunks the server is missing
+            if os.path.getsize(file_path) >= CHUNK_THRESHOLD:
+                file_hash, chunk_manifest = self.upload_chunked_file(task, file_path)
+                chunked[filename] = {'hash': file_hash, 'manifest': chunk_manifest}
+                continue
+
+            # Cached by the status scan above unless the file changed since
+            objects[filename] = self.status.hash_file(filename)
+
+        # Other files are streamed byte for byte, skipping content the server already has
+        missing = set(self.api.json('POST', "/objects/missing", json={'hashes': list(objects.values())})
+                      .get('missing', [])) if objects else set()
+        for filename, file_hash in objects.items():
+            task.check_cancelled()
+            if file_hash not in missing:
+                continue
+            task.report(len(changed), len(changed), f"uploading {filename}")
+            with open(os.path.join('files', filename), 'rb') as f:
+                self.api.json('PUT', f"/objects/{file_hash}", data=f)
+            missing.discard(file_hash)
+
+        # Every change, deletions included, lands in a single commit
+        task.report(len(changed), len(changed), "committing")
+        data = {'branch': branch, 'objects': objects, 'chunked': chunked, 'deleted': status['deleted'],
+                'base': base_tree}
+        result = self.api.json('POST', "/push", json=data)
+
+        # The commit went on top of the base, so base plus these changes is the new base
+        pushed = dict(base_manifest)
+        pushed.update(objects)
+        pushed.update((filename, entry['hash']) for filename, entry in chunked.items())
+        for filename in status['deleted']:
+            pushed.pop(filename, None)
+        self.checkout.record_base(branch, self.sparse_paths, result['tree'], pushed)
+        return len(changed) + len(status['deleted'])
+
+    def upload_chunked_file(self, task, file_path):
+        """Upload the chunks of a large file the server is missing; returns (file_hash, manifest)."""
+        with open(file_path, 'rb') as f:
+            file_hash, manifest = build_manifest(f)
+
+        hashes = [chunk_hash for chunk_hash, _ in manifest['chunks']]
+        missing = set(self.api.json('POST', "/objects/missing", json={'hashes': hashes}).get('missing', []))
+
+        # The manifest's chunk lengths give the boundaries; only missing chunks are read again
+        offset = 0
+        with open(file_path, 'rb') as f:
+            for chunk_hash, length in manifest['chunks']:
+                task.check_cancelled()
+                if chunk_hash in missing:
+                    f.seek(offset)
+                    self.api.json('PUT', f"/objects/{chunk_hash}", data=f.read(length))
+                    missing.discard(chunk_hash)
+                offset += length
+        return file_hash, manifest
 
     def update_branch_info(self):
         """Update the information displayed for selected branches"""
         source_branch = self.source_branch_combo.currentText()
         target_branch = self.target_branch_combo.currentText()
-        
-        if source_branch:
-            try:
-                response = requests.get(f"{SERVER_URL}/pull/{source_branch}")
-                if response.status_code == 200:
-                    files = response.json()
-                    self.source_info.setText(f"Branch: {source_branch}\n"
-                                          f"Number of files: {len(files)}")
-            except Exception:
-                self.source_info.setText("Unable to fetch branch information")
-
-        if target_branch:
-            try:
-                response = requests.get(f"{SERVER_URL}/pull/{target_branch}")
-                if response.status_code == 200:
-                    files = response.json()
-                    self.target_info.setText(f"Branch: {target_branch}\n"
-                                          f"Number of files: {len(files)}")
-            except Exception:
-                self.target_info.setText("Unable to fetch branch information")
+
+        # The two branches are fetched concurrently, each replacing its own stale request
+        for side, branch, info in (('source', source_branch, self.source_info),
+                                   ('target', target_branch, self.target_info)):
+            if not branch:
+                continue
+
+            def fetch(task, branch=branch):
+                return self.api.json('GET', f"/branch_info/{branch}")
+
+            def show(result, info=info):
+                info.setText(f"Branch: {result['branch']}\n"
+                             f"Number of files: {result['files']}\n"
+                             f"Number of commits: {result['commits']}")
+
+            self.replace_task(f'{side}_info', fetch, on_result=show,
+                              on_error=lambda message, info=info: info.setText("Unable to fetch branch information"))
 
     def compare_branches(self):
         """Compare the selected source and target branches"""
@@ -445,50 +645,40 @@ class GitClientGUI(QMainWindow):
             self.show_error("Source and target branches must be different")
             return
 
-        try:
-            # Get files from both branches
-            source_response = requests.get(f"{SERVER_URL}/pull/{source_branch}")
-            target_response = requests.get(f"{SERVER_URL}/pull/{target_branch}")
-            
-            if source_response.status_code == 200 and target_response.status_code == 200:
-                source_files = source_response.json()
-                target_files = target_response.json()
-                
-                self.changes_list.clear()
-                conflicts = []
-                
-                # Compare files
-                all_files = set(source_files.keys()) | set(target_files.keys())
-                
-                for file in all_files:
-                    if file in source_files and file in target_files:
-                        if source_files[file] != target_files[file]:
-                            self.changes_list.addItem(f"Modified: {file}")
-                            conflicts.append([file, source_files[file],target_files[file]])
-                    elif file in source_files:
-                        self.changes_list.addItem(f"Added in source: {file}")
-                    else:
-                        self.changes_list.addItem(f"Added in target: {file}")
-                
-                # Update conflict label
-                if conflicts:
-                    self.conflict_label.setText(f"⚠️ Warning: {len(conflicts)} potential conflict(s) detected")
-                    self.show_conflict_panel(conflicts, source_branch, target_branch)
-                else:
-                    self.conflict_label.setText("✓ No conflicts detected")
-                
-                # Show summary
-                self.changes_list.addItem("")
-                self.changes_list.addItem("Summary:")
-                self.changes_list.addItem(f"Total changes: {len(all_files)}")
-                self.changes_list.addItem(f"Potential conflicts: {len(conflicts)}")
-            else:
-                self.show_error("Failed to compare branches")
-        except Exception as e:
-            self.show_error(f"Error comparing branches: {str(e)}")
+        # The server compares the snapshots by hash, so no file content is downloaded
+        def fetch(task):
+            return self.api.json('GET', f"/compare/{source_branch}/{target_branch}")
+
+        self.replace_task('compare', fetch, on_result=self.show_comparison,
+                          on_error=lambda message: self.show_error(f"Error comparing branches: {message}"))
+
+    def show_comparison(self, result):
+        self.changes_list.clear()
+        conflicts = result['modified']
+
+        for file in conflicts:
+            self.changes_list.addItem(f"Modified: {file}")
+        for file in result['source_only']:
+            self.changes_list.addItem(f"Added in source: {file}")
+        for file in result['target_only']:
+            self.changes_list.addItem(f"Added in target: {file}")
+
+        # Update conflict label
+        if conflicts:
+            self.conflict_label.setText(f"⚠️ Warning: {len(conflicts)} potential conflict(s) detected")
+            self.show_conflict_panel(conflicts, result['source_branch'], result['target_branch'])
+        else:
+            self.conflict_label.setText("✓ No conflicts detected")
+
+        # Show summary
+        counts = result['counts']
+        self.changes_list.addItem("")
+        self.changes_list.addItem("Summary:")
+        self.changes_list.addItem(f"Total changes: {counts['modified'] + counts['source_only'] + counts['target_only']}")
+        self.changes_list.addItem(f"Potential conflicts: {len(conflicts)}")
 
     def show_conflict_panel(self, conflicts, source_branch, target_branch):
-        """Display a panel with line-by-line conflict details."""
+        """Display a panel with line-by-line conflict details, loading each file when its tab is opened."""
         dialog = QDialog(self)
         dialog.setWindowTitle("Conflict Details")
         dialog.resize(1000, 800)
@@ -499,11 +689,12 @@ class GitClientGUI(QMainWindow):
 
         tab_widget = QTabWidget()
 
-        for file in conflicts:
-            # Get file contents from both branches
-            source_content = file[1]
-            target_content = file[2]
+        # Suggestions load in the background while the dialog is open
+        suggestion_tasks = []
+        tab_lists = []
+        loaded = set()
 
+        for filename in conflicts:
             # Create a widget for the tab and set up a horizontal layout
             file_tab = QWidget()
             file_layout = QHBoxLayout(file_tab)
@@ -511,42 +702,8 @@ class GitClientGUI(QMainWindow):
             # Create two QListWidgets for displaying source and target contents side by side
             source_list = QListWidget()
             target_list = QListWidget()
-
-            # Set labels for each side
-            source_list.addItem(QListWidgetItem(f"Source ({source_branch}):"))
-            target_list.addItem(QListWidgetItem(f"Target ({target_branch}):"))
-
-            # Compare line-by-line and add lines to the respective lists
-            diff = difflib.ndiff(
-                source_content.splitlines(keepends=True),
-                target_content.splitlines(keepends=True)
-            )
-
-            added = []
-            removed = []
-            for line in diff:
-                # Process source (original) content
-                if line.startswith('-'):
-                    item = QListWidgetItem(line[1:].strip())
-                    item.setForeground(QColor("red"))  # Mark removed lines in red
-                    source_list.addItem(item)
-                    # Add empty item to target list to align rows
-                    target_list.addItem(QListWidgetItem(""))
-                    removed.append(line.strip())
-
-                # Process target (new) content
-                elif line.startswith('+'):
-                    item = QListWidgetItem(line[1:].strip())
-                    item.setForeground(QColor("green"))  # Mark added lines in green
-                    target_list.addItem(item)
-                    # Add empty item to source list to align rows
-                    source_list.addItem(QListWidgetItem(""))
-                    added.append(line.strip())
-
-                # Process unchanged lines (to align content)
-                elif line.startswith(' '):
-                    source_list.addItem(QListWidgetItem(line[1:].strip()))
-                    target_list.addItem(QListWidgetItem(line[1:].strip()))
+            source_list.addItem(QListWidgetItem("Loading..."))
+            tab_lists.append((filename, source_list, target_list))
 
             # Horizontal layout to display source and target lists side by side
             comparison_layout = QHBoxLayout()
@@ -556,36 +713,135 @@ class GitClientGUI(QMainWindow):
             # Add the comparison layout to the file tab layout
             file_layout.addLayout(comparison_layout)
 
-            # Generate the chatbot response for this specific file
-            chatbot_response = requests.post(f"{SERVER_URL}/chat", json={"conflicts":[source_content, target_content]})
-            if chatbot_response.status_code == 200:
-                # Extract the "message" field from the JSON response
-                response_data = chatbot_response.json()
-                message = response_data.get("message")
-            else:
-                # Handle error
-                error_data = chatbot_response.json()
-                print("Error:", error_data.get("error"))
-
             # Add a QTextEdit for the chatbot response specific to this file
             response_box = QTextEdit()
-            formatted_response = self.markdown_to_html(message)
-            response_box.setText(formatted_response)
             response_box.setReadOnly(True)  # Make the response box read-only
-            response_box.setPlaceholderText("Chatbot response based on the conflicts in this file...")
+            response_box.setPlaceholderText("Waiting for the chatbot response for this file...")
+
+            # The server extracts the conflicting hunks itself, so no content is uploaded
+            suggestion_tasks.append(self.tasks.start(
+                self.fetch_suggestion, source_branch, target_branch, filename,
+                on_result=lambda message, box=response_box: box.setText(self.markdown_to_html(message))))
 
             # Add the response box to the file layout below the comparison
             file_layout.addWidget(response_box)
 
             # Set the layout for the file tab and add it to the QTabWidget
             file_tab.setLayout(file_layout)
-            tab_widget.addTab(file_tab, file[0])
+            tab_widget.addTab(file_tab, filename)
+
+        def load_tab(index):
+            # Content is only downloaded for the files the user actually opens
+            if index < 0 or index in loaded:
+                return
+            loaded.add(index)
+            filename, source_list, target_list = tab_lists[index]
+
+            def fetch(task):
+                return self.api.json('GET', f"/compare/{source_branch}/{target_branch}",
+                                     params={'path': filename, 'content': 1})
+
+            def show(result):
+                entry = result.get('files', {}).get(filename, {})
+                self.fill_comparison(source_list, target_list, source_branch, target_branch,
+                                     entry.get('source') or '', entry.get('target') or '')
+
+            def fail(message):
+                loaded.discard(index)
+                source_list.clear()
+                source_list.addItem(QListWidgetItem(f"Unable to load file: {message}"))
+
+            suggestion_tasks.append(self.tasks.start(fetch, on_result=show, on_error=fail))
+
+        tab_widget.currentChanged.connect(load_tab)
+        load_tab(tab_widget.currentIndex())
 
         layout.addWidget(tab_widget)
 
         dialog.setLayout(layout)
+        # Closing the dialog stops requests whose results nobody will see
+        dialog.finished.connect(lambda result: [task.cancel() for task in suggestion_tasks])
         dialog.exec()
 
+    def fill_comparison(self, source_list, target_list, source_branch, target_branch, source_content, target_content):
+        """Fill two list widgets with an aligned side-by-side diff of a file."""
+        engine = DiffEngine()
+        source_list.clear()
+        target_list.clear()
+
+        # Set labels for each side
+        source_list.addItem(QListWidgetItem(f"Source ({source_branch}):"))
+        target_list.addItem(QListWidgetItem(f"Target ({target_branch}):"))
+
+        # Compare line-by-line and add lines to the respective lists
+        source_lines = source_content.splitlines(keepends=True)
+        target_lines = target_content.splitlines(keepends=True)
+        # The engine's own checks, so the view skips exactly what commits summarise
+        summary = None
+        if is_binary(source_content) or is_binary(target_content):
+            summary = "Binary file, no line diff available"
+        else:
+            skipped = (engine.oversized(len(source_content.encode()), len(target_content.encode()))
+                       or engine.too_many_lines(source_lines, target_lines))
+            if skipped:
+                summary = skipped[0]
+        if summary:
+            opcodes = []
+            source_list.addItem(QListWidgetItem(summary))
+        else:
+            opcodes = engine.opcodes(source_lines, target_lines)
+
+        for tag, i1, i2, j1, j2 in opcodes:
+            # Process unchanged lines (to align content)
+            if tag == 'equal':
+                for line in source_lines[i1:i2]:
+                    source_list.addItem(QListWidgetItem(line.strip()))
+                    target_list.addItem(QListWidgetItem(line.strip()))
+                continue
+
+            # Process source (original) content
+            for line in source_lines[i1:i2]:
+                item = QListWidgetItem(line.strip())
+                item.setForeground(QColor("red"))  # Mark removed lines in red
+                source_list.addItem(item)
+                # Add empty item to target list to align rows
+                target_list.addItem(QListWidgetItem(""))
+
+            # Process target (new) content
+            for line in target_lines[j1:j2]:
+                item = QListWidgetItem(line.strip())
+                item.setForeground(QColor("green"))  # Mark added lines in green
+                target_list.addItem(item)
+                # Add empty item to source list to align rows
+                source_list.addItem(QListWidgetItem(""))
+
+    def fetch_suggestion(self, task, source_branch, target_branch, filename):
+        """Worker body: queue a suggestion job for one file and wait for its message."""
+        try:
+            job = self.api.post("/chat", json={"source_branch": source_branch,
+                                               "target_branch": target_branch,
+                                               "filename": filename}).json()
+        except Exception as e:
+            job = {"status": "error", "error": str(e)}
+        return self.wait_for_suggestion(task, job)
+
+    def wait_for_suggestion(self, task, job, timeout=120):
+        """Long-poll a suggestion job until it finishes and return its message."""
+        deadline = time.monotonic() + timeout
+        while job.get("status") in ("queued", "running") and time.monotonic() < deadline:
+            task.check_cancelled()
+            try:
+                # The poll itself waits up to 20 seconds, so allow longer than that
+                response = self.api.get(f"/chat/{job['job_id']}", params={"wait": 20},
+                                        timeout=self.api.timeout + 20)
+                job = response.json()
+            except Exception as e:
+                job = {"status": "error", "error": str(e)}
+        if job.get("status") == "done":
+            return job.get("message", "")
+        print("Error:", job.get("error"))
+        return f"No suggestion available: {job.get('error', 'timed out')}"
+
     def cancel_merge(self):
         """Cancel the merge operation"""
         self.changes_list.clear()
@@ -593,76 +849,6 @@ class GitClientGUI(QMainWindow):
         self.source_info.clear()
         self.target_info.clear()
 
-    def refresh_repo(self):
-        try:
-            response = requests.get(f"{SERVER_URL}/clone")
-            if response.status_code == 200:
-                branches = response.json()
-                self.branch_combo.clear()
-                self.source_branch_combo.clear()
-                self.target_branch_combo.clear()
-                
-                for branch in branches.keys():
-                    self.branch_combo.addItem(branch)
-                    self.source_branch_combo.addItem(branch)
-                    self.target_branch_combo.addItem(branch)
-                
-                self.refresh_files()
-            else:
-                self.show_error("Failed to refresh repository")
-        except Exception as e:
-            self.show_error(f"Error refreshing repository: {str(e)}")
-
-    def refresh_files(self):
-        current_branch = self.branch_combo.currentText()
-        if not current_branch:
-            return
-
-        try:
-            response = requests.get(f"{SERVER_URL}/pull/{current_branch}")
-            if response.status_code == 200:
-                files = response.json()
-                self.file_list.clear()
-                for filename in files.keys():
-                    self.file_list.addItem(filename)
-            else:
-                self.show_error("Failed to fetch files")
-        except Exception as e:
-            self.show_error(f"Error fetching files: {str(e)}")
-
-    def show_file_content(self, item):
-        current_branch = self.branch_combo.currentText()
-        filename = item.text()
-        
-        try:
-            response = requests.get(f"{SERVER_URL}/pull/{current_branch}")
-            if response.status_code == 200:
-                files = response.json()
-                if filename in files:
-                    self.content_edit.setText(files[filename])
-            else:
-                self.show_error("Failed to fetch file content")
-        except Exception as e:
-            self.show_error(f"Error fetching file content: {str(e)}")
-
-    def create_branch(self):
-        branch_name = self.new_branch_input.text().strip()
-        if not branch_name:
-            self.show_error("Please enter a branch name")
-            return
-
-        try:
-            response = requests.post(f"{SERVER_URL}/create_branch", 
-                                  json={'branch_name': branch_name})
-            if response.status_code == 200:
-                self.show_message("Success", f"Branch '{branch_name}' created successfully")
-                self.refresh_repo()
-                self.new_branch_input.clear()
-            else:
-                self.show_error("Failed to create branch")
-        except Exception as e:
-            self.show_error(f"Error creating branch: {str(e)}")
-
     def merge_branches(self):
         """Merge the selected source branch into the target branch"""
         source_branch = self.source_branch_combo.currentText()
@@ -682,21 +868,23 @@ class GitClientGUI(QMainWindow):
         msg.setDefaultButton(QMessageBox.StandardButton.No)
 
         if msg.exec() == QMessageBox.StandardButton.Yes:
-            try:
-                data = {
-                    'source_branch': source_branch,
-                    'target_branch': target_branch
-                }
-                response = requests.post(f"{SERVER_URL}/merge", json=data)
-                if response.status_code == 200:
-                    self.show_message("Success", 
-                                    f"Successfully merged '{source_branch}' into '{target_branch}'")
+            data = {
+                'source_branch': source_branch,
+                'target_branch': target_branch
+            }
+
+            def send(task):
+                return self.api.json('POST', "/merge", json=data)
+
+            def done(result):
+                self.show_message("Success", 
+                                f"Successfully merged '{source_branch}' into '{target_branch}'")
+                if not self.events_connected:
                     self.refresh_repo()
-                    self.cancel_merge()  # Reset the merge UI
-                else:
-                    self.show_error("Merge failed")
-            except Exception as e:
-                self.show_error(f"Error during merge: {str(e)}")
+                self.cancel_merge()  # Reset the merge UI
+
+            self.tasks.start(send, on_result=done,
+                             on_error=lambda message: self.show_error(f"Error during merge: {message}"))
 
     # def merge_branches(self):
     #     """Merge the selected source branch into the target branch"""
@@ -778,6 +966,12 @@ class GitClientGUI(QMainWindow):
     #             print(traceback.format_exc())  # Print full stack trace
     #             self.show_error(f"Error during merge: {str(e)}")
 
+    def closeEvent(self, event):
+        # Stop background calls before the widgets they update go away
+        self.tasks.shutdown()
+        self.api.close()
+        super().closeEvent(event)
+
     def show_error(self, message):
         QMessageBox.critical(self, "Error", message)
 
@@ -0,0 +1,143 @@
+import os
+import hashlib
+import tempfile
+import threading
+from collections import OrderedDict
+
+# Local cache of file versions, next to the 'files' working directory.
+CACHE_DIR = '.vcs_cache'
+
+# Bytes of recently used objects kept in memory on top of the disk store.
+MEMORY_BYTES = 32 * 1024 * 1024
+
+# Objects larger than this are only kept on disk.
+MAX_MEMORY_OBJECT = 4 * 1024 * 1024
+
+
+class ObjectCache:
+    """
+    Content-addressed cache of file versions keyed by SHA-256.
+
+    Objects live on disk under <root>/objects/<aa>/<rest> with a byte-bounded
+    in-memory LRU in front. Since a hash names its content, a cached object
+    never goes stale; only the per-branch manifests of path -> hash need to
+    be revalidated, which the server answers with 304 when unchanged.
+    """
+
+    def __init__(self, root=CACHE_DIR, memory_bytes=MEMORY_BYTES):
+        self.root = root
+        self.objects_path = os.path.join(root, 'objects')
+        self.memory_bytes = memory_bytes
+        self.memory = OrderedDict()
+        self.memory_used = 0
+        self.manifests = {}
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        os.makedirs(self.objects_path, exist_ok=True)
+
+    def object_path(self, file_hash):
+        return os.path.join(self.objects_path, file_hash[:2], file_hash[2:])
+
+    def get(self, file_hash):
+        """Return cached content, or None if the object is not cached."""
+        with self.lock:
+            data = self.memory.get(file_hash)
+            if data is not None:
+                self.memory.move_to_end(file_hash)
+                self.hits += 1
+                return data
+        try:
+            with open(self.object_path(file_hash), 'rb') as f:
+                data = f.read()
+        except FileNotFoundError:
+            with self.lock:
+                self.misses += 1
+            return None
+        with self.lock:
+            self.hits += 1
+            self.remember(file_hash, data)
+        return data
+
+    def put(self, file_hash, data):
+        """Store content under its hash, refusing content that does not match."""
+        if hashlib.sha256(data).hexdigest() != file_hash:
+            raise ValueError(f"Content does not match object hash {file_hash}.")
+        path = self.object_path(file_hash)
+        if not os.path.exists(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            # Write beside the target and rename, so readers never see a partial object
+            fd, tmp_path = tempfile.mkstemp(dir=os.path.dirname(path), prefix='.tmp-')
+            try:
+                with os.fdopen(fd, 'wb') as f:
+                    f.write(data)
+                os.replace(tmp_path, path)
+            except BaseException:
+                os.unlink(tmp_path)
+                raise
+        with self.lock:
+            self.remember(file_hash, data)
+
+    def remember(self, file_hash, data):
+        """Add an object to the memory LRU; the caller holds the lock."""
+        if len(data) > MAX_MEMORY_OBJECT or file_hash in self.memory:
+            return
+        self.memory[file_hash] = data
+        self.memory_used += len(data)
+        while self.memory_used > self.memory_bytes:
+            _, evicted = self.memory.popitem(last=False)
+            self.memory_used -= len(evicted)
+
+    def fetch(self, api, file_hash):
+        """Return an object's content, downloading it from the server only on a cache miss."""
+        data = self.get(file_hash)
+        if data is not None:
+            return data
+        response = api.get(f"/objects/{file_hash}")
+        if response.status_code != 200:
+            raise ValueError(f"Object {file_hash} could not be downloaded ({response.status_code}).")
+        data = response.content
+        self.put(file_hash, data)
+        return data
+
+    def fetch_manifest(self, api, branch, paths=None):
+        """Return the path -> hash manifest of a branch (see fetch_tip)."""
+        return self.fetch_tip(api, branch, paths)[1]
+
+    def fetch_tip(self, api, branch, paths=None):
+        """
+        Return (tree, manifest): a branch's root tree hash and its path -> hash manifest.
+
+        The tree is the manifest's ETag ('empty' for a branch without commits),
+        so the cached copy is revalidated by it and when one exists only the
+        changes since that tree are downloaded and applied to it. paths (a
+        sparse.PathFilter) limits the manifest to a sparse checkout.
+        """
+        key = (branch, str(paths or ''))
+        with self.lock:
+            cached = self.manifests.get(key)
+        headers = {'If-None-Match': f'"{cached[0]}"'} if cached else {}
+        params = {'since': cached[0]} if cached else {}
+        if paths:
+            params['paths'] = str(paths)
+        response = api.get(f"/manifest/{branch}", params=params, headers=headers)
+        if response.status_code == 304 and cached:
+            return cached
+        if response.status_code != 200:
+            raise ValueError(f"Manifest of branch '{branch}' could not be fetched ({response.status_code}).")
+        manifest = response.json()
+        if cached and response.headers.get('X-Manifest-Delta') == cached[0]:
+            delta = manifest
+            manifest = dict(cached[1])
+            manifest.update(delta['changed'])
+            for name in delta['deleted']:
+                manifest.pop(name, None)
+        etag = response.headers.get('ETag', '').strip('"')
+        if etag:
+            with self.lock:
+                self.manifests[key] = (etag, manifest)
+        return etag or None, manifest
+
+    def read_text(self, api, file_hash):
+        """Return an object decoded as text the way the server reads files."""
+        return self.fetch(api, file_hash).decode('utf-8', errors='replace').replace('\r\n', '\n')
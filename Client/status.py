@@ -0,0 +1,134 @@
+import os
+import json
+import time
+import hashlib
+import threading
+from object_cache import CACHE_DIR
+from sparse import PathFilter
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+# Files modified this recently are not cached, because another write within
+# the filesystem's timestamp granularity would leave their stat data unchanged.
+RACY_WINDOW = 2.0
+
+
+class StatusEngine:
+    """
+    Compare the local working tree with a branch manifest of path -> hash.
+
+    File hashes are cached by (size, mtime, inode), so a file is only read
+    again after it changes. The cache is kept in the client cache directory.
+    """
+
+    def __init__(self, root='files', cache_path=os.path.join(CACHE_DIR, 'status.json'), include=None):
+        self.root = root
+        # Paths of a sparse checkout; files outside it are neither listed nor compared
+        self.include = include or PathFilter()
+        self.cache_path = cache_path
+        self.lock = threading.Lock()
+        self.entries = self.load()
+        self.dirty = False
+
+    def load(self):
+        try:
+            with open(self.cache_path, 'r') as f:
+                return json.load(f)
+        except (FileNotFoundError, ValueError):
+            return {}
+
+    def save(self):
+        """Write the hash cache if it changed, replacing the old file atomically."""
+        with self.lock:
+            if not self.dirty:
+                return
+            data = json.dumps(self.entries)
+            self.dirty = False
+        os.makedirs(os.path.dirname(self.cache_path) or '.', exist_ok=True)
+        tmp_path = self.cache_path + '.tmp'
+        with open(tmp_path, 'w') as f:
+            f.write(data)
+        os.replace(tmp_path, self.cache_path)
+
+    def hash_file(self, name):
+        """Return the SHA-256 of a working file, reading it only if its stat data changed."""
+        st = os.stat(os.path.join(self.root, name))
+        key = [st.st_size, st.st_mtime_ns, st.st_ino]
+        with self.lock:
+            entry = self.entries.get(name)
+        if entry and entry[:3] == key:
+            return entry[3]
+
+        hasher = hashlib.sha256()
+        with open(os.path.join(self.root, name), 'rb') as f:
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                hasher.update(block)
+        file_hash = hasher.hexdigest()
+        self.remember(name, st, file_hash)
+        return file_hash
+
+    def record(self, name, file_hash):
+        """Cache the hash of a file that was just written with known content."""
+        self.remember(name, os.stat(os.path.join(self.root, name)), file_hash)
+
+    def remember(self, name, st, file_hash):
+        if time.time() - st.st_mtime < RACY_WINDOW:
+            return
+        with self.lock:
+            self.entries[name] = [st.st_size, st.st_mtime_ns, st.st_ino, file_hash]
+            self.dirty = True
+
+    def forget(self, name):
+        with self.lock:
+            if self.entries.pop(name, None) is not None:
+                self.dirty = True
+
+    def list_files(self):
+        """Return the '/'-separated paths of the working files in the checkout, skipping pull staging directories."""
+        names = []
+        stack = ['']
+        while stack:
+            prefix = stack.pop()
+            with os.scandir(os.path.join(self.root, prefix)) as entries:
+                for entry in entries:
+                    if entry.is_dir(follow_symlinks=False):
+                        if not (prefix == '' and entry.name.startswith('.pull-')) \
+                                and self.include.may_contain(prefix + entry.name + '/'):
+                            stack.append(prefix + entry.name + '/')
+                    elif entry.is_file(follow_symlinks=False) and self.include.matches(prefix + entry.name):
+                        names.append(prefix + entry.name)
+        return sorted(names)
+
+    def scan(self, progress=None):
+        """Return {path: hash} for the files in the working tree, including subdirectories."""
+        if not os.path.isdir(self.root):
+            return {}
+        names = self.list_files()
+        hashes = {}
+        for done, name in enumerate(names):
+            if progress:
+                progress(done, len(names), name)
+            hashes[name] = self.hash_file(name)
+
+        # Files that are gone no longer need an entry
+        with self.lock:
+            for name in [name for name in self.entries if name not in hashes]:
+                del self.entries[name]
+                self.dirty = True
+        self.save()
+        return hashes
+
+    def status(self, manifest, progress=None):
+        """
+        Compare the working tree with a manifest, normally the checkout's base (see Checkout.base).
+
+        Returns the sorted 'added', 'modified' and 'deleted' file names, and
+        the local hashes under 'local'.
+        """
+        local = self.scan(progress)
+        return {
+            'added': sorted(name for name in local if name not in manifest),
+            'modified': sorted(name for name in local if name in manifest and manifest[name] != local[name]),
+            'deleted': sorted(name for name in manifest if name not in local),
+            'local': local,
+        }
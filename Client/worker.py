@@ -0,0 +1,150 @@
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+from PyQt6.QtCore import QObject, QRunnable, QThreadPool, pyqtSignal
+
+# Connections kept open to the server, and threads running server calls.
+POOL_SIZE = 8
+
+# Seconds to wait for the server before a request fails.
+REQUEST_TIMEOUT = 30
+
+
+class Cancelled(Exception):
+    """Raised inside a task once it has been cancelled."""
+
+
+class ApiError(Exception):
+    """Raised when the server answers with an error status."""
+
+
+class ApiClient:
+    """
+    Server access over one keep-alive session shared by all worker threads.
+
+    Connections are pooled, so repeated calls reuse the same TCP/TLS
+    connection instead of opening a new one each time.
+    """
+
+    def __init__(self, base_url, pool_size=POOL_SIZE, timeout=REQUEST_TIMEOUT):
+        self.base_url = base_url.rstrip('/')
+        self.timeout = timeout
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('http://', adapter)
+        self.session.mount('https://', adapter)
+
+    def request(self, method, path, **kwargs):
+        kwargs.setdefault('timeout', self.timeout)
+        return self.session.request(method, self.base_url + path, **kwargs)
+
+    def get(self, path, **kwargs):
+        return self.request('GET', path, **kwargs)
+
+    def post(self, path, **kwargs):
+        return self.request('POST', path, **kwargs)
+
+    def put(self, path, **kwargs):
+        return self.request('PUT', path, **kwargs)
+
+    def json(self, method, path, **kwargs):
+        """Send a request and return its JSON body, raising ApiError on an error status."""
+        response = self.request(method, path, **kwargs)
+        if response.status_code >= 400:
+            try:
+                message = response.json().get('error')
+            except ValueError:
+                message = None
+            raise ApiError(message or f"Server returned {response.status_code}")
+        return response.json()
+
+    def close(self):
+        self.session.close()
+
+
+class TaskSignals(QObject):
+    result = pyqtSignal(object)
+    error = pyqtSignal(str)
+    progress = pyqtSignal(int, int, str)
+    finished = pyqtSignal()
+
+
+class Task(QRunnable):
+    """
+    Run fn(task, *args) on a pool thread and report back through signals.
+
+    The function can call task.report() for progress and task.check_cancelled()
+    between steps. A cancelled task never emits its result or error.
+    """
+
+    def __init__(self, fn, *args):
+        super().__init__()
+        self.fn = fn
+        self.args = args
+        self.signals = TaskSignals()
+        self.cancel_event = threading.Event()
+        # The runner holds the reference, so Qt must not delete the object
+        self.setAutoDelete(False)
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def cancel(self):
+        self.cancel_event.set()
+
+    def check_cancelled(self):
+        if self.cancelled:
+            raise Cancelled()
+
+    def report(self, done, total, message=""):
+        self.check_cancelled()
+        self.signals.progress.emit(done, total, message)
+
+    def run(self):
+        try:
+            result = self.fn(self, *self.args)
+        except Cancelled:
+            pass
+        except Exception as e:
+            if not self.cancelled:
+                self.signals.error.emit(str(e))
+        else:
+            if not self.cancelled:
+                self.signals.result.emit(result)
+        finally:
+            self.signals.finished.emit()
+
+
+class TaskRunner:
+    """Start tasks on a thread pool and keep them alive until they finish."""
+
+    def __init__(self, max_threads=POOL_SIZE):
+        self.pool = QThreadPool()
+        self.pool.setMaxThreadCount(max_threads)
+        self.active = set()
+
+    def start(self, fn, *args, on_result=None, on_error=None, on_progress=None, on_finished=None):
+        """Run fn(task, *args) in the background; callbacks run on the UI thread."""
+        task = Task(fn, *args)
+        if on_result:
+            task.signals.result.connect(on_result)
+        if on_error:
+            task.signals.error.connect(on_error)
+        if on_progress:
+            task.signals.progress.connect(on_progress)
+        if on_finished:
+            task.signals.finished.connect(on_finished)
+        task.signals.finished.connect(lambda: self.active.discard(task))
+        self.active.add(task)
+        self.pool.start(task)
+        return task
+
+    def cancel_all(self):
+        for task in list(self.active):
+            task.cancel()
+
+    def shutdown(self, timeout=2000):
+        """Cancel running tasks and wait briefly for the pool to drain."""
+        self.cancel_all()
+        self.pool.waitForDone(timeout)
@@ -0,0 +1,116 @@
+import os
+import hashlib
+import importlib
+import threading
+
+# Backend used by VCS.chat unless one is passed in explicitly. Either a
+# registered name or a "module:attribute" plugin path.
+DEFAULT_BACKEND = os.getenv("VCS_AI_BACKEND", "gemini")
+
+# Seconds a single model request may take before the SDK gives up on it.
+REQUEST_TIMEOUT = 60
+
+SYSTEM_PROMPT = "You are an AI assitant that will receive two pieces of texts that will have conflicts and your task is to give the user suggestions on merging the first text into the second resolving the conflict."
+
+
+class AssistantBackend:
+    """Interface for conflict-assistant backends."""
+
+    def complete(self, system, prompt):
+        """Return the model's answer to prompt under the given system instructions."""
+        raise NotImplementedError
+
+
+def create_gemini_model(model_name):
+    """Import and configure the Gemini SDK and build a model."""
+    import google.generativeai as genai
+    from dotenv import load_dotenv
+
+    load_dotenv()
+    genai.configure(api_key=os.getenv("GEMINI_API"))
+    return genai.GenerativeModel(model_name)
+
+
+class GemBot():
+
+    def __init__(self, model, timeout=None):
+        self.conversation = []
+        self.model = model
+        self.timeout = timeout
+
+    def system(self, text):
+        self.conversation = []
+        self.conversation.append({'role': 'system', 'content': text})
+
+    def gen_out(self, text):
+        self.conversation.append({'role': 'user', 'content': text})
+        conv = self.build_conversation()
+        options = {'timeout': self.timeout} if self.timeout else None
+        response = self.model.generate_content(conv, request_options=options)
+        output = response.text  # Adjust this based on Gemini's response structure
+        self.conversation.append({'role': 'assistant', 'content': output})
+        return output
+
+    def build_conversation(self):
+        return "\n\n".join(f"{msg['role'].capitalize()}: {msg['content']}" for msg in self.conversation)
+
+
+class GeminiBackend(AssistantBackend):
+    """Google Gemini backend; the SDK is only imported on first use."""
+
+    def __init__(self, model_name="gemini-1.5-flash", timeout=REQUEST_TIMEOUT):
+        self.model_name = model_name
+        self.timeout = timeout
+        self.model = None
+        self.lock = threading.Lock()
+
+    def complete(self, system, prompt):
+        # The model is shared; each request only gets its own conversation
+        with self.lock:
+            if self.model is None:
+                self.model = create_gemini_model(self.model_name)
+        bot = GemBot(self.model, timeout=self.timeout)
+        bot.system(system)
+        return bot.gen_out(prompt)
+
+
+class LocalBackend(AssistantBackend):
+    """
+    Deterministic offline backend for tests and machines without an API key.
+
+    It does not call any model; it returns a fixed suggestion that depends
+    only on the prompt, so identical requests get identical answers.
+    """
+
+    def complete(self, system, prompt):
+        digest = hashlib.sha256(prompt.encode()).hexdigest()[:12]
+        lines = prompt.count('\n') + 1
+        return (f"**Local suggestion** ({digest}): review the {lines} line(s) of conflicting text, "
+                "keep the target branch's version and re-apply the source branch's changes on top of it.")
+
+
+# Registered backends by name. Values are zero-argument factories.
+BACKENDS = {
+    'gemini': GeminiBackend,
+    'local': LocalBackend,
+}
+
+
+def register_backend(name, factory):
+    """Register a backend factory usable through load_backend(name)."""
+    BACKENDS[name] = factory
+
+
+def load_backend(name=None):
+    """
+    Create a backend by registered name or "module:attribute" plugin path.
+
+    Plugin modules are imported here, so they cost nothing until used.
+    """
+    name = name or DEFAULT_BACKEND
+    if name in BACKENDS:
+        return BACKENDS[name]()
+    if ':' in name:
+        module_name, attribute = name.split(':', 1)
+        return getattr(importlib.import_module(module_name), attribute)()
+    raise ValueError(f"Unknown assistant backend '{name}'.")
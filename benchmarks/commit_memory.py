@@ -0,0 +1,154 @@
+"""
+Measure the resident memory of loaded branch histories.
+
+Writes a branches.json in the older inline format: `--commits` commits on
+main, each with an ISO timestamp, hex tree hash and a small diff_log, plus
+`--branches` branches that copy main's history up to a fork point and add
+`--branch-commits` of their own. The file is then loaded in fresh
+interpreters, once as the plain JSON dicts load_branches used to keep and
+once through VCS as compact Commit objects (after a first load has split the
+file into per-branch histories and moved the diff logs into the object
+store). The RSS growth with every history loaded is reported, along with the
+time until VCS is usable, which only reads the refs file.
+
+    python benchmarks/commit_memory.py --commits 100000 --branches 4
+"""
+import argparse
+import gc
+import hashlib
+import json
+import os
+import random
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime, timedelta
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+def rss_bytes():
+    """Return the current resident set size of this process."""
+    try:
+        with open('/proc/self/status', 'r') as f:
+            for line in f:
+                if line.startswith('VmRSS:'):
+                    return int(line.split()[1]) * 1024
+    except FileNotFoundError:
+        pass
+    import resource
+    # Peak rather than current RSS, but the best that is portable
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def make_commit(i, when, rng):
+    path = f"src/module_{rng.randrange(500):03d}.py"
+    return {
+        'id': i,
+        'timestamp': when.isoformat(),
+        'message': f"Updated {path} on branch 'main' from client.",
+        'tree': hashlib.sha256(f"tree {i} {rng.random()}".encode()).hexdigest(),
+        'diff_log': {path: ['--- ', '+++ ', '@@ -1 +1 @@\n', f'-value = {i - 1}\n', f'+value = {i}\n']},
+    }
+
+
+def write_branches(path, args):
+    """Write the synthetic histories and return the number of distinct commits."""
+    rng = random.Random(args.seed)
+    when = datetime(2024, 1, 1)
+    main = []
+    for i in range(args.commits):
+        when += timedelta(seconds=rng.randint(1, 600), microseconds=rng.randrange(1000000))
+        main.append(make_commit(i + 1, when, rng))
+    branches = {'main': main}
+    for b in range(args.branches):
+        history = main[:rng.randint(len(main) // 2, len(main))]
+        for i in range(args.branch_commits):
+            when += timedelta(seconds=rng.randint(1, 600))
+            history.append(make_commit(len(history) + 1, when, rng))
+        branches[f'branch-{b}'] = history
+    with open(path, 'w') as f:
+        json.dump(branches, f, indent=4)
+    return args.commits + args.branches * args.branch_commits
+
+
+def measure(mode, root):
+    """Load the histories in this process and print the RSS they added."""
+    os.chdir(root)
+    sys.path.insert(0, ROOT)
+    stdout = sys.stdout
+    sys.stdout = open(os.devnull, 'w')
+    try:
+        from vcs import VCS
+        gc.collect()
+        before = rss_bytes()
+        start = time.perf_counter()
+        if mode == 'dicts':
+            with open(os.path.join(root, 'legacy.json'), 'r') as f:
+                branches = json.load(f)
+            startup = time.perf_counter() - start
+        else:
+            vcs = VCS(repo_path=os.path.join(root, 'bench_repo'))
+            startup = time.perf_counter() - start
+            # Histories load lazily; touch every branch so all of them are resident
+            branches = {branch: vcs.branches[branch] for branch in vcs.branches}
+        seconds = time.perf_counter() - start
+        gc.collect()
+        rss = rss_bytes() - before
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+    print(json.dumps({'mode': mode, 'rss_bytes': rss, 'load_seconds': seconds, 'startup_seconds': startup,
+                      'commits': sum(len(history) for history in branches.values())}))
+
+
+def run(mode, root):
+    output = subprocess.run([sys.executable, os.path.abspath(__file__), '--measure', mode, '--repo', root],
+                            capture_output=True, text=True, check=True).stdout
+    return json.loads(output.strip().splitlines()[-1])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--commits', type=int, default=100000, help="commits on main")
+    parser.add_argument('--branches', type=int, default=4)
+    parser.add_argument('--branch-commits', type=int, default=100, help="commits added on each branch")
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--measure', choices=('dicts', 'compact'), help=argparse.SUPPRESS)
+    parser.add_argument('--repo', help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.measure:
+        measure(args.measure, args.repo)
+        return
+
+    root = tempfile.mkdtemp(prefix='vcs-memory-')
+    try:
+        legacy_path = os.path.join(root, 'legacy.json')
+        distinct = write_branches(legacy_path, args)
+        size = os.path.getsize(legacy_path)
+        os.makedirs(os.path.join(root, 'bench_repo'))
+        shutil.copy(legacy_path, os.path.join(root, 'bench_repo', 'branches.json'))
+        dicts = run('dicts', root)
+        # The first compact load moves the inline diff logs into the object store
+        migration = run('compact', root)
+        compact = run('compact', root)
+        compact_size = sum(os.path.getsize(os.path.join(root, 'bench_repo', 'commits', name))
+                           for name in os.listdir(os.path.join(root, 'bench_repo', 'commits')))
+    finally:
+        shutil.rmtree(root)
+
+    print(f"{distinct} distinct commits, {dicts['commits']} across branches")
+    print(f"branches.json {size / 2 ** 20:.1f} MiB inline, {compact_size / 2 ** 20:.1f} MiB of branch files; "
+          f"one-time diff log migration {migration['load_seconds']:.1f} s")
+    print(f"{'model':>8} {'RSS (MiB)':>10} {'bytes/commit':>13} {'startup (s)':>12} {'load all (s)':>13}")
+    for result in (dicts, compact):
+        print(f"{result['mode']:>8} {result['rss_bytes'] / 2 ** 20:>10.1f} "
+              f"{result['rss_bytes'] / result['commits']:>13.0f} {result['startup_seconds']:>12.3f} "
+              f"{result['load_seconds']:>13.2f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,103 @@
+"""
+Benchmark VCS.commit with different worker pool sizes.
+
+Creates a throwaway repository with many files, then times a first commit
+(everything new) and a second commit after editing a fraction of the files,
+once per worker count.
+
+    python benchmarks/commit_scaling.py --files 2000 --size 65536 --workers 1 2 4 8
+"""
+import argparse
+import os
+import random
+import shutil
+import sys
+import tempfile
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from vcs import VCS
+from worktrees import write_file
+
+
+def make_files(files_path, count, size, seed):
+    """Fill files_path with `count` text files of roughly `size` bytes."""
+    rng = random.Random(seed)
+    for i in range(count):
+        lines = []
+        written = 0
+        while written < size:
+            line = f"{i} {rng.getrandbits(64):x} " + 'x' * rng.randint(10, 60) + '\n'
+            lines.append(line)
+            written += len(line)
+        with open(os.path.join(files_path, f'file_{i:06d}.txt'), 'w') as f:
+            f.writelines(lines)
+
+
+def edit_files(files_path, fraction, seed):
+    """Append a line to a random fraction of the files."""
+    rng = random.Random(seed)
+    names = sorted(os.listdir(files_path))
+    for name in rng.sample(names, max(1, int(len(names) * fraction))):
+        path = os.path.join(files_path, name)
+        with open(path, 'r') as f:
+            content = f.read()
+        # Worktree files may be hardlinks into the object store, so replace rather than append
+        write_file(path, content + f"edit {rng.getrandbits(32):x}\n")
+
+
+def run(workers, args):
+    root = tempfile.mkdtemp(prefix='vcs-bench-')
+    try:
+        vcs = VCS(repo_path=os.path.join(root, 'repo'), commit_workers=workers)
+        make_files(vcs.files_path, args.files, args.size, args.seed)
+
+        start = time.perf_counter()
+        vcs.commit("initial")
+        initial = time.perf_counter() - start
+
+        edit_files(vcs.files_path, args.edit_fraction, args.seed)
+        start = time.perf_counter()
+        vcs.commit("edit")
+        edit = time.perf_counter() - start
+        return initial, edit, vcs.snapshot(vcs.commits[-1])
+    finally:
+        shutil.rmtree(root)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=1000)
+    parser.add_argument('--size', type=int, default=64 * 1024, help="approximate bytes per file")
+    parser.add_argument('--edit-fraction', type=float, default=0.25)
+    parser.add_argument('--workers', type=int, nargs='+', default=[1, 2, 4, 8])
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    # Keep the per-commit prints out of the results table
+    stdout = sys.stdout
+    results = []
+    baseline_snapshot = None
+    for workers in args.workers:
+        sys.stdout = open(os.devnull, 'w')
+        try:
+            initial, edit, snapshot = run(workers, args)
+        finally:
+            sys.stdout.close()
+            sys.stdout = stdout
+        if baseline_snapshot is None:
+            baseline_snapshot = snapshot
+        elif snapshot != baseline_snapshot:
+            raise SystemExit(f"Snapshot with {workers} workers differs from the first run")
+        results.append((workers, initial, edit))
+
+    print(f"{args.files} files x {args.size} bytes, {os.cpu_count()} CPUs")
+    print(f"{'workers':>8} {'initial (s)':>12} {'speedup':>8} {'edit (s)':>10} {'speedup':>8}")
+    for workers, initial, edit in results:
+        print(f"{workers:>8} {initial:>12.3f} {results[0][1] / initial:>8.2f} "
+              f"{edit:>10.3f} {results[0][2] / edit:>8.2f}")
+
+
+if __name__ == '__main__':
+    main()
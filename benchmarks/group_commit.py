@@ -0,0 +1,116 @@
+"""
+Benchmark group commit throughput and latency under concurrent pushes.
+
+Generates a synthetic repository, then for each concurrency level runs
+that many client threads, each sending `--pushes` single-file /push requests
+through Flask's test client. Every level is run once committing each push
+on its own (batch size 1) and once with group commit using `--window` and
+`--batch`. Reported are pushes per second and the median and 99th
+percentile request latency.
+
+    python benchmarks/group_commit.py --concurrency 1 4 16 64 --window 0.005 --batch 64
+"""
+import argparse
+import os
+import shutil
+import statistics
+import sys
+import tempfile
+import threading
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from synthetic import generate_repo
+from group_commit import DEFAULT_MAX_BATCH, DEFAULT_WINDOW, GroupCommitter
+
+
+def percentile(samples, fraction):
+    ordered = sorted(samples)
+    return ordered[min(len(ordered) - 1, int(len(ordered) * fraction))]
+
+
+def run_level(server, vcs, clients, args, window, batch):
+    """Run `clients` pushing threads against a fresh committer and return the measurements."""
+    server.group_commits = GroupCommitter(vcs, window=window, max_batch=batch)
+    latencies = []
+    errors = []
+    lock = threading.Lock()
+    start_line = threading.Barrier(clients + 1)
+
+    def client(index):
+        test_client = server.app.test_client()
+        start_line.wait()
+        for i in range(args.pushes):
+            content = f"client {index} push {i}\n" * (args.size // 20 + 1)
+            started = time.perf_counter()
+            response = test_client.post('/push', json={'branch': 'main', 'filename': f'client_{index}.txt',
+                                                       'content': content})
+            elapsed = time.perf_counter() - started
+            with lock:
+                latencies.append(elapsed)
+                if response.status_code != 200:
+                    errors.append(response.get_data(as_text=True))
+
+    threads = [threading.Thread(target=client, args=(i,)) for i in range(clients)]
+    for thread in threads:
+        thread.start()
+    start_line.wait()
+    started = time.perf_counter()
+    for thread in threads:
+        thread.join()
+    seconds = time.perf_counter() - started
+    if errors:
+        raise RuntimeError(errors[0])
+    return {
+        'throughput': len(latencies) / seconds,
+        'p50': statistics.median(latencies),
+        'p99': percentile(latencies, 0.99),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 4, 16, 64])
+    parser.add_argument('--pushes', type=int, default=20, help="pushes sent by each client thread")
+    parser.add_argument('--files', type=int, default=200, help="files in the repository")
+    parser.add_argument('--size', type=int, default=1024, help="bytes per pushed file")
+    parser.add_argument('--window', type=float, default=DEFAULT_WINDOW, help="group commit window in seconds")
+    parser.add_argument('--batch', type=int, default=DEFAULT_MAX_BATCH, help="largest group commit batch")
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    root = tempfile.mkdtemp(prefix='vcs-group-')
+    cwd = os.getcwd()
+    stdout = sys.stdout
+    results = []
+    try:
+        # Keep the per-commit prints out of the report
+        sys.stdout = open(os.devnull, 'w')
+        vcs = generate_repo(os.path.join(root, 'repo'), files=args.files, depth=2, branches=0, seed=args.seed)
+        # server builds its own VCS in ./repo on import, so import it from the scratch directory
+        os.chdir(root)
+        import server
+        server.vcs = vcs
+        for clients in args.concurrency:
+            single = run_level(server, vcs, clients, args, 0, 1)
+            grouped = run_level(server, vcs, clients, args, args.window, args.batch)
+            results.append((clients, single, grouped))
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        os.chdir(cwd)
+        shutil.rmtree(root)
+
+    print(f"{args.files} files, {args.pushes} pushes per client, window {args.window * 1000:g} ms, "
+          f"batch {args.batch}, {os.cpu_count()} CPUs")
+    print(f"{'clients':>7} {'mode':>8} {'pushes/s':>9} {'p50 (ms)':>9} {'p99 (ms)':>9}")
+    for clients, single, grouped in results:
+        for mode, result in (('single', single), ('grouped', grouped)):
+            print(f"{clients:>7} {mode:>8} {result['throughput']:>9.1f} {result['p50'] * 1000:>9.1f} "
+                  f"{result['p99'] * 1000:>9.1f}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,74 @@
+"""
+Measure how long it takes to import the server and the VCS module.
+
+Each measurement runs in a fresh interpreter inside an empty working
+directory, so the VCS that server creates on import starts from an empty repo.
+Pass --compare REF to measure a git revision of the same tree side by side
+(for example the commit before the assistant backend became lazy).
+
+    python benchmarks/import_time.py --runs 10 --compare HEAD~1
+"""
+import argparse
+import io
+import os
+import statistics
+import subprocess
+import sys
+import tarfile
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+TARGETS = {
+    'vcs': "import vcs; vcs.VCS('bench_repo')",
+    'server': "import server",
+}
+
+
+def measure(source_dir, statement, runs):
+    """Return the wall-clock seconds of each fresh-interpreter import."""
+    timings = []
+    code = ("import sys, time; sys.path.insert(0, %r); start = time.perf_counter(); %s; "
+            "print(time.perf_counter() - start)") % (source_dir, statement)
+    for _ in range(runs):
+        with tempfile.TemporaryDirectory() as cwd:
+            result = subprocess.run([sys.executable, '-c', code], cwd=cwd, capture_output=True, text=True)
+            if result.returncode != 0:
+                raise SystemExit(result.stderr.strip().splitlines()[-1])
+            timings.append(float(result.stdout.strip().splitlines()[-1]))
+    return timings
+
+
+def export_revision(ref, target_dir):
+    """Write the tracked Python sources of a git revision into target_dir."""
+    archive = subprocess.run(['git', 'archive', '--format=tar', ref], cwd=ROOT, capture_output=True, check=True)
+    with tarfile.open(fileobj=io.BytesIO(archive.stdout)) as tar:
+        tar.extractall(target_dir, members=[m for m in tar.getmembers() if m.name.endswith('.py')])
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    parser.add_argument('--compare', metavar='REF', help="git revision to measure alongside the working tree")
+    args = parser.parse_args()
+
+    trees = [('working tree', ROOT)]
+    temp_dir = None
+    if args.compare:
+        temp_dir = tempfile.TemporaryDirectory()
+        export_revision(args.compare, temp_dir.name)
+        trees.insert(0, (args.compare, temp_dir.name))
+
+    print(f"{'tree':>14} {'target':>8} {'median (ms)':>12} {'min (ms)':>10}")
+    for label, source_dir in trees:
+        for target, statement in TARGETS.items():
+            timings = measure(source_dir, statement, args.runs)
+            print(f"{label:>14} {target:>8} {statistics.median(timings) * 1000:>12.1f} "
+                  f"{min(timings) * 1000:>10.1f}")
+
+    if temp_dir:
+        temp_dir.cleanup()
+
+
+if __name__ == '__main__':
+    main()
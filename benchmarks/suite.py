@@ -0,0 +1,239 @@
+"""
+Benchmark the VCS hot paths on a synthetic repository.
+
+Times VCS.commit, create_branch, merge and get_file_content_by_hash, and
+the /push, /pull and /clone endpoints through Flask's test client. Results
+are written as JSON; with --baseline each benchmark's median is compared to
+a saved run and the exit status is 1 if any slowed down past --threshold.
+
+    python benchmarks/suite.py --files 500 --depth 20 --output results.json
+    python benchmarks/suite.py --files 500 --depth 20 --baseline results.json
+"""
+import argparse
+import json
+import os
+import platform
+import random
+import shutil
+import statistics
+import subprocess
+import sys
+import tempfile
+import time
+from datetime import datetime
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+from synthetic import EDIT_PATTERNS, edit_files, file_name, generate_repo
+
+
+def timed(fn, repeat):
+    """Call fn() `repeat` times and return the durations in seconds."""
+    samples = []
+    for _ in range(repeat):
+        start = time.perf_counter()
+        fn()
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_commit(vcs, args, rng):
+    samples = []
+    for _ in range(args.repeat):
+        edit_files(vcs.files_path, args.edit_fraction, args.edit_pattern, rng)
+        start = time.perf_counter()
+        vcs.commit("benchmark edit")
+        samples.append(time.perf_counter() - start)
+    return samples
+
+
+def bench_create_branch(vcs, args, rng):
+    names = iter(f'bench-branch-{i}' for i in range(args.repeat))
+    return timed(lambda: vcs.create_branch(next(names)), args.repeat)
+
+
+def bench_merge(vcs, args, rng):
+    vcs.switch_branch('main')
+    source = 'branch-0' if 'branch-0' in vcs.branches else 'main'
+    return timed(lambda: vcs.merge(source, 'main'), args.repeat)
+
+
+def bench_get_file_content_by_hash(vcs, args, rng):
+    hashes = list(vcs.tip_snapshot('main').values())
+
+    def read_all():
+        for file_hash in hashes:
+            vcs.get_file_content_by_hash(file_hash)
+    return timed(read_all, args.repeat)
+
+
+def bench_push(client, args, rng):
+    counter = iter(range(args.repeat))
+
+    def push():
+        i = next(counter)
+        content = ''.join(f"pushed line {i} {rng.getrandbits(32):x}\n" for _ in range(args.size // 32))
+        response = client.post('/push', json={'branch': 'main', 'filename': file_name(i % args.files),
+                                              'content': content})
+        assert response.status_code == 200, response.get_data(as_text=True)
+    return timed(push, args.repeat)
+
+
+def bench_pull(client, args, rng):
+    def pull():
+        response = client.get('/pull/main')
+        assert response.status_code == 200, response.get_data(as_text=True)
+    return timed(pull, args.repeat)
+
+
+def bench_clone(client, args, rng):
+    def clone():
+        response = client.get('/clone')
+        assert response.status_code == 200, response.get_data(as_text=True)
+    return timed(clone, args.repeat)
+
+
+VCS_BENCHMARKS = {
+    'commit': bench_commit,
+    'create_branch': bench_create_branch,
+    'merge': bench_merge,
+    'get_file_content_by_hash': bench_get_file_content_by_hash,
+}
+
+SERVER_BENCHMARKS = {
+    'push': bench_push,
+    'pull': bench_pull,
+    'clone': bench_clone,
+}
+
+
+def summarize(samples):
+    return {
+        'samples': len(samples),
+        'min': min(samples),
+        'median': statistics.median(samples),
+        'mean': statistics.fmean(samples),
+        'max': max(samples),
+    }
+
+
+def git_revision():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], capture_output=True, text=True,
+                              cwd=os.path.dirname(os.path.abspath(__file__))).stdout.strip() or None
+    except OSError:
+        return None
+
+
+def run(args):
+    """Generate a repository, run the selected benchmarks and return the results document."""
+    selected = args.only or list(VCS_BENCHMARKS) + list(SERVER_BENCHMARKS)
+    root = tempfile.mkdtemp(prefix='vcs-suite-')
+    cwd = os.getcwd()
+    stdout = sys.stdout
+    results = {}
+    try:
+        # Keep the per-commit prints out of the report
+        sys.stdout = open(os.devnull, 'w')
+        start = time.perf_counter()
+        vcs = generate_repo(os.path.join(root, 'repo'), files=args.files, size=args.size,
+                            size_spread=args.size_spread, depth=args.depth, branches=args.branches,
+                            branch_depth=args.branch_depth, edit_fraction=args.edit_fraction,
+                            edit_pattern=args.edit_pattern, seed=args.seed)
+        generate_seconds = time.perf_counter() - start
+        rng = random.Random(args.seed + 1)
+
+        for name, bench in VCS_BENCHMARKS.items():
+            if name in selected:
+                results[name] = summarize(bench(vcs, args, rng))
+
+        if any(name in selected for name in SERVER_BENCHMARKS):
+            # server builds its own VCS in ./repo on import, so import it from the scratch directory
+            os.chdir(root)
+            sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+            import server
+            from group_commit import GroupCommitter
+            server.vcs = vcs
+            server.group_commits = GroupCommitter(vcs)
+            client = server.app.test_client()
+            for name, bench in SERVER_BENCHMARKS.items():
+                if name in selected:
+                    results[name] = summarize(bench(client, args, rng))
+    finally:
+        sys.stdout.close()
+        sys.stdout = stdout
+        os.chdir(cwd)
+        shutil.rmtree(root)
+
+    return {
+        'meta': {
+            'timestamp': datetime.now().isoformat(),
+            'revision': git_revision(),
+            'python': platform.python_version(),
+            'platform': platform.platform(),
+            'cpus': os.cpu_count(),
+            'generate_seconds': generate_seconds,
+            'params': {key: value for key, value in vars(args).items()
+                       if key not in ('output', 'baseline', 'threshold', 'only')},
+        },
+        'results': results,
+    }
+
+
+def compare(current, baseline, threshold):
+    """Print each benchmark's median against the baseline and return the names that regressed."""
+    if baseline['meta'].get('params') != current['meta']['params']:
+        print("warning: baseline was recorded with different parameters")
+    regressions = []
+    print(f"{'benchmark':<26} {'baseline (s)':>13} {'current (s)':>12} {'ratio':>7}")
+    for name, result in current['results'].items():
+        before = baseline['results'].get(name)
+        if before is None:
+            print(f"{name:<26} {'-':>13} {result['median']:>12.5f} {'new':>7}")
+            continue
+        ratio = result['median'] / before['median'] if before['median'] else float('inf')
+        flag = ''
+        if ratio > 1 + threshold:
+            regressions.append(name)
+            flag = '  REGRESSION'
+        print(f"{name:<26} {before['median']:>13.5f} {result['median']:>12.5f} {ratio:>7.2f}{flag}")
+    return regressions
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--files', type=int, default=200)
+    parser.add_argument('--size', type=int, default=4096, help="approximate bytes per file")
+    parser.add_argument('--size-spread', type=float, default=0.5, help="relative spread of file sizes")
+    parser.add_argument('--depth', type=int, default=10, help="commits on main")
+    parser.add_argument('--branches', type=int, default=2)
+    parser.add_argument('--branch-depth', type=int, default=3, help="commits on each branch")
+    parser.add_argument('--edit-fraction', type=float, default=0.1)
+    parser.add_argument('--edit-pattern', choices=EDIT_PATTERNS, default='append')
+    parser.add_argument('--repeat', type=int, default=5)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--only', nargs='+', choices=list(VCS_BENCHMARKS) + list(SERVER_BENCHMARKS))
+    parser.add_argument('--output', help="write the results as JSON to this file")
+    parser.add_argument('--baseline', help="compare against results saved with --output")
+    parser.add_argument('--threshold', type=float, default=0.2,
+                        help="allowed slowdown of the median before it counts as a regression")
+    args = parser.parse_args()
+
+    results = run(args)
+    if args.output:
+        with open(args.output, 'w') as f:
+            json.dump(results, f, indent=4)
+
+    if args.baseline:
+        with open(args.baseline, 'r') as f:
+            baseline = json.load(f)
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print(f"{len(regressions)} regression(s): {', '.join(regressions)}")
+            sys.exit(1)
+    elif not args.output:
+        print(json.dumps(results, indent=4))
+
+
+if __name__ == '__main__':
+    main()
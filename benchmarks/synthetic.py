@@ -0,0 +1,98 @@
+"""
+Generate synthetic repositories for benchmarks.
+
+    from synthetic import generate_repo
+    vcs = generate_repo('/tmp/repo', files=500, size=8192, depth=20, branches=4)
+
+The result is an ordinary VCS repository: `depth` commits on main, then
+`branches` branches that each add `branch_depth` commits of their own.
+Every commit edits `edit_fraction` of the files using `edit_pattern`.
+"""
+import os
+import random
+import sys
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from worktrees import write_file
+
+EDIT_PATTERNS = ('append', 'prepend', 'middle', 'rewrite', 'mixed')
+
+
+def random_lines(rng, size, tag):
+    """Return text lines adding up to roughly `size` bytes."""
+    lines = []
+    written = 0
+    while written < size:
+        line = f"{tag} {rng.getrandbits(64):x} " + 'x' * rng.randint(10, 60) + '\n'
+        lines.append(line)
+        written += len(line)
+    return lines
+
+
+def file_name(i):
+    return f'file_{i:06d}.txt'
+
+
+def make_files(files_path, count, size, size_spread, rng):
+    """Write `count` text files whose sizes vary by +/- size_spread around `size`."""
+    for i in range(count):
+        file_size = max(1, int(size * (1 + rng.uniform(-size_spread, size_spread))))
+        with open(os.path.join(files_path, file_name(i)), 'w') as f:
+            f.writelines(random_lines(rng, file_size, i))
+
+
+def edit_file(path, pattern, rng):
+    """Apply one edit of the given pattern to a text file."""
+    with open(path, 'r') as f:
+        lines = f.readlines()
+    if pattern == 'mixed':
+        pattern = rng.choice(EDIT_PATTERNS[:-1])
+    edit = random_lines(rng, 80, 'edit')
+    if pattern == 'append':
+        lines += edit
+    elif pattern == 'prepend':
+        lines = edit + lines
+    elif pattern == 'middle':
+        at = rng.randint(0, len(lines))
+        lines[at:at + 1] = edit
+    elif pattern == 'rewrite':
+        lines = random_lines(rng, sum(len(line) for line in lines), 'rewrite')
+    else:
+        raise ValueError(f"Unknown edit pattern '{pattern}'.")
+    # Worktree files may be hardlinks into the object store, so replace rather than rewrite
+    write_file(path, ''.join(lines))
+
+
+def edit_files(files_path, fraction, pattern, rng):
+    """Edit a random fraction of the files in place."""
+    names = sorted(os.listdir(files_path))
+    for name in rng.sample(names, max(1, int(len(names) * fraction))):
+        edit_file(os.path.join(files_path, name), pattern, rng)
+
+
+def generate_repo(repo_path, files=100, size=4096, size_spread=0.5, depth=10, branches=2,
+                  branch_depth=3, edit_fraction=0.1, edit_pattern='append', seed=0, **vcs_options):
+    """Create a synthetic repository at repo_path and return its VCS."""
+    if edit_pattern not in EDIT_PATTERNS:
+        raise ValueError(f"Unknown edit pattern '{edit_pattern}'.")
+    # Imported here so the edit helpers can be used without loading the VCS
+    from vcs import VCS
+    rng = random.Random(seed)
+    vcs = VCS(repo_path=repo_path, **vcs_options)
+    make_files(vcs.files_path, files, size, size_spread, rng)
+    vcs.commit("initial")
+    for i in range(depth - 1):
+        edit_files(vcs.files_path, edit_fraction, edit_pattern, rng)
+        vcs.commit(f"main edit {i + 1}")
+
+    for b in range(branches):
+        name = f'branch-{b}'
+        vcs.switch_branch('main')
+        vcs.create_branch(name)
+        vcs.switch_branch(name)
+        for i in range(branch_depth):
+            edit_files(vcs.files_path, edit_fraction, edit_pattern, rng)
+            vcs.commit(f"{name} edit {i + 1}")
+    vcs.switch_branch('main')
+    return vcs
@@ -0,0 +1,186 @@
+import hashlib
+import json
+import threading
+
+# Chunk size bounds for content-defined chunking (FastCDC with normalised
+# chunking). Boundaries depend only on nearby content, so an edit only
+# changes the chunks around it.
+MIN_CHUNK_SIZE = 16 * 1024
+AVG_CHUNK_SIZE = 64 * 1024
+MAX_CHUNK_SIZE = 256 * 1024
+
+# Files at least this large are stored as chunks plus a manifest.
+CHUNK_THRESHOLD = 4 * 1024 * 1024
+
+READ_SIZE = 1024 * 1024
+MASK_64 = (1 << 64) - 1
+
+# The gear hash of a position only depends on the bytes of this window.
+GEAR_WINDOW = 64
+
+# Bytes hashed per numpy pass, small enough for the arrays to stay in cache.
+CANDIDATE_BLOCK = 32 * 1024
+
+
+def _gear_table():
+    """Build the deterministic 256-entry random table for the gear hash."""
+    table = []
+    for i in range(256):
+        digest = hashlib.sha256(b'vcs-gear-%d' % i).digest()
+        table.append(int.from_bytes(digest[:8], 'big'))
+    return table
+
+
+GEAR = _gear_table()
+
+# numpy is optional; it is imported on first use so importing this module stays cheap.
+_numpy = None
+_numpy_lock = threading.Lock()
+
+
+def load_numpy():
+    """Return numpy, or None if it is not installed."""
+    global _numpy
+    with _numpy_lock:
+        if _numpy is None:
+            try:
+                import numpy
+                _numpy = numpy
+            except ImportError:
+                _numpy = False
+        return _numpy or None
+
+
+def _mask(bits):
+    """Return a mask of the top `bits` bits, which depend on the last 64 bytes only."""
+    return ((1 << bits) - 1) << (64 - bits)
+
+
+def _masks(avg_size):
+    """Return the (before average, after average) cut masks of normalised chunking."""
+    bits = avg_size.bit_length() - 1
+    return _mask(bits + 2), _mask(bits - 2)
+
+
+class CutCandidates:
+    """
+    Positions in a buffer where a chunk may end, found with numpy for the whole buffer at once.
+
+    The gear hash after byte p is the sum of gear[data[p - k]] << k over the
+    last 64 bytes, so it is computed for every position with six shifted
+    additions over the array (windows of 1, 2, 4, ... 64 bytes), one
+    cache-sized block at a time. Positions whose hash passes either mask are
+    kept; cut_point only looks them up.
+    """
+
+    def __init__(self, numpy, data, avg_size=AVG_CHUNK_SIZE):
+        gear = numpy.array(GEAR, dtype=numpy.uint64)
+        values = numpy.frombuffer(data, dtype=numpy.uint8)
+        mask_small, mask_large = (numpy.uint64(mask) for mask in _masks(avg_size))
+        small = []
+        large = []
+        for start in range(0, len(values), CANDIDATE_BLOCK):
+            # Each block is hashed with the window of bytes before it
+            lead = min(start, GEAR_WINDOW - 1)
+            hashes = gear[values[start - lead:start + CANDIDATE_BLOCK]]
+            width = 1
+            while width < GEAR_WINDOW:
+                hashes[width:] += hashes[:-width] << numpy.uint64(width)
+                width *= 2
+            hashes = hashes[lead:]
+            small.append(numpy.flatnonzero((hashes & mask_small) == 0) + start)
+            large.append(numpy.flatnonzero((hashes & mask_large) == 0) + start)
+        self.numpy = numpy
+        self.small = numpy.concatenate(small) if small else numpy.empty(0, dtype=numpy.intp)
+        self.large = numpy.concatenate(large) if large else numpy.empty(0, dtype=numpy.intp)
+
+    def first(self, mask_small, start, end):
+        """Return the first candidate position in [start, end), or None."""
+        positions = self.small if mask_small else self.large
+        i = self.numpy.searchsorted(positions, start)
+        return int(positions[i]) if i < len(positions) and positions[i] < end else None
+
+
+def cut_point(data, start, end, min_size=MIN_CHUNK_SIZE, avg_size=AVG_CHUNK_SIZE, max_size=MAX_CHUNK_SIZE,
+              candidates=None):
+    """
+    Return the end offset of the chunk starting at `start` in data[start:end].
+
+    With candidates (a CutCandidates over data) only the first 64 bytes
+    after the minimum size are hashed here; from there on the hash no longer
+    depends on where it started, so the precomputed positions are used.
+    """
+    length = end - start
+    if length <= min_size:
+        return end
+    if length > max_size:
+        end = start + max_size
+    mask_small, mask_large = _masks(avg_size)
+    gear = GEAR
+    fingerprint = 0
+    i = start + min_size
+
+    # Harder to cut before the average size, easier after it
+    normal = min(start + avg_size, end)
+    stop = min(i + GEAR_WINDOW - 1, end) if candidates is not None else end
+    while i < stop:
+        fingerprint = ((fingerprint << 1) + gear[data[i]]) & MASK_64
+        i += 1
+        if not fingerprint & (mask_small if i <= normal else mask_large):
+            return i
+    if i < end:
+        position = candidates.first(True, i, normal) if i < normal else None
+        if position is None:
+            position = candidates.first(False, max(i, normal), end)
+        if position is not None:
+            return position + 1
+    return end
+
+
+def iter_chunks(f, min_size=MIN_CHUNK_SIZE, avg_size=AVG_CHUNK_SIZE, max_size=MAX_CHUNK_SIZE):
+    """Split a binary file object into content-defined chunks, reading it as a stream."""
+    numpy = load_numpy()
+    buffer = b''
+    offset = 0
+    candidates = None
+    eof = False
+    while True:
+        if not eof and len(buffer) - offset < max_size:
+            # Only the unchunked tail is copied, once per read rather than once per chunk
+            blocks = [buffer[offset:]]
+            while not eof and sum(map(len, blocks)) < max_size:
+                block = f.read(READ_SIZE)
+                if not block:
+                    eof = True
+                blocks.append(block)
+            buffer = b''.join(blocks)
+            offset = 0
+            candidates = CutCandidates(numpy, buffer, avg_size) if numpy is not None and len(buffer) > min_size \
+                else None
+        if offset >= len(buffer):
+            return
+        end = cut_point(buffer, offset, len(buffer), min_size, avg_size, max_size, candidates)
+        yield buffer[offset:end]
+        offset = end
+
+
+def build_manifest(f):
+    """
+    Chunk a binary file object.
+
+    Returns (file_hash, manifest) where the manifest lists the size and the
+    [chunk_hash, length] pairs in file order.
+    """
+    hasher = hashlib.sha256()
+    entries = []
+    size = 0
+    for data in iter_chunks(f):
+        hasher.update(data)
+        entries.append([hashlib.sha256(data).hexdigest(), len(data)])
+        size += len(data)
+    return hasher.hexdigest(), {'size': size, 'chunks': entries}
+
+
+def dump_manifest(manifest):
+    """Serialise a manifest in its canonical on-disk form."""
+    return json.dumps(manifest, separators=(',', ':')).encode()
@@ -0,0 +1,155 @@
+"""
+Compact in-memory commits.
+
+Branch histories stay resident in the server for its whole lifetime, so a
+commit is a __slots__ object instead of a dict of strings: hashes are kept as
+32-byte bytes, timestamps as integer microseconds, messages are interned,
+and the diff log stays on disk in the object store, referenced by hash.
+Commits loaded from disk are shared between branches whose histories
+overlap, and paths of old flat snapshots go through one interned path table.
+
+Commits still answer dict-style reads such as commit['message'] or
+commit.get('tree'), returning the values in their JSON form.
+"""
+import sys
+from array import array
+from datetime import datetime, timedelta
+
+EPOCH = datetime(1970, 1, 1)
+
+
+class PathTable:
+    """Map each distinct path to a small integer so it is stored only once."""
+
+    def __init__(self):
+        self.ids = {}
+        self.paths = []
+
+    def intern(self, path):
+        path_id = self.ids.get(path)
+        if path_id is None:
+            path_id = self.ids[path] = len(self.paths)
+            self.paths.append(sys.intern(path))
+        return path_id
+
+    def path(self, path_id):
+        return self.paths[path_id]
+
+
+PATHS = PathTable()
+
+
+def pack_hash(name):
+    return bytes.fromhex(name) if name else None
+
+
+def unpack_hash(data):
+    return data.hex() if data is not None else None
+
+
+def pack_time(timestamp):
+    """Convert a naive ISO timestamp to integer microseconds; raises ValueError."""
+    value = datetime.fromisoformat(timestamp)
+    if value.tzinfo is not None:
+        raise ValueError("Only naive timestamps are packed.")
+    return (value - EPOCH) // timedelta(microseconds=1)
+
+
+def unpack_time(micros):
+    return (EPOCH + timedelta(microseconds=micros)).isoformat()
+
+
+def current_time():
+    """Return the current local time in the packed form."""
+    return (datetime.now() - EPOCH) // timedelta(microseconds=1)
+
+
+class Commit:
+    """One commit of a branch history."""
+
+    __slots__ = ('id', 'time', 'message', 'tree', 'diff', 'snapshot_paths', 'snapshot_hashes', 'extra',
+                 '__weakref__')
+
+    def __init__(self, message, time, id=None, tree=None, diff=None, snapshot=None, extra=None):
+        self.id = id
+        self.time = time
+        self.message = sys.intern(message)
+        self.tree = tree
+        self.diff = diff
+        self.snapshot_paths = None
+        self.snapshot_hashes = None
+        if snapshot is not None:
+            # Flat snapshots of commits made before tree objects existed
+            self.snapshot_paths = array('I', (PATHS.intern(path) for path in snapshot))
+            self.snapshot_hashes = b''.join(bytes.fromhex(file_hash) for file_hash in snapshot.values())
+        self.extra = extra or None
+
+    @classmethod
+    def from_dict(cls, data):
+        """Build a commit from its JSON form; unknown keys are kept as they are."""
+        extra = {key: value for key, value in data.items()
+                 if key not in ('id', 'timestamp', 'message', 'tree', 'diff', 'snapshot')}
+        time = None
+        if 'timestamp' in data:
+            try:
+                time = pack_time(data['timestamp'])
+            except (TypeError, ValueError):
+                extra['timestamp'] = data['timestamp']
+        return cls(data.get('message', ''), time, id=data.get('id'), tree=pack_hash(data.get('tree')),
+                   diff=pack_hash(data.get('diff')), snapshot=data.get('snapshot'), extra=extra)
+
+    def snapshot(self):
+        """Return the flat {path: hash} snapshot of an old commit, or None."""
+        if self.snapshot_paths is None:
+            return None
+        hashes = self.snapshot_hashes
+        return {PATHS.path(path_id): hashes[i * 32:(i + 1) * 32].hex()
+                for i, path_id in enumerate(self.snapshot_paths)}
+
+    def field(self, key):
+        if key == 'id':
+            value = self.id
+        elif key == 'timestamp':
+            value = unpack_time(self.time) if self.time is not None else None
+        elif key == 'message':
+            value = self.message
+        elif key == 'tree':
+            value = unpack_hash(self.tree)
+        elif key == 'diff':
+            value = unpack_hash(self.diff)
+        elif key == 'snapshot':
+            value = self.snapshot()
+        else:
+            value = None
+        if value is None and self.extra:
+            value = self.extra.get(key)
+        return value
+
+    def __getitem__(self, key):
+        value = self.field(key)
+        if value is None:
+            raise KeyError(key)
+        return value
+
+    def get(self, key, default=None):
+        value = self.field(key)
+        return default if value is None else value
+
+    def __contains__(self, key):
+        return self.field(key) is not None
+
+    def key(self):
+        """Identity used to share one object between branches that copied a commit."""
+        return self.id, self.time, self.message, self.tree, self.diff, self.snapshot_hashes
+
+    def to_dict(self):
+        """Return the JSON form of the commit."""
+        data = {}
+        for key in ('id', 'timestamp', 'message', 'tree', 'diff', 'snapshot'):
+            value = self.field(key)
+            if value is not None:
+                data[key] = value
+        if self.extra:
+            for key, value in self.extra.items():
+                data.setdefault(key, value)
+        return data
@@ -0,0 +1,535 @@
+import io
+import difflib
+
+# Content with a NUL byte in this many leading bytes is treated as binary.
+BINARY_SNIFF_BYTES = 8000
+
+# Files above either limit only get a one-line summary instead of a line diff.
+DEFAULT_MAX_BYTES = 8 * 1024 * 1024
+DEFAULT_MAX_LINES = 200000
+
+# Upper bound on the number of entries the Myers trace may hold before the
+# linear-space algorithm takes over (the trace grows with the square of the
+# edit distance).
+MAX_TRACE_ENTRIES = 4 * 1024 * 1024
+
+# Number of diagonals the Myers search may visit per diff. Regions that would
+# cost more are reported as a plain replacement instead of a minimal diff.
+MAX_DIFF_COST = 2 * 1024 * 1024
+
+# Budget for the plain Myers attempt made before patience anchoring; small
+# edits to large files finish well within it with a minimal diff.
+QUICK_DIFF_COST = 64 * 1024
+
+
+def is_binary(data):
+    """Guess whether file content, raw bytes or already decoded text, is binary."""
+    return (b'\0' if isinstance(data, bytes) else '\0') in data[:BINARY_SNIFF_BYTES]
+
+
+def decode_lines(data):
+    """Split raw content into lines the same way VCS.get_file_content reads files."""
+    return io.TextIOWrapper(io.BytesIO(data)).readlines()
+
+
+def intern_lines(old_lines, new_lines):
+    """Map every distinct line to a small integer so comparisons are cheap."""
+    table = {}
+    old_ids = [table.setdefault(line, len(table)) for line in old_lines]
+    new_ids = [table.setdefault(line, len(table)) for line in new_lines]
+    return old_ids, new_ids
+
+
+class _TooExpensive(Exception):
+    """Raised when a region exceeds the diff cost budget."""
+
+
+def _myers_trace(a, b, budget):
+    """Run the greedy Myers search, returning the trace or None if it grows too large."""
+    n = len(a)
+    m = len(b)
+    size = n + m + 2
+    v = [0] * (2 * size + 1)
+    trace = []
+    entries = 0
+    for d in range(n + m + 1):
+        budget[0] -= d + 1
+        if budget[0] < 0:
+            raise _TooExpensive()
+        # Keep V for diagonals -d-1..d+1, which backtracking at step d reads
+        trace.append(v[size - d - 1:size + d + 2])
+        entries += 2 * d + 3
+        if entries > MAX_TRACE_ENTRIES:
+            return None
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and v[size + k - 1] < v[size + k + 1]):
+                x = v[size + k + 1]
+            else:
+                x = v[size + k - 1] + 1
+            y = x - k
+            while x < n and y < m and a[x] == b[y]:
+                x += 1
+                y += 1
+            v[size + k] = x
+            if x >= n and y >= m:
+                return trace
+    return trace
+
+
+def _myers_backtrack(trace, n, m):
+    """Return the matching blocks recorded in a Myers trace, in order."""
+    x, y = n, m
+    found = []
+    for d in range(len(trace) - 1, -1, -1):
+        v = trace[d]
+        k = x - y
+        if k == -d or (k != d and v[k + d] < v[k + d + 2]):
+            prev_k = k + 1
+        else:
+            prev_k = k - 1
+        prev_x = v[prev_k + d + 1]
+        prev_y = prev_x - prev_k
+        run = 0
+        while x > prev_x and y > prev_y and x > 0 and y > 0:
+            x -= 1
+            y -= 1
+            run += 1
+        if run:
+            found.append((x, y, run))
+        x, y = prev_x, prev_y
+    found.reverse()
+    return found
+
+
+def _middle_snake(a, alo, ahi, b, blo, bhi, budget):
+    """Find the middle snake of Myers' linear-space algorithm as (x0, y0, x1, y1)."""
+    n = ahi - alo
+    m = bhi - blo
+    delta = n - m
+    odd = delta & 1
+    forward = {1: 0}
+    backward = {1: 0}
+    for d in range((n + m + 1) // 2 + 1):
+        budget[0] -= 2 * (d + 1)
+        if budget[0] < 0:
+            raise _TooExpensive()
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and forward[k - 1] < forward[k + 1]):
+                x = forward[k + 1]
+            else:
+                x = forward[k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[alo + x] == b[blo + y]:
+                x += 1
+                y += 1
+            forward[k] = x
+            if odd and delta - (d - 1) <= k <= delta + (d - 1) and x + backward[delta - k] >= n:
+                return x0, y0, x, y
+        for k in range(-d, d + 1, 2):
+            if k == -d or (k != d and backward[k - 1] < backward[k + 1]):
+                x = backward[k + 1]
+            else:
+                x = backward[k - 1] + 1
+            y = x - k
+            x0, y0 = x, y
+            while x < n and y < m and a[ahi - 1 - x] == b[bhi - 1 - y]:
+                x += 1
+                y += 1
+            backward[k] = x
+            if not odd and -d <= delta - k <= d and x + forward[delta - k] >= n:
+                return n - x, m - y, n - x0, m - y0
+    raise AssertionError("middle snake not found")
+
+
+def _linear_blocks(a, alo, ahi, b, blo, bhi, blocks, budget):
+    """Append matching blocks using divide and conquer on the middle snake."""
+    while alo < ahi and blo < bhi and a[alo] == b[blo]:
+        blocks.append((alo, blo, 1))
+        alo += 1
+        blo += 1
+    suffix = 0
+    while alo < ahi - suffix and blo < bhi - suffix and a[ahi - 1 - suffix] == b[bhi - 1 - suffix]:
+        suffix += 1
+    ahi -= suffix
+    bhi -= suffix
+    if alo < ahi and blo < bhi:
+        x0, y0, x1, y1 = _middle_snake(a, alo, ahi, b, blo, bhi, budget)
+        _linear_blocks(a, alo, alo + x0, b, blo, blo + y0, blocks, budget)
+        if x1 > x0:
+            blocks.append((alo + x0, blo + y0, x1 - x0))
+        _linear_blocks(a, alo + x1, ahi, b, blo + y1, bhi, blocks, budget)
+    if suffix:
+        blocks.append((ahi, bhi, suffix))
+
+
+def _myers_region(a, alo, ahi, b, blo, bhi, blocks, budget, strict=False):
+    """
+    Append the Myers matching blocks for a[alo:ahi] against b[blo:bhi].
+
+    When the budget runs out the rest of the region is reported as replaced,
+    or _TooExpensive is raised if strict is set.
+    """
+    # Trim the common prefix and suffix
+    prefix = 0
+    while alo + prefix < ahi and blo + prefix < bhi and a[alo + prefix] == b[blo + prefix]:
+        prefix += 1
+    if prefix:
+        blocks.append((alo, blo, prefix))
+        alo += prefix
+        blo += prefix
+    suffix = 0
+    while alo < ahi - suffix and blo < bhi - suffix and a[ahi - 1 - suffix] == b[bhi - 1 - suffix]:
+        suffix += 1
+
+    # Lines that only occur on one side can never match; leave them out of the search
+    common = set(a[alo:ahi - suffix]).intersection(b[blo:bhi - suffix])
+    a_index = [i for i in range(alo, ahi - suffix) if a[i] in common]
+    b_index = [j for j in range(blo, bhi - suffix) if b[j] in common]
+    if a_index and b_index:
+        fa = [a[i] for i in a_index]
+        fb = [b[j] for j in b_index]
+        found = []
+        try:
+            trace = _myers_trace(fa, fb, budget)
+            if trace is not None:
+                found = _myers_backtrack(trace, len(fa), len(fb))
+            else:
+                _linear_blocks(fa, 0, len(fa), fb, 0, len(fb), found, budget)
+        except _TooExpensive:
+            if strict:
+                raise
+            # Keep whatever prefix was matched; the rest is reported as replaced
+        for i, j, size in found:
+            for offset in range(size):
+                blocks.append((a_index[i + offset], b_index[j + offset], 1))
+
+    if suffix:
+        blocks.append((ahi - suffix, bhi - suffix, suffix))
+
+
+def _merge_blocks(blocks, n, m):
+    """Collapse adjacent matching blocks and add difflib's terminating sentinel."""
+    merged = []
+    for i, j, size in blocks:
+        if merged and merged[-1][0] + merged[-1][2] == i and merged[-1][1] + merged[-1][2] == j:
+            merged[-1] = (merged[-1][0], merged[-1][1], merged[-1][2] + size)
+        else:
+            merged.append((i, j, size))
+    merged.append((n, m, 0))
+    return merged
+
+
+def myers_matching_blocks(a, b):
+    """
+    Return difflib-style matching blocks for two sequences of interned lines.
+
+    Uses the greedy O(ND) Myers search, falling back to the linear-space
+    variant when the edit distance makes the trace too large.
+    """
+    blocks = []
+    _myers_region(a, 0, len(a), b, 0, len(b), blocks, [MAX_DIFF_COST])
+    return _merge_blocks(blocks, len(a), len(b))
+
+
+def _unique_anchors(a, alo, ahi, b, blo, bhi):
+    """Return (i, j) pairs of lines unique on both sides, in longest increasing order."""
+    counts = {}
+    for i in range(alo, ahi):
+        entry = counts.setdefault(a[i], [0, i, 0, -1])
+        entry[0] += 1
+    for j in range(blo, bhi):
+        entry = counts.get(b[j])
+        if entry is not None:
+            entry[2] += 1
+            entry[3] = j
+    pairs = sorted((i, j) for a_count, i, b_count, j in counts.values() if a_count == 1 and b_count == 1)
+
+    # Patience sort for the longest increasing subsequence of b positions
+    tails = []
+    tail_index = []
+    previous = [-1] * len(pairs)
+    for index, (i, j) in enumerate(pairs):
+        lo, hi = 0, len(tails)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if tails[mid] < j:
+                lo = mid + 1
+            else:
+                hi = mid
+        if lo == len(tails):
+            tails.append(j)
+            tail_index.append(index)
+        else:
+            tails[lo] = j
+            tail_index[lo] = index
+        previous[index] = tail_index[lo - 1] if lo else -1
+    anchors = []
+    index = tail_index[-1] if tail_index else -1
+    while index >= 0:
+        anchors.append(pairs[index])
+        index = previous[index]
+    anchors.reverse()
+    return anchors
+
+
+def _patience_region(a, alo, ahi, b, blo, bhi, blocks, budget):
+    """Split a region on unique common lines and diff the gaps with Myers."""
+    anchors = _unique_anchors(a, alo, ahi, b, blo, bhi)
+    if not anchors:
+        _myers_region(a, alo, ahi, b, blo, bhi, blocks, budget)
+        return
+    for i, j in anchors:
+        if i > alo or j > blo:
+            _patience_region(a, alo, i, b, blo, j, blocks, budget)
+        blocks.append((i, j, 1))
+        alo, blo = i + 1, j + 1
+    if alo < ahi or blo < bhi:
+        _patience_region(a, alo, ahi, b, blo, bhi, blocks, budget)
+
+
+def patience_matching_blocks(a, b):
+    """
+    Return matching blocks anchored on lines that are unique on both sides.
+
+    Heavily rewritten or reordered files stay fast because the expensive
+    Myers search only runs on the gaps between anchors. A cheap plain Myers
+    attempt runs first so small edits still get a minimal diff.
+    """
+    blocks = []
+    try:
+        _myers_region(a, 0, len(a), b, 0, len(b), blocks, [QUICK_DIFF_COST], strict=True)
+        return _merge_blocks(blocks, len(a), len(b))
+    except _TooExpensive:
+        blocks = []
+    _patience_region(a, 0, len(a), b, 0, len(b), blocks, [MAX_DIFF_COST])
+    return _merge_blocks(blocks, len(a), len(b))
+
+
+def difflib_matching_blocks(a, b):
+    """Return matching blocks computed by difflib.SequenceMatcher."""
+    return [tuple(block) for block in difflib.SequenceMatcher(None, a, b, autojunk=False).get_matching_blocks()]
+
+
+# Registered diff algorithms, keyed by name. Each takes two sequences of
+# interned lines and returns difflib-style matching blocks.
+ALGORITHMS = {
+    'patience': patience_matching_blocks,
+    'myers': myers_matching_blocks,
+    'difflib': difflib_matching_blocks,
+}
+
+
+def register_algorithm(name, matching_blocks):
+    """Register a new diff algorithm usable through DiffEngine(algorithm=name)."""
+    ALGORITHMS[name] = matching_blocks
+
+
+def blocks_to_opcodes(blocks):
+    """Convert matching blocks into difflib-style opcodes."""
+    i = j = 0
+    opcodes = []
+    for ai, bj, size in blocks:
+        tag = ''
+        if i < ai and j < bj:
+            tag = 'replace'
+        elif i < ai:
+            tag = 'delete'
+        elif j < bj:
+            tag = 'insert'
+        if tag:
+            opcodes.append((tag, i, ai, j, bj))
+        i, j = ai + size, bj + size
+        if size:
+            opcodes.append(('equal', ai, i, bj, j))
+    return opcodes
+
+
+def group_opcodes(opcodes, n=3):
+    """Group opcodes into hunks with up to n lines of context, like difflib."""
+    codes = list(opcodes)
+    if not codes:
+        codes = [('equal', 0, 1, 0, 1)]
+    if codes[0][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[0]
+        codes[0] = tag, max(i1, i2 - n), i2, max(j1, j2 - n), j2
+    if codes[-1][0] == 'equal':
+        tag, i1, i2, j1, j2 = codes[-1]
+        codes[-1] = tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)
+
+    nn = n + n
+    group = []
+    for tag, i1, i2, j1, j2 in codes:
+        if tag == 'equal' and i2 - i1 > nn:
+            group.append((tag, i1, min(i2, i1 + n), j1, min(j2, j1 + n)))
+            yield group
+            group = []
+            i1, j1 = max(i1, i2 - n), max(j1, j2 - n)
+        group.append((tag, i1, i2, j1, j2))
+    if group and not (len(group) == 1 and group[0][0] == 'equal'):
+        yield group
+
+
+def _format_range(start, stop):
+    """Format a hunk range the way difflib.unified_diff does."""
+    beginning = start + 1
+    length = stop - start
+    if length == 1:
+        return f'{beginning}'
+    if not length:
+        beginning -= 1
+    return f'{beginning},{length}'
+
+
+class DiffEngine:
+    """
+    Line diff engine used for commits, history and the GUI compare view.
+
+    Lines are interned to integers before running the configured algorithm.
+    Binary content and content above max_bytes/max_lines only produce a
+    one-line summary.
+    """
+
+    def __init__(self, algorithm='patience', max_bytes=DEFAULT_MAX_BYTES,
+                 max_lines=DEFAULT_MAX_LINES, context=3):
+        if algorithm not in ALGORITHMS:
+            raise ValueError(f"Unknown diff algorithm '{algorithm}'.")
+        self.algorithm = algorithm
+        self.max_bytes = max_bytes
+        self.max_lines = max_lines
+        self.context = context
+
+    def opcodes(self, old_lines, new_lines):
+        """Return difflib-style opcodes turning old_lines into new_lines."""
+        a, b = intern_lines(old_lines, new_lines)
+        return blocks_to_opcodes(ALGORITHMS[self.algorithm](a, b))
+
+    def too_many_lines(self, old_lines, new_lines):
+        """Return the summary recorded for content above max_lines, or None."""
+        if max(len(old_lines), len(new_lines)) > self.max_lines:
+            return [f"Diff skipped: {len(old_lines)} -> {len(new_lines)} lines "
+                    f"(limit {self.max_lines})"]
+        return None
+
+    def unified_diff(self, old_lines, new_lines):
+        """Return a unified diff as a list of lines, or None if there are no changes."""
+        summary = self.too_many_lines(old_lines, new_lines)
+        if summary:
+            return summary
+        diff = []
+        for group in group_opcodes(self.opcodes(old_lines, new_lines), self.context):
+            if not diff:
+                diff.extend(['--- ', '+++ '])
+            first, last = group[0], group[-1]
+            diff.append(f"@@ -{_format_range(first[1], last[2])} +{_format_range(first[3], last[4])} @@")
+            for tag, i1, i2, j1, j2 in group:
+                if tag == 'equal':
+                    diff.extend(' ' + line for line in old_lines[i1:i2])
+                    continue
+                if tag in ('replace', 'delete'):
+                    diff.extend('-' + line for line in old_lines[i1:i2])
+                if tag in ('replace', 'insert'):
+                    diff.extend('+' + line for line in new_lines[j1:j2])
+        return diff if diff else None
+
+    def oversized(self, old_size, new_size):
+        """Return the summary recorded for content above max_bytes, or None."""
+        if max(old_size, new_size) > self.max_bytes:
+            return [f"Diff skipped: {old_size} -> {new_size} bytes (limit {self.max_bytes})"]
+        return None
+
+    def diff_bytes(self, old_data, new_data):
+        """Diff two versions of raw file content, summarising binary or oversized files."""
+        if old_data == new_data:
+            return None
+        if is_binary(old_data) or is_binary(new_data):
+            return [f"Binary files differ: {len(old_data)} -> {len(new_data)} bytes"]
+        summary = self.oversized(len(old_data), len(new_data))
+        if summary:
+            return summary
+        try:
+            old_lines, new_lines = decode_lines(old_data), decode_lines(new_data)
+        except UnicodeDecodeError:
+            # No NUL byte, but not text either
+            return [f"Binary files differ: {len(old_data)} -> {len(new_data)} bytes"]
+        return self.unified_diff(old_lines, new_lines)
+
+
+def diff_bytes_pair(task):
+    """Process pool entry point for DiffEngine.diff_bytes."""
+    engine, old_data, new_data = task
+    return engine.diff_bytes(old_data, new_data)
+
+
+def _changes(opcodes):
+    """Return the non-equal opcodes as (i1, i2, j1, j2) ranges."""
+    return [(i1, i2, j1, j2) for tag, i1, i2, j1, j2 in opcodes if tag != 'equal']
+
+
+def _hunk(hunk_id, target_lines, target_start, target_end, source_lines, source_start, source_end,
+          context, base_lines=None, base_start=0, base_end=0):
+    """Build a conflict hunk with `context` lines of target context on either side."""
+    hunk = {
+        'id': hunk_id,
+        'target_start': target_start,
+        'target_end': target_end,
+        'source_start': source_start,
+        'source_end': source_end,
+        'target': target_lines[target_start:target_end],
+        'source': source_lines[source_start:source_end],
+        'context_before': target_lines[max(0, target_start - context):target_start],
+        'context_after': target_lines[target_end:target_end + context],
+    }
+    if base_lines is not None:
+        hunk['base'] = base_lines[base_start:base_end]
+    return hunk
+
+
+def conflict_hunks(source_lines, target_lines, base_lines=None, context=3, engine=None):
+    """
+    Extract the regions where merging source into target needs a decision.
+
+    With a merge base, only regions changed on both sides (differently) are
+    returned. Without one, every differing region of a two-way diff is a
+    hunk. Line ranges are 0-based and end-exclusive.
+    """
+    engine = engine or DiffEngine()
+    if base_lines is None:
+        hunks = []
+        for tag, i1, i2, j1, j2 in engine.opcodes(target_lines, source_lines):
+            if tag != 'equal':
+                hunks.append(_hunk(len(hunks) + 1, target_lines, i1, i2, source_lines, j1, j2, context))
+        return hunks
+
+    source_changes = _changes(engine.opcodes(base_lines, source_lines))
+    target_changes = _changes(engine.opcodes(base_lines, target_lines))
+    tagged = sorted([(i1, i2, 's', j1, j2) for i1, i2, j1, j2 in source_changes] +
+                    [(i1, i2, 't', j1, j2) for i1, i2, j1, j2 in target_changes])
+
+    # Merge changes whose base ranges overlap or touch into regions
+    regions = []
+    for change in tagged:
+        if regions and change[0] <= regions[-1]['hi']:
+            regions[-1]['hi'] = max(regions[-1]['hi'], change[1])
+            regions[-1]['changes'].append(change)
+        else:
+            regions.append({'lo': change[0], 'hi': change[1], 'changes': [change]})
+
+    hunks = []
+    shift = {'s': 0, 't': 0}
+    for region in regions:
+        lo, hi = region['lo'], region['hi']
+        side_ranges = {}
+        for side in ('s', 't'):
+            start = lo + shift[side]
+            delta = sum((j2 - j1) - (i2 - i1) for i1, i2, tag, j1, j2 in region['changes'] if tag == side)
+            side_ranges[side] = (start, start + (hi - lo) + delta)
+            shift[side] += delta
+        sides = {tag for _, _, tag, _, _ in region['changes']}
+        source_start, source_end = side_ranges['s']
+        target_start, target_end = side_ranges['t']
+        if sides != {'s', 't'} or source_lines[source_start:source_end] == target_lines[target_start:target_end]:
+            continue
+        hunks.append(_hunk(len(hunks) + 1, target_lines, target_start, target_end,
+                           source_lines, source_start, source_end, context, base_lines, lo, hi))
+    return hunks
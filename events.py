@@ -0,0 +1,81 @@
+"""
+Ref-update events for clients that follow branches.
+
+Whenever a commit, merge or new branch moves a branch, an event with the
+branch, its old and new tip trees and the paths that changed is added to a
+bounded in-memory log. Clients read it through /events, either as a
+Server-Sent Events stream or by long polling, instead of re-fetching
+branches on a timer; an idle client costs one open request.
+
+Event ids are '<stream>.<sequence>', where the stream id changes each time
+the server starts. A client whose id is from another stream, or so old
+that the events after it were dropped, is told to reset and reload.
+"""
+import time
+import uuid
+import threading
+from collections import deque
+
+# Events kept for clients that reconnect or poll late.
+EVENT_HISTORY = 1024
+
+# Events list at most this many paths; beyond it 'changed' and 'deleted' are None.
+MAX_EVENT_PATHS = 1000
+
+
+class EventLog:
+    """Recent events with sequence numbers, and a condition to wait for new ones."""
+
+    def __init__(self, size=EVENT_HISTORY):
+        self.stream = uuid.uuid4().hex[:12]
+        self.events = deque(maxlen=size)
+        self.sequence = 0
+        self.condition = threading.Condition()
+
+    def cursor(self, sequence=None):
+        return f'{self.stream}.{self.sequence if sequence is None else sequence}'
+
+    def publish(self, event):
+        """Add an event, give it an id and wake every waiting reader."""
+        with self.condition:
+            self.sequence += 1
+            event = dict(event, id=self.cursor(), time=time.time())
+            self.events.append((self.sequence, event))
+            self.condition.notify_all()
+        return event
+
+    def parse(self, cursor):
+        """Return the sequence a cursor points at, or None if it is not from this stream."""
+        stream, _, sequence = (cursor or '').partition('.')
+        if stream != self.stream or not sequence.isdigit():
+            return None
+        return int(sequence)
+
+    def read(self, cursor=None, timeout=0):
+        """
+        Return the events after cursor, waiting up to timeout seconds for one.
+
+        Returns {'events', 'cursor', 'reset'}. Without a cursor only events
+        published from now on are returned. 'reset' is true when events were
+        missed, in which case the events list is empty and the client should
+        reload what it shows and continue from the returned cursor.
+        """
+        deadline = time.monotonic() + timeout
+        with self.condition:
+            after = self.parse(cursor) if cursor else self.sequence
+            oldest = self.events[0][0] if self.events else self.sequence + 1
+            if after is None or after > self.sequence or after < oldest - 1:
+                return {'events': [], 'cursor': self.cursor(), 'reset': True}
+            while self.sequence == after:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            if self.events and after < self.events[0][0] - 1:
+                # More events arrived while waiting than the log keeps
+                return {'events': [], 'cursor': self.cursor(), 'reset': True}
+            events = [event for sequence, event in self.events if sequence > after]
+            return {'events': events, 'cursor': self.cursor(), 'reset': False}
+
+
+EVENTS = EventLog()
@@ -0,0 +1,137 @@
+"""
+Group commit for concurrent pushes.
+
+Pushes are queued instead of each committing and rewriting the branch
+metadata on its own. A single committer thread takes whatever arrived
+within a short window (up to a batch size), turns each push into a commit
+in arrival order, writes the metadata once for the whole batch with an
+fsync, and only then releases the waiting requests.
+"""
+import time
+import threading
+from collections import deque
+from metrics import phase, GROUP_COMMIT_SIZE
+
+# Seconds the committer waits for more pushes after the first one of a batch.
+DEFAULT_WINDOW = 0.005
+
+# Most pushes committed in one batch.
+DEFAULT_MAX_BATCH = 64
+
+
+class GroupCommitter:
+    """
+    Commit queued pushes in batches on one background thread.
+
+    submit() blocks until the push is committed and durable. A push that
+    fails only fails its own request: its branch worktree is reset to the
+    branch tip and the rest of the batch still commits. If the batch cannot
+    be saved, every push in it fails and its branches go back to where they
+    were before the batch.
+    """
+
+    def __init__(self, vcs, window=DEFAULT_WINDOW, max_batch=DEFAULT_MAX_BATCH):
+        self.vcs = vcs
+        self.window = window
+        self.max_batch = max(1, max_batch)
+        self.queue = deque()
+        self.condition = threading.Condition()
+        self.thread = None
+
+    def submit(self, branch, message, apply=None):
+        """
+        Queue a commit of branch and wait for it; returns the Commit.
+
+        apply() is called on the committer thread with the branch checked out,
+        just before committing, to change its worktree. Exceptions raised by
+        apply() or by the commit are re-raised here.
+        """
+        job = {'branch': branch, 'message': message, 'apply': apply,
+               'event': threading.Event(), 'commit': None, 'error': None}
+        with self.condition:
+            if self.thread is None:
+                self.thread = threading.Thread(target=self.run, name='group-commit', daemon=True)
+                self.thread.start()
+            self.queue.append(job)
+            self.condition.notify()
+        job['event'].wait()
+        if job['error'] is not None:
+            raise job['error']
+        return job['commit']
+
+    def run(self):
+        while True:
+            self.commit_batch(self.next_batch())
+
+    def next_batch(self):
+        """Wait for a first push, then for the window to pass or the batch to fill."""
+        with self.condition:
+            while not self.queue:
+                self.condition.wait()
+            deadline = time.monotonic() + self.window
+            while len(self.queue) < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                self.condition.wait(remaining)
+            return [self.queue.popleft() for _ in range(min(len(self.queue), self.max_batch))]
+
+    def commit_batch(self, batch):
+        vcs = self.vcs
+        committed = []
+        # Branch -> its ref before this batch
+        checkpoints = {}
+        GROUP_COMMIT_SIZE.observe(len(batch))
+        try:
+            with vcs.lock:
+                for job in batch:
+                    try:
+                        if vcs.switch_branch(job['branch']) is None:
+                            raise ValueError(f"Branch '{job['branch']}' does not exist.")
+                        if job['branch'] not in checkpoints:
+                            checkpoints[job['branch']] = vcs.branches.checkpoint(job['branch'])
+                        job['old_tree'] = vcs.tip_tree(job['branch'])
+                        if job['apply'] is not None:
+                            job['apply']()
+                        job['commit'] = vcs.commit(job['message'], save=False)
+                        committed.append(job)
+                    except Exception as e:
+                        job['error'] = e
+                        # Leave nothing of the failed push for the next commit to pick up
+                        if job['branch'] in vcs.branches:
+                            self.reset_worktree(job['branch'])
+                if not committed:
+                    return
+                try:
+                    with phase('group_commit', 'metadata'):
+                        vcs.save_branches(sync=True)
+                except Exception as e:
+                    for job in committed:
+                        job['commit'] = None
+                        job['error'] = e
+                    # Failed pushes must not reach the disk with a later save
+                    for branch in {job['branch'] for job in committed}:
+                        vcs.branches.restore(branch, checkpoints[branch])
+                        self.reset_worktree(branch)
+                    return
+                try:
+                    # Clients only hear of commits once they are durable
+                    for job in committed:
+                        vcs.publish_ref(job['branch'], job['old_tree'], vcs.commit_tree(job['commit']))
+                except Exception as e:
+                    print(f"Committed batch could not be announced: {e}")
+        except Exception as e:
+            # The committer thread must survive; pushes not yet answered get the error
+            print(f"Group commit failed: {e}")
+            for job in batch:
+                if job['error'] is None and job['commit'] is None:
+                    job['error'] = e
+        finally:
+            for job in batch:
+                job['event'].set()
+
+    def reset_worktree(self, branch):
+        try:
+            self.vcs.reset_worktree(branch)
+        except OSError as e:
+            print(f"Worktree of branch '{branch}' could not be reset: {e}")
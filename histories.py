@@ -0,0 +1,235 @@
+"""
+Branch histories loaded on demand.
+
+Only a small refs file (branch -> commit count and tip commit) is read at
+startup. Each branch's history lives in commits/<branch>_commits.json, one
+commit per line, and is streamed in the first time the branch is accessed.
+Histories not used recently are evicted once they are saved. Commits that
+several loaded branches have in common stay one shared object.
+"""
+import os
+import json
+import uuid
+import threading
+import weakref
+from collections import OrderedDict
+from collections.abc import MutableMapping
+
+# Number of branch histories kept in memory at once.
+RESIDENT_HISTORIES = 8
+
+
+def sync_directory(path):
+    """Flush renames in a directory to disk where the platform allows it."""
+    try:
+        fd = os.open(path, os.O_RDONLY)
+    except OSError:
+        return
+    try:
+        os.fsync(fd)
+    except OSError:
+        pass
+    finally:
+        os.close(fd)
+
+
+def remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+class BranchHistories(MutableMapping):
+    """
+    Mapping of branch name to its list of commits.
+
+    Histories changed through item assignment stay in memory until save()
+    writes them. Code that appends to a history in place must assign it back
+    (branches[name] = history) so the change is saved and not evicted.
+    """
+
+    def __init__(self, commits_path, refs_path, load_commit, resident=RESIDENT_HISTORIES):
+        self.commits_path = commits_path
+        self.refs_path = refs_path
+        self.load_commit = load_commit
+        self.resident = resident
+        # Branch -> [commit count, tip Commit or None], in creation order
+        self.refs = {}
+        self.histories = OrderedDict()
+        self.dirty = set()
+        self.shared = weakref.WeakValueDictionary()
+        self.lock = threading.RLock()
+
+    def load_refs(self):
+        """Read the refs file; returns False if there is none yet."""
+        try:
+            with open(self.refs_path, 'r') as f:
+                refs = json.load(f)
+        except FileNotFoundError:
+            return False
+        with self.lock:
+            self.refs = {branch: [ref['count'], self.share(ref['tip']) if ref.get('tip') else None]
+                         for branch, ref in refs.items()}
+        return True
+
+    def history_path(self, branch):
+        return os.path.join(self.commits_path, f'{branch}_commits.json')
+
+    def share(self, entry):
+        """Convert a JSON commit, reusing the object already loaded for the same commit."""
+        commit = self.load_commit(entry)
+        return self.shared.setdefault(commit.key(), commit)
+
+    def read_history(self, branch):
+        """Stream a branch's history from its file, one commit per line."""
+        commits = []
+        try:
+            with open(self.history_path(branch), 'r') as f:
+                for line in f:
+                    line = line.strip().rstrip(',')
+                    if line in ('', '[', ']'):
+                        continue
+                    commits.append(self.share(json.loads(line)))
+        except ValueError:
+            # Written pretty-printed by an older version; parse the file whole
+            with open(self.history_path(branch), 'r') as f:
+                commits = [self.share(entry) for entry in json.load(f)]
+        except FileNotFoundError:
+            pass
+        return commits
+
+    def write_history(self, branch, history, sync=False):
+        path = self.history_path(branch)
+        temp_path = os.path.join(self.commits_path, f'.tmp-{uuid.uuid4().hex}')
+        try:
+            with open(temp_path, 'w') as f:
+                f.write('[\n')
+                f.write(',\n'.join(json.dumps(commit.to_dict()) for commit in history))
+                f.write('\n]\n')
+                if sync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(temp_path, path)
+        except BaseException:
+            remove_quietly(temp_path)
+            raise
+
+    def write_refs(self, sync=False):
+        refs = {branch: {'count': count, 'tip': tip.to_dict() if tip is not None else None}
+                for branch, (count, tip) in self.refs.items()}
+        temp_path = self.refs_path + '.tmp'
+        try:
+            with open(temp_path, 'w') as f:
+                json.dump(refs, f, indent=4)
+                if sync:
+                    f.flush()
+                    os.fsync(f.fileno())
+            os.replace(temp_path, self.refs_path)
+        except BaseException:
+            remove_quietly(temp_path)
+            raise
+
+    def save(self, branches=None, refs=True, sync=False):
+        """
+        Write the changed histories (or only the given branches) and then the refs file.
+
+        With sync the files and the renames are flushed to disk before this returns.
+        """
+        with self.lock:
+            written = False
+            for branch in list(self.dirty if branches is None else branches):
+                if branch in self.dirty:
+                    self.write_history(branch, self.histories[branch], sync)
+                    self.dirty.discard(branch)
+                    written = True
+            if refs:
+                self.write_refs(sync)
+            if sync:
+                if written:
+                    sync_directory(self.commits_path)
+                if refs:
+                    sync_directory(os.path.dirname(self.refs_path) or '.')
+            self.evict()
+
+    def evict(self):
+        for branch in list(self.histories):
+            if len(self.histories) <= self.resident:
+                break
+            if branch not in self.dirty:
+                del self.histories[branch]
+
+    def tip(self, branch):
+        """Return the latest commit of a branch without loading its history, or None if it is empty."""
+        with self.lock:
+            return self.refs[branch][1]
+
+    def count(self, branch):
+        with self.lock:
+            return self.refs[branch][0]
+
+    def __getitem__(self, branch):
+        with self.lock:
+            if branch not in self.refs:
+                raise KeyError(branch)
+            history = self.histories.get(branch)
+            if history is not None:
+                self.histories.move_to_end(branch)
+                return history
+        history = self.read_history(branch)
+        with self.lock:
+            # Another thread may have loaded or replaced it meanwhile
+            history = self.histories.setdefault(branch, history)
+            self.histories.move_to_end(branch)
+            self.evict()
+        return history
+
+    def __setitem__(self, branch, history):
+        with self.lock:
+            self.histories[branch] = history
+            self.histories.move_to_end(branch)
+            self.refs[branch] = [len(history), history[-1] if history else None]
+            self.dirty.add(branch)
+
+    def __delitem__(self, branch):
+        with self.lock:
+            del self.refs[branch]
+            self.histories.pop(branch, None)
+            self.dirty.discard(branch)
+            self.write_refs()
+        try:
+            os.remove(self.history_path(branch))
+        except FileNotFoundError:
+            pass
+
+    def checkpoint(self, branch):
+        """Return a branch's ref, to restore() if the commits made after it cannot be saved."""
+        with self.lock:
+            return list(self.refs[branch])
+
+    def restore(self, branch, checkpoint):
+        """Drop the commits made on a branch since checkpoint, in memory and with the next save."""
+        count, tip = checkpoint
+        history = self[branch]
+        with self.lock:
+            del history[count:]
+            self.histories[branch] = history
+            self.refs[branch] = [count, tip]
+            # The failed save may already have replaced the history file
+            self.dirty.add(branch)
+
+    def discard(self, branch):
+        """Drop a branch from memory only, e.g. one whose creation could not be saved."""
+        with self.lock:
+            self.refs.pop(branch, None)
+            self.histories.pop(branch, None)
+            self.dirty.discard(branch)
+
+    def __contains__(self, branch):
+        return branch in self.refs
+
+    def __iter__(self):
+        return iter(list(self.refs))
+
+    def __len__(self):
+        return len(self.refs)
@@ -0,0 +1,240 @@
+"""
+On-demand profiling of individual requests and storage calls.
+
+A request is profiled when it carries the admin token in the X-VCS-Profile
+header, or when profiling is switched on and the request falls within the
+sample rate.
+Each profile is saved as a pstats dump (cProfile mode) or a collapsed-stack
+file (sampler mode, usable with flamegraph tools), plus a small JSON record
+with the timings of wrapped VCS calls such as commit.
+
+Configured with VCS_PROFILE_DIR, VCS_PROFILE_ENABLED, VCS_PROFILE_SAMPLE_RATE
+and VCS_PROFILE_MODE; the settings can also be changed at runtime.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import threading
+import functools
+from collections import Counter
+
+PROFILE_HEADER = 'X-VCS-Profile'
+
+MODES = ('cprofile', 'sample')
+
+# Seconds between stack samples in sampler mode.
+SAMPLE_INTERVAL = 0.005
+
+# Oldest profiles are deleted beyond this count.
+MAX_PROFILES = 200
+
+
+class StackSampler:
+    """Sample one thread's stack on a timer and count identical stacks."""
+
+    def __init__(self, thread_id, interval=SAMPLE_INTERVAL):
+        self.thread_id = thread_id
+        self.interval = interval
+        self.counts = Counter()
+        self.stop_event = threading.Event()
+        self.thread = threading.Thread(target=self.run, name='stack-sampler', daemon=True)
+
+    def start(self):
+        self.thread.start()
+
+    def run(self):
+        while not self.stop_event.wait(self.interval):
+            frame = sys._current_frames().get(self.thread_id)
+            stack = []
+            while frame is not None:
+                code = frame.f_code
+                stack.append(f"{code.co_name} ({os.path.basename(code.co_filename)}:{code.co_firstlineno})")
+                frame = frame.f_back
+            if stack:
+                self.counts[';'.join(reversed(stack))] += 1
+
+    def stop(self):
+        self.stop_event.set()
+        self.thread.join()
+
+    def dump(self, path):
+        with open(path, 'w') as f:
+            for stack, count in self.counts.most_common():
+                f.write(f"{stack} {count}\n")
+
+
+class Profile:
+    """One running profile of a request or a wrapped call."""
+
+    def __init__(self, name, mode):
+        self.id = uuid.uuid4().hex
+        self.name = name
+        self.mode = mode
+        self.created = time.time()
+        self.started = time.perf_counter()
+        self.spans = {}
+        self.collector = None
+
+    def start(self):
+        if self.mode == 'cprofile':
+            import cProfile
+            collector = cProfile.Profile()
+            try:
+                collector.enable()
+                self.collector = collector
+                return
+            except ValueError:
+                # Only one cProfile can run at a time on newer Pythons; sample instead
+                self.mode = 'sample'
+        self.collector = StackSampler(threading.get_ident())
+        self.collector.start()
+
+    def stop(self):
+        if self.mode == 'cprofile':
+            self.collector.disable()
+        else:
+            self.collector.stop()
+        return time.perf_counter() - self.started
+
+    def add_span(self, name, seconds):
+        count, total = self.spans.get(name, (0, 0.0))
+        self.spans[name] = (count + 1, total + seconds)
+
+
+class Profiler:
+    """Decide what to profile, run the collectors and keep the saved profiles."""
+
+    def __init__(self, directory=None, enabled=False, sample_rate=0.0, mode='cprofile', max_profiles=MAX_PROFILES):
+        self.directory = directory or os.getenv('VCS_PROFILE_DIR', os.path.join('repo', 'profiles'))
+        self.enabled = enabled
+        self.sample_rate = sample_rate
+        self.mode = mode
+        self.max_profiles = max_profiles
+        self.local = threading.local()
+        self.lock = threading.Lock()
+
+    def settings(self):
+        return {'enabled': self.enabled, 'sample_rate': self.sample_rate, 'mode': self.mode}
+
+    def configure(self, enabled=None, sample_rate=None, mode=None):
+        """Change the runtime settings; raises ValueError on invalid values."""
+        if sample_rate is not None and not 0 <= float(sample_rate) <= 1:
+            raise ValueError("sample_rate must be between 0 and 1.")
+        if mode is not None and mode not in MODES:
+            raise ValueError(f"mode must be one of {', '.join(MODES)}.")
+        if enabled is not None:
+            self.enabled = bool(enabled)
+        if sample_rate is not None:
+            self.sample_rate = float(sample_rate)
+        if mode is not None:
+            self.mode = mode
+        return self.settings()
+
+    def should_profile(self, requested=False):
+        if requested:
+            return True
+        return self.enabled and self.sample_rate > 0 and random.random() < self.sample_rate
+
+    def active(self):
+        return getattr(self.local, 'profile', None)
+
+    def start(self, name, mode=None):
+        """Start profiling the current thread; returns None if a profile is already running on it."""
+        if self.active() is not None:
+            return None
+        profile = Profile(name, mode if mode in MODES else self.mode)
+        profile.start()
+        self.local.profile = profile
+        return profile
+
+    def finish(self, profile, **info):
+        """Stop a profile, save it and return its record."""
+        seconds = profile.stop()
+        self.local.profile = None
+        os.makedirs(self.directory, exist_ok=True)
+        extension = 'pstats' if profile.mode == 'cprofile' else 'collapsed'
+        filename = f"{profile.id}.{extension}"
+        if profile.mode == 'cprofile':
+            profile.collector.dump_stats(os.path.join(self.directory, filename))
+        else:
+            profile.collector.dump(os.path.join(self.directory, filename))
+
+        record = dict(info, id=profile.id, name=profile.name, mode=profile.mode, file=filename,
+                      created=profile.created, seconds=round(seconds, 6),
+                      spans={name: {'calls': count, 'seconds': round(total, 6)}
+                             for name, (count, total) in profile.spans.items()})
+        with open(os.path.join(self.directory, f"{profile.id}.json"), 'w') as f:
+            json.dump(record, f)
+        self.prune()
+        return record
+
+    def list(self):
+        """Return the saved profile records, newest first."""
+        records = []
+        try:
+            names = os.listdir(self.directory)
+        except FileNotFoundError:
+            return records
+        for name in names:
+            if not name.endswith('.json'):
+                continue
+            try:
+                with open(os.path.join(self.directory, name), 'r') as f:
+                    records.append(json.load(f))
+            except (OSError, ValueError):
+                continue
+        records.sort(key=lambda record: record['created'], reverse=True)
+        return records
+
+    def dump_path(self, profile_id):
+        """Return the path of a saved dump, or None if there is no such profile."""
+        for record in self.list():
+            if record['id'] == profile_id:
+                return os.path.join(self.directory, record['file'])
+        return None
+
+    def prune(self):
+        with self.lock:
+            for record in self.list()[self.max_profiles:]:
+                for name in (record['file'], f"{record['id']}.json"):
+                    try:
+                        os.remove(os.path.join(self.directory, name))
+                    except FileNotFoundError:
+                        pass
+
+
+PROFILER = Profiler(enabled=os.getenv('VCS_PROFILE_ENABLED', '0') == '1',
+                    sample_rate=float(os.getenv('VCS_PROFILE_SAMPLE_RATE', '0')),
+                    mode=os.getenv('VCS_PROFILE_MODE', 'cprofile'))
+
+
+def profiled(name):
+    """
+    Wrap a function so it shows up by name in profiles.
+
+    Inside a profiled request the call's time is added to the profile's
+    spans; outside one, the call itself is sampled at the profiler's rate.
+    """
+    def decorator(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            profiler = PROFILER
+            profile = profiler.active()
+            if profile is None:
+                if not profiler.should_profile():
+                    return fn(*args, **kwargs)
+                profile = profiler.start(name)
+                try:
+                    return fn(*args, **kwargs)
+                finally:
+                    profiler.finish(profile, kind='call')
+            started = time.perf_counter()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                profile.add_span(name, time.perf_counter() - started)
+        return wrapper
+    return decorator
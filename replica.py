@@ -0,0 +1,235 @@
+"""
+Read replicas that follow a primary server.
+
+A replica keeps its own repository as a mirror of the primary. A background
+thread polls the primary's /refs and, for each branch that moved, fetches
+only the commits after the ones it already has (/history/<branch>?since=N)
+and the objects those commits reference that are still missing locally.
+Trees are fetched before being stored only once their children are, so a
+tree that is present locally always has its whole subtree.
+
+Reads are then served from the mirror, while writes are forwarded to the
+primary as they are. status() reports how far behind the primary the
+mirror may be.
+"""
+import time
+import hashlib
+import threading
+from datetime import datetime
+import requests
+from flask import Response, jsonify
+from trees import TREE, decode_tree
+
+# Seconds between polls of the primary's refs.
+DEFAULT_INTERVAL = 1.0
+
+# Timeout in seconds for requests to the primary.
+REQUEST_TIMEOUT = 30
+
+# Block size for streaming objects and forwarded bodies.
+STREAM_BLOCK_SIZE = 1024 * 1024
+
+# Headers that only apply to one connection and are not passed on.
+HOP_HEADERS = {'connection', 'keep-alive', 'proxy-authenticate', 'proxy-authorization', 'te', 'trailers',
+               'transfer-encoding', 'upgrade', 'host', 'content-length'}
+
+
+def commit_json(commit):
+    return commit.to_dict() if commit is not None else None
+
+
+class ReplicationError(Exception):
+    """Raised when the primary sends something the mirror cannot use."""
+
+
+class RequestBody:
+    """A request body of known length that requests streams instead of buffering."""
+
+    def __init__(self, stream, length):
+        self.stream = stream
+        self.len = length
+
+    def read(self, size=-1):
+        return self.stream.read(size)
+
+
+class Replica:
+    """Keep a VCS in sync with a primary server and forward writes to it."""
+
+    def __init__(self, vcs, primary_url, interval=DEFAULT_INTERVAL):
+        self.vcs = vcs
+        self.primary_url = primary_url.rstrip('/')
+        self.interval = interval
+        self.session = requests.Session()
+        self.wakeup = threading.Event()
+        self.thread = None
+        self.state_lock = threading.Lock()
+        # Time of the last poll that left the mirror level with the primary
+        self.synced_at = None
+        self.last_poll = None
+        self.last_error = None
+        # Branch -> commits the mirror was behind at the last poll
+        self.behind = {}
+
+    def start(self):
+        if self.thread is None:
+            self.thread = threading.Thread(target=self.run, name='replica', daemon=True)
+            self.thread.start()
+
+    def wake(self):
+        """Poll again now instead of at the next interval, e.g. after forwarding a write."""
+        self.wakeup.set()
+
+    def run(self):
+        while True:
+            try:
+                self.sync()
+            except Exception as e:
+                # Anything the primary or the store throws at us is retried on the next poll
+                with self.state_lock:
+                    self.last_error = f"{type(e).__name__}: {e}"
+                print(f"Replication from {self.primary_url} failed: {type(e).__name__}: {e}")
+            self.wakeup.wait(self.interval)
+            self.wakeup.clear()
+
+    def get(self, path, **kwargs):
+        response = self.session.get(self.primary_url + path, timeout=REQUEST_TIMEOUT, **kwargs)
+        response.raise_for_status()
+        return response
+
+    def sync(self):
+        """Bring every branch up to the primary's refs; returns the number of commits applied."""
+        started = time.time()
+        refs = self.get('/refs').json()
+        behind = {}
+        applied = 0
+        for branch, ref in refs.items():
+            local_count = self.vcs.branches.count(branch) if branch in self.vcs.branches else 0
+            local_tip = self.vcs.branches.tip(branch) if branch in self.vcs.branches else None
+            if local_count == ref['count'] and commit_json(local_tip) == ref['tip']:
+                continue
+            behind[branch] = ref['count'] - local_count
+            applied += self.sync_branch(branch, local_count, local_tip)
+
+        with self.vcs.lock:
+            for branch in [branch for branch in self.vcs.branches if branch not in refs]:
+                if branch != self.vcs.current_branch:
+                    del self.vcs.branches[branch]
+                    self.vcs.remove_worktree(branch)
+            self.vcs.save_branches()
+
+        with self.state_lock:
+            self.behind = behind
+            self.last_poll = time.time()
+            self.last_error = None
+            # Nothing that reached the primary before this poll started is missing any more
+            self.synced_at = started
+        return applied
+
+    def sync_branch(self, branch, local_count, local_tip):
+        """Fetch the commits of a branch after local_count, or the whole history if it was rewritten."""
+        data = self.get(f'/history/{branch}', params={'since': local_count}).json()
+        since = local_count
+        if local_count and data.get('base') != commit_json(local_tip):
+            # The branch no longer continues from our tip
+            data = self.get(f'/history/{branch}', params={'since': 0}).json()
+            since = 0
+
+        commits = [self.vcs.load_commit(entry) for entry in data['commits']]
+        for commit in commits:
+            self.fetch_commit_objects(commit)
+
+        with self.vcs.lock:
+            history = list(self.vcs.branches[branch]) if since and branch in self.vcs.branches else []
+            del history[since:]
+            history.extend(commits)
+            self.vcs.branches[branch] = history
+            # Clients following this replica see the same events as on the primary
+            self.vcs.publish_ref(branch, self.vcs.commit_tree(local_tip) if local_tip is not None else None,
+                                 self.vcs.tip_tree(branch))
+        return len(commits)
+
+    def fetch_commit_objects(self, commit):
+        if commit.get('diff'):
+            self.fetch_object(commit['diff'])
+        if commit.get('tree'):
+            self.fetch_tree(commit['tree'])
+        else:
+            # Commits made before trees only list their files
+            for file_hash in (commit.snapshot() or {}).values():
+                self.fetch_object(file_hash)
+
+    def fetch_tree(self, tree_hash):
+        """Fetch a tree and everything below it that is missing, storing the tree itself last."""
+        if self.vcs.has_object(tree_hash):
+            return
+        data = self.get(f'/objects/{tree_hash}').content
+        if hashlib.sha256(data).hexdigest() != tree_hash:
+            raise ReplicationError(f"Tree '{tree_hash}' does not match its hash.")
+        for _, kind, child in decode_tree(data)['entries']:
+            if kind == TREE:
+                self.fetch_tree(child)
+            else:
+                self.fetch_object(child)
+        self.vcs.write_object(tree_hash, data)
+
+    def fetch_object(self, file_hash):
+        """Stream a missing object from the primary into the local store."""
+        if self.vcs.has_object(file_hash):
+            return
+        with self.session.get(f'{self.primary_url}/objects/{file_hash}', stream=True,
+                              timeout=REQUEST_TIMEOUT) as response:
+            response.raise_for_status()
+            response.raw.decode_content = True
+            stored_hash = self.vcs.store_stream(response.raw)
+        if stored_hash != file_hash:
+            # Already so on the primary (its fsck reports it); mirror it as served
+            print(f"Object '{file_hash}' from {self.primary_url} does not match its hash.")
+            self.vcs.write_object(file_hash, self.vcs.read_object(stored_hash))
+
+    def lag_seconds(self):
+        """Upper bound on how old the newest change missing from the mirror can be, or None before the first sync."""
+        with self.state_lock:
+            return time.time() - self.synced_at if self.synced_at is not None else None
+
+    def status(self):
+        lag = self.lag_seconds()
+        with self.state_lock:
+            return {
+                'role': 'replica',
+                'primary': self.primary_url,
+                'lag_seconds': lag,
+                'last_sync': datetime.fromtimestamp(self.synced_at).isoformat() if self.synced_at else None,
+                'last_poll': datetime.fromtimestamp(self.last_poll).isoformat() if self.last_poll else None,
+                'behind': dict(self.behind),
+                'last_error': self.last_error,
+            }
+
+    def forward(self, request):
+        """Pass a request on to the primary and stream its response back."""
+        headers = {name: value for name, value in request.headers.items() if name.lower() not in HOP_HEADERS}
+        if request.content_length is not None:
+            body = RequestBody(request.stream, request.content_length)
+        else:
+            body = iter(lambda: request.stream.read(STREAM_BLOCK_SIZE), b'')
+        try:
+            url = self.primary_url + request.path
+            if request.query_string:
+                url += '?' + request.query_string.decode()
+            upstream = self.session.request(request.method, url, data=body, headers=headers,
+                                            stream=True, timeout=REQUEST_TIMEOUT)
+        except requests.RequestException as e:
+            return jsonify({"error": f"Primary is unreachable: {e}"}), 502
+        # Pick up the change this write made without waiting for the next poll
+        self.wake()
+        response_headers = [(name, value) for name, value in upstream.headers.items()
+                            if name.lower() not in HOP_HEADERS]
+        if 'Content-Length' in upstream.headers:
+            response_headers.append(('Content-Length', upstream.headers['Content-Length']))
+
+        def body_blocks():
+            try:
+                yield from upstream.raw.stream(STREAM_BLOCK_SIZE, decode_content=False)
+            finally:
+                upstream.close()
+        return Response(body_blocks(), status=upstream.status_code, headers=response_headers)
@@ -1,22 +1,191 @@
-from flask import Flask, request, jsonify, send_file
+from flask import Flask, Response, g, request, jsonify, send_file
+from werkzeug.exceptions import RequestEntityTooLarge
 import os
+import hmac
 import json
+import multiprocessing
 from datetime import datetime
-from vcs import VCS
+from vcs import VCS, GC_GRACE_PERIOD, BranchMoved, ObjectTooLarge, is_branch_name, is_object_name, is_safe_path
+from suggestions import SuggestionJobs, TooManyJobs
+from group_commit import DEFAULT_MAX_BATCH, DEFAULT_WINDOW, GroupCommitter
+from replica import DEFAULT_INTERVAL, Replica
+import time
+import metrics
+from profiling import PROFILER, PROFILE_HEADER
+from trees import diff_trees, flatten
+from sparse import PathFilter
+from events import EVENTS
 
 app = Flask(__name__)
 
+# Upload limits in bytes: a whole request body, and a single file or object within it
+MAX_REQUEST_BYTES = int(os.getenv('VCS_MAX_REQUEST_BYTES', 1024 * 1024 * 1024))
+MAX_FILE_BYTES = int(os.getenv('VCS_MAX_FILE_BYTES', 512 * 1024 * 1024))
+
+# Flask answers 413 before reading a body whose Content-Length is over the limit
+app.config['MAX_CONTENT_LENGTH'] = MAX_REQUEST_BYTES
+
 # Initialize the VCS
 vcs = VCS()
 
+# Pushes arriving within the window are committed together with one metadata write
+group_commits = GroupCommitter(vcs, window=float(os.getenv('VCS_GROUP_COMMIT_WINDOW', DEFAULT_WINDOW)),
+                               max_batch=int(os.getenv('VCS_GROUP_COMMIT_BATCH', DEFAULT_MAX_BATCH)))
+
+# Set to the primary's URL to run this server as a read replica of it
+PRIMARY_URL = os.getenv('VCS_PRIMARY_URL')
+replica = Replica(vcs, PRIMARY_URL, interval=float(os.getenv('VCS_REPLICA_INTERVAL', DEFAULT_INTERVAL))) \
+    if PRIMARY_URL else None
+# Spawned VCS worker processes import this module again when it is run as a script
+if replica is not None and multiprocessing.parent_process() is None:
+    replica.start()
+
+# On a replica these stay local; every other non-GET request goes to the primary,
+# as do GETs of state that only the primary has
+LOCAL_ENDPOINTS = {'profile_settings', 'gc', 'fsck'}
+FORWARDED_READS = {'chat_result'}
+
+# Seconds an /events request waits for an event: the long-poll default and cap,
+# and the keepalive interval of an event stream
+EVENTS_POLL_TIMEOUT = 25
+EVENTS_MAX_TIMEOUT = 60
+EVENTS_KEEPALIVE = 15
+
+# Raised when a push puts a file where a directory is, or the other way round
+APPLY_ERRORS = (FileExistsError, NotADirectoryError, IsADirectoryError)
+
+# Background jobs for conflict-assistant suggestions
+suggestion_jobs = SuggestionJobs()
+
+# Profiling requests and admin endpoints must present this token; without one
+# configured they are refused and only sampled profiling can run
+ADMIN_TOKEN = os.getenv('VCS_ADMIN_TOKEN')
+
+def is_admin(token):
+    return bool(ADMIN_TOKEN) and hmac.compare_digest(token or '', ADMIN_TOKEN)
+
+# Shortest gc grace period accepted over HTTP, in seconds; anything shorter could
+# sweep objects uploaded for a push that has not committed yet
+MIN_GC_GRACE_PERIOD = max(float(os.getenv('VCS_MIN_GC_GRACE_PERIOD', 60 * 60)), 1.0)
+
+@app.before_request
+def start_timer():
+    g.request_started = time.perf_counter()
+
+    # The header asks for this request to be profiled; otherwise it may be sampled
+    header = request.headers.get(PROFILE_HEADER)
+    requested = bool(header) and header != '0' and is_admin(header)
+    if PROFILER.should_profile(requested):
+        route = request.url_rule.rule if request.url_rule else 'unmatched'
+        g.profile = PROFILER.start(f"{request.method} {route}")
+
+@app.before_request
+def forward_to_primary():
+    if replica is None or request.endpoint in LOCAL_ENDPOINTS:
+        return None
+    if request.method in ('GET', 'HEAD', 'OPTIONS') and request.endpoint not in FORWARDED_READS:
+        return None
+    return replica.forward(request)
+
+@app.after_request
+def report_lag(response):
+    if replica is not None:
+        lag = replica.lag_seconds()
+        response.headers['X-Replication-Lag'] = f'{lag:.3f}' if lag is not None else 'unknown'
+    return response
+
+@app.after_request
+def record_request(response):
+    """Record latency and body sizes per route; unknown paths share one label."""
+    started = g.pop('request_started', None)
+    if started is None:
+        return response
+    route = request.url_rule.rule if request.url_rule else 'unmatched'
+    metrics.REQUEST_DURATION.observe(time.perf_counter() - started, route=route,
+                                     method=request.method, status=response.status_code)
+    metrics.REQUEST_BYTES.inc(request.content_length or 0, route=route)
+    metrics.RESPONSE_BYTES.inc(response.content_length or 0, route=route)
+
+    profile = g.pop('profile', None)
+    if profile is not None:
+        record = PROFILER.finish(profile, kind='request', path=request.path, status=response.status_code)
+        response.headers['X-VCS-Profile-Id'] = record['id']
+    return response
+
+@app.teardown_request
+def stop_profile(error=None):
+    # A handler that raised never reaches after_request
+    profile = g.pop('profile', None)
+    if profile is not None:
+        PROFILER.finish(profile, kind='request', path=request.path, status=500)
+
+@app.route('/profiles', methods=['GET'])
+def list_profiles():
+    """
+    List the saved request and call profiles, newest first.
+    """
+    if not is_admin(request.headers.get('X-Admin-Token')):
+        return jsonify({"error": "Admin token required."}), 403
+    limit = request.args.get('limit', 50, type=int)
+    return jsonify(PROFILER.list()[:limit]), 200
+
+@app.route('/profiles/settings', methods=['GET', 'POST'])
+def profile_settings():
+    """
+    Show or change profiling: 'enabled', 'sample_rate' (0-1) and 'mode' ('cprofile' or 'sample').
+    """
+    if not is_admin(request.headers.get('X-Admin-Token')):
+        return jsonify({"error": "Admin token required."}), 403
+    if request.method == 'GET':
+        return jsonify(PROFILER.settings()), 200
+    data = request.get_json(silent=True) or {}
+    try:
+        settings = PROFILER.configure(enabled=data.get('enabled'), sample_rate=data.get('sample_rate'),
+                                      mode=data.get('mode'))
+        return jsonify(settings), 200
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/profiles/<profile_id>', methods=['GET'])
+def download_profile(profile_id):
+    """
+    Download a profile dump: pstats for cProfile, collapsed stacks for the sampler.
+    """
+    if not is_admin(request.headers.get('X-Admin-Token')):
+        return jsonify({"error": "Admin token required."}), 403
+    path = PROFILER.dump_path(profile_id)
+    if path is None or not os.path.exists(path):
+        return jsonify({"error": f"Profile '{profile_id}' does not exist."}), 404
+    return send_file(os.path.abspath(path), as_attachment=True, download_name=os.path.basename(path))
+
+@app.errorhandler(RequestEntityTooLarge)
+def request_too_large(error):
+    return jsonify({"error": f"Request body is larger than the {MAX_REQUEST_BYTES} byte limit."}), 413
+
+@app.route('/metrics', methods=['GET'])
+def metrics_endpoint():
+    """
+    Expose request, object-store, cache and phase metrics in the Prometheus text format.
+    """
+    return Response(metrics.REGISTRY.render(), content_type=metrics.CONTENT_TYPE)
+
 @app.route('/push', methods=['POST'])
 def push_changes():
     """
     Handle client push requests and manually authorize changes to be committed.
+
+    Besides a single 'filename'/'content', a push can carry several changes
+    as one commit: 'files' maps names to new text content, 'objects' maps
+    names to the hash of content already streamed to /objects, 'chunked' maps
+    names to the 'hash' and 'manifest' of large files uploaded as chunks, and
+    'deleted' lists names to remove.
     """
     # Get the data from the request (filename, content, branch)
     data = request.get_json()
-    
+
+    if data and 'branch' in data and any(key in data for key in ('files', 'objects', 'chunked', 'deleted')):
+        return push_many(data)
+
     if not data or 'filename' not in data or 'content' not in data or 'branch' not in data:
         return jsonify({"error": "Invalid data. Requires 'filename', 'content', and 'branch'."}), 400
 
@@ -24,6 +193,11 @@ def push_changes():
     filename = data['filename']
     content = data['content']
 
+    if not is_safe_path(filename):
+        return jsonify({"error": "Invalid file name."}), 400
+    if isinstance(content, str) and len(content.encode()) > MAX_FILE_BYTES:
+        return jsonify({"error": f"'{filename}' is larger than the {MAX_FILE_BYTES} byte limit."}), 413
+
     # Check if the branch exists; if not, return an error
     if branch not in vcs.branches:
         return jsonify({"error": f"Branch '{branch}' does not exist."}), 404
@@ -35,50 +209,373 @@ def push_changes():
     # if user_input != "yes":
     #     return jsonify({"message": "Push denied by server."}), 403
 
-    # Switch to the target branch
-    vcs.switch_branch(branch)
+    # Add the file to the target branch and commit it with any concurrent pushes
+    try:
+        group_commits.submit(branch, f"Updated {filename} on branch '{branch}' from client.",
+                             lambda: vcs.add_file(filename, content))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+    except APPLY_ERRORS as e:
+        return jsonify({"error": f"Changes could not be applied: {e.strerror}."}), 400
+
+    return jsonify({"message": f"Changes committed to branch '{branch}' successfully."}), 200
+
+def push_many(data):
+    """
+    Commit several added, modified and deleted files at once.
+    """
+    branch = data['branch']
+    files = data.get('files', {})
+    objects = data.get('objects', {})
+    chunked = data.get('chunked', {})
+    deleted = data.get('deleted', [])
+
+    if (not isinstance(files, dict) or not isinstance(objects, dict) or not isinstance(chunked, dict)
+            or not isinstance(deleted, list)):
+        return jsonify({"error": "Invalid data. 'files', 'objects' and 'chunked' must be objects "
+                                 "and 'deleted' a list."}), 400
+    names = list(files) + list(objects) + list(chunked) + deleted
+    if not all(is_safe_path(name) for name in names):
+        return jsonify({"error": "Invalid file name."}), 400
+    if branch not in vcs.branches:
+        return jsonify({"error": f"Branch '{branch}' does not exist."}), 404
+    base = data.get('base')
+    if 'base' in data and base != 'empty' and not is_object_name(base):
+        return jsonify({"error": "Invalid 'base'. Requires a tree hash or 'empty'."}), 400
+
+    for filename, content in files.items():
+        if not isinstance(content, str):
+            return jsonify({"error": f"Invalid content for '{filename}'."}), 400
+        if len(content.encode()) > MAX_FILE_BYTES:
+            return jsonify({"error": f"'{filename}' is larger than the {MAX_FILE_BYTES} byte limit."}), 413
+    for filename, file_hash in objects.items():
+        if not is_object_name(file_hash) or not vcs.has_object(file_hash):
+            return jsonify({"error": f"Object for '{filename}' has not been uploaded."}), 400
+
+    for filename, entry in chunked.items():
+        if not isinstance(entry, dict) or not is_object_name(entry.get('hash')):
+            return jsonify({"error": f"Invalid object hash for '{filename}'."}), 400
+        if not isinstance(entry.get('manifest'), dict):
+            return jsonify({"error": f"Invalid manifest for '{filename}'."}), 400
+        try:
+            vcs.store_manifest(entry['hash'], entry.get('manifest'))
+        except ValueError as e:
+            return jsonify({"error": str(e)}), 400
+
+    def apply():
+        # Checked on the committer thread, so no other push can land in between
+        if 'base' in data:
+            vcs.check_tip(branch, None if base == 'empty' else base)
+        for filename, content in files.items():
+            vcs.add_file(filename, content)
+        for filename, file_hash in objects.items():
+            vcs.restore_version(filename, file_hash)
+        for filename, entry in chunked.items():
+            vcs.restore_version(filename, entry['hash'])
+        for filename in deleted:
+            vcs.remove_file(filename)
+
+    message = data.get('message') or f"Updated {len(names)} file(s) on branch '{branch}' from client."
+    try:
+        commit = group_commits.submit(branch, message, apply)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+    except BranchMoved as e:
+        return jsonify({"error": str(e)}), 409
+    except APPLY_ERRORS as e:
+        return jsonify({"error": f"Changes could not be applied: {e.strerror}."}), 400
+
+    return jsonify({"message": f"Changes committed to branch '{branch}' successfully.",
+                    "changed": len(files) + len(objects) + len(chunked), "deleted": len(deleted),
+                    "tree": vcs.commit_tree(commit)}), 200
+
+@app.route('/objects/missing', methods=['POST'])
+def missing_objects():
+    """
+    Report which of the given object hashes the server does not have yet.
+    """
+    data = request.get_json(silent=True) or {}
+    hashes = data.get('hashes')
+    if not isinstance(hashes, list):
+        return jsonify({"error": "Invalid data. Requires a 'hashes' list."}), 400
+
+    missing = [file_hash for file_hash in hashes if not is_object_name(file_hash) or not vcs.has_object(file_hash)]
+    return jsonify({"missing": missing}), 200
+
+@app.route('/objects/<file_hash>', methods=['PUT'])
+def upload_object(file_hash):
+    """
+    Store a single object (a file or a chunk of a large file) sent as the raw request body.
+
+    The body is streamed into the object store and hashed on the way, so
+    binary content is kept byte for byte and never held in memory. Uploads
+    over the per-file limit are refused with 413, before reading when the
+    Content-Length says so and otherwise as soon as the limit is passed.
+    """
+    if not is_object_name(file_hash):
+        return jsonify({"error": "Invalid object hash."}), 400
+    if request.content_length is not None and request.content_length > MAX_FILE_BYTES:
+        return jsonify({"error": f"Object is larger than the {MAX_FILE_BYTES} byte limit."}), 413
+
+    try:
+        stored_hash = vcs.store_stream(request.stream, max_size=MAX_FILE_BYTES)
+    except ObjectTooLarge as e:
+        return jsonify({"error": str(e)}), 413
+    if stored_hash != file_hash:
+        # The content is kept under its real hash until gc sweeps it
+        return jsonify({"error": "Content does not match the object hash."}), 400
+
+    return jsonify({"message": f"Object '{file_hash}' stored."}), 200
+
+@app.route('/objects/<file_hash>', methods=['GET'])
+def download_object(file_hash):
+    """
+    Stream the content of an object by hash.
+
+    Objects never change once stored, so clients may cache them indefinitely.
+    """
+    if not is_object_name(file_hash) or not vcs.has_object(file_hash):
+        return jsonify({"error": f"Object '{file_hash}' does not exist."}), 404
+
+    response = Response(vcs.iter_object(file_hash), mimetype='application/octet-stream')
+    response.headers['Content-Length'] = str(vcs.object_size(file_hash))
+    response.headers['Cache-Control'] = 'public, max-age=31536000, immutable'
+    response.set_etag(file_hash)
+    return response
+
+@app.route('/manifest/<branch>', methods=['GET'])
+def branch_manifest(branch):
+    """
+    Return the path -> hash manifest of a branch's latest commit.
+
+    The ETag is the root tree hash, so an unchanged branch answers 304 without
+    the tree being read. With ?since=<tree hash> (a previous ETag) only the
+    difference is sent, as {"changed": {path: hash}, "deleted": [path]}, and
+    the response carries an X-Manifest-Delta header. ?paths= limits the
+    manifest to matching paths (see sparse_options).
+    """
+    paths = PathFilter.parse(request.args.get('paths'))
+    try:
+        with vcs.lock:
+            root = vcs.tip_tree(branch)
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+
+    etag = root or 'empty'
+    if etag in request.if_none_match:
+        response = Response(status=304)
+        response.set_etag(etag)
+        return response
+
+    since = request.args.get('since')
+    if since and (since == 'empty' or (is_object_name(since) and vcs.has_object(since))):
+        changed = {}
+        deleted = []
+        try:
+            for path, _, new_hash in diff_trees(None if since == 'empty' else since, root, vcs.read_tree,
+                                                include=paths or None):
+                if new_hash is None:
+                    deleted.append(path)
+                else:
+                    changed[path] = new_hash
+        except (FileNotFoundError, ValueError):
+            return jsonify({"error": f"'{since}' is not a tree."}), 400
+        response = jsonify({"changed": changed, "deleted": deleted})
+        response.headers['X-Manifest-Delta'] = since
+    else:
+        snapshot = (flatten(root, vcs.read_tree, include=paths) if paths else vcs.flatten_tree(root)) if root else {}
+        response = jsonify(snapshot)
+    response.set_etag(etag)
+    return response
+
+@app.route('/push_manifest', methods=['POST'])
+def push_manifest():
+    """
+    Commit a large file whose chunks were uploaded beforehand through /objects.
+    """
+    data = request.get_json(silent=True)
+
+    if not data or not all(key in data for key in ('filename', 'hash', 'manifest', 'branch')):
+        return jsonify({"error": "Invalid data. Requires 'filename', 'hash', 'manifest', and 'branch'."}), 400
+
+    branch = data['branch']
+    filename = data['filename']
+    file_hash = data['hash']
 
-    # Add the file to the VCS and commit the changes
-    vcs.add_file(filename, content)
-    vcs.commit(f"Updated {filename} on branch '{branch}' from client.")
+    if branch not in vcs.branches:
+        return jsonify({"error": f"Branch '{branch}' does not exist."}), 404
+    if not is_safe_path(filename):
+        return jsonify({"error": "Invalid file name."}), 400
+    if not is_object_name(file_hash):
+        return jsonify({"error": "Invalid object hash."}), 400
+
+    try:
+        vcs.store_manifest(file_hash, data['manifest'])
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+
+    try:
+        group_commits.submit(branch, f"Updated {filename} on branch '{branch}' from client.",
+                             lambda: vcs.restore_version(filename, file_hash))
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
 
     return jsonify({"message": f"Changes committed to branch '{branch}' successfully."}), 200
 
+@app.route('/refs', methods=['GET'])
+def branch_refs():
+    """
+    Return every branch's commit count and latest commit without loading any history.
+    """
+    with vcs.lock:
+        refs = {branch: {'count': vcs.branches.count(branch), 'tip': vcs.branches.tip(branch)}
+                for branch in vcs.branches}
+    return jsonify({branch: dict(ref, tip=ref['tip'].to_dict() if ref['tip'] is not None else None)
+                    for branch, ref in refs.items()}), 200
+
+@app.route('/history/<branch>', methods=['GET'])
+def branch_history(branch):
+    """
+    Return the commits of a branch after the first ?since=N of them.
+
+    'base' is commit N itself (None when N is 0), so a follower can check its
+    copy still leads up to the new commits.
+    """
+    if branch not in vcs.branches:
+        return jsonify({"error": f"Branch '{branch}' does not exist."}), 404
+    try:
+        since = max(0, int(request.args.get('since', 0)))
+    except ValueError:
+        return jsonify({"error": "'since' must be a number."}), 400
+
+    with vcs.lock:
+        history = vcs.branches[branch]
+        base = history[since - 1].to_dict() if 0 < since <= len(history) else None
+        commits = [commit.to_dict() for commit in history[since:]]
+    return jsonify({"count": len(history), "base": base, "commits": commits}), 200
+
+@app.route('/replication', methods=['GET'])
+def replication_status():
+    """
+    Report whether this server is a primary or a replica, and a replica's lag behind its primary.
+    """
+    if replica is None:
+        return jsonify({"role": "primary"}), 200
+    return jsonify(replica.status()), 200
+
+@app.route('/events', methods=['GET'])
+def ref_events():
+    """
+    Wait for branches to move, by Server-Sent Events or long polling.
+
+    Each 'ref' event has the branch, its old and new tip trees (the manifest
+    ETags), its commit count and the changed and deleted paths. With
+    'Accept: text/event-stream' events are streamed as they happen, resuming
+    after Last-Event-ID. Otherwise the request returns as soon as there are
+    events after ?after=<cursor>, or empty after ?timeout= seconds, with the
+    cursor to pass next. 'reset' means events were missed and the client
+    should reload what it shows.
+    """
+    cursor = request.headers.get('Last-Event-ID') or request.args.get('after')
+    if 'text/event-stream' in request.headers.get('Accept', ''):
+        def stream(cursor):
+            if not cursor:
+                cursor = EVENTS.cursor()
+                yield f"id: {cursor}\nevent: ready\ndata: {{}}\n\n"
+            while True:
+                result = EVENTS.read(cursor, timeout=EVENTS_KEEPALIVE)
+                cursor = result['cursor']
+                if result['reset']:
+                    yield f"id: {cursor}\nevent: reset\ndata: {{}}\n\n"
+                elif not result['events']:
+                    # Comments keep proxies from closing an idle stream
+                    yield ": keepalive\n\n"
+                for event in result['events']:
+                    yield f"id: {event['id']}\nevent: {event['type']}\ndata: {json.dumps(event)}\n\n"
+        return Response(stream(cursor), mimetype='text/event-stream',
+                        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'})
+
+    try:
+        timeout = min(max(float(request.args.get('timeout', EVENTS_POLL_TIMEOUT)), 0), EVENTS_MAX_TIMEOUT)
+    except ValueError:
+        return jsonify({"error": "'timeout' must be a number."}), 400
+    return jsonify(EVENTS.read(cursor, timeout=timeout)), 200
+
+def sparse_options():
+    """
+    Read the ?depth=N and ?paths=... options of partial pulls and clones; raises ValueError.
+
+    depth limits history to the latest N commits. paths is a comma-separated
+    list of directory prefixes or globs (see sparse.py).
+    """
+    depth = request.args.get('depth')
+    depth = int(depth) if depth else None
+    if depth is not None and depth < 0:
+        raise ValueError("'depth' must not be negative.")
+    return depth, PathFilter.parse(request.args.get('paths'))
+
 @app.route('/clone', methods=['GET'])
 def clone_repo():
     """
     Handle repo cloning by returning the commit history and branch structure.
+
+    ?depth=N returns only the latest N commits of each branch, and ?paths=
+    only the commits that changed a matching path.
     """
-    return jsonify(vcs.branches), 200
+    try:
+        depth, paths = sparse_options()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
+    return jsonify(vcs.export_branches(depth=depth, include=paths or None)), 200
 
 @app.route('/pull/<branch>', methods=['GET'])
 def pull_changes(branch):
     """
     Pull the latest version of the specified file from a specific branch.
+
+    ?depth=N only looks at files in the latest N commits, and ?paths= only
+    at matching paths; other subtrees are not read. Binary and missing files
+    are left out and counted in X-Skipped-Files; clients fetch binaries
+    through /manifest and /objects.
     """
     if branch not in vcs.branches:
         return jsonify({"error": f"Branch '{branch}' does not exist."}), 404
+    try:
+        depth, paths = sparse_options()
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 400
 
-    # Switch to the target branch
-    vcs.switch_branch(branch)
+    with vcs.lock:
+        # Switch to the target branch
+        vcs.switch_branch(branch)
 
-    # Get the snapshot for the branch
-    branch_snapshots = vcs.branches.get(branch, {})
-    
-    if not branch_snapshots:
-        return jsonify({"error": f"No files found for branch '{branch}'."}), 404
+        # Get the snapshot for the branch
+        branch_snapshots = vcs.branches.get(branch, {})
+        if depth is not None:
+            branch_snapshots = branch_snapshots[len(branch_snapshots) - depth:] if depth else []
 
-    # Create a dictionary to hold the file contents
-    files = {}
-    
-    for snapshot in branch_snapshots:
-        for filename, file_hash in snapshot['snapshot'].items():
+        if not branch_snapshots:
+            return jsonify({"error": f"No files found for branch '{branch}'."}), 404
+
+        # Later commits win, so each file's content is read only once
+        hashes = {}
+        for commit in branch_snapshots:
+            hashes.update(vcs.snapshot(commit, include=paths or None))
+
+        # Create a dictionary to hold the file contents
+        files = {}
+        skipped = 0
+
+        for filename, file_hash in hashes.items():
             # Get the content of the file based on its hash
             file_content = vcs.get_file_content_by_hash(file_hash)
-            files[filename] = ''.join(file_content)  # Convert list to string
+            if file_content is None and vcs.object_size(file_hash) != 0:
+                skipped += 1
+                continue
+            files[filename] = ''.join(file_content or [])  # Convert list to string
 
     # Return the list of all files and their contents in the branch
-    return jsonify(files), 200
+    return jsonify(files), 200, {'X-Skipped-Files': str(skipped)}
 
     # file_path = os.path.join(vcs.files_path, filename)
     
@@ -87,20 +584,54 @@ def pull_changes(branch):
     # else:
     #     return jsonify({"error": "File not found"}), 404
 
+@app.route('/branch_info/<branch>', methods=['GET'])
+def branch_info(branch):
+    """
+    Return the commit and file counts of a branch without any file content.
+    """
+    try:
+        with vcs.lock:
+            info = vcs.branch_info(branch)
+        return jsonify(info), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+
+@app.route('/compare/<source_branch>/<target_branch>', methods=['GET'])
+def compare_branches(source_branch, target_branch):
+    """
+    Compare the tip snapshots of two branches by hash.
+
+    Repeat the 'path' query parameter to get diffs for those files, and add
+    content=1 to include their text on both branches.
+    """
+    paths = request.args.getlist('path')
+    content = request.args.get('content', '0') not in ('0', 'false', '')
+
+    try:
+        with vcs.lock:
+            result = vcs.compare_branches(source_branch, target_branch, paths=paths, content=content)
+        return jsonify(result), 200
+    except ValueError as e:
+        return jsonify({"error": str(e)}), 404
+
 @app.route('/create_branch', methods=['POST'])
 def create_branch():
     """
     Create a new branch in the repository.
     """
-    data = request.get_json()
+    data = request.get_json(silent=True)
     
-    if 'branch_name' not in data:
+    if not data or 'branch_name' not in data:
         return jsonify({"error": "Branch name is required."}), 400
 
     branch_name = data['branch_name']
+    if not is_branch_name(branch_name):
+        return jsonify({"error": "Invalid branch name. It must not contain '/', '\\' or '..' "
+                                 "or start with '.'."}), 400
 
     # Create a new branch
-    success = vcs.create_branch(branch_name)
+    with vcs.lock:
+        success = vcs.create_branch(branch_name)
     if success:
         return jsonify({"message": f"Branch '{branch_name}' created successfully."}), 200
     else:
@@ -116,21 +647,94 @@ def merge():
     target_branch = data.get('target_branch')
 
     try:
-        vcs.merge(source_branch, target_branch)
+        with vcs.lock:
+            vcs.merge(source_branch, target_branch)
         return jsonify({"message": f"Successfully merged {source_branch} into {target_branch}."}), 200
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
     
 @app.route('/chat', methods=['POST'])
 def chat():
-    data = request.get_json()
+    """
+    Queue a conflict-assistant suggestion and return its job id right away.
+
+    Either name a file on two branches ('source_branch', 'target_branch',
+    'filename'), so the server extracts the conflicting hunks against the merge
+    base, or send 'conflicts' as [source, target] contents for a two-way diff.
+    """
+    data = request.get_json(silent=True) or {}
     conflicts = data.get("conflicts")
 
     try:
-        out = vcs.chat(conflicts)
-        return jsonify({"message": out}), 200
+        if conflicts is None:
+            with vcs.lock:
+                versions = vcs.conflict_versions(data.get('source_branch'), data.get('target_branch'),
+                                                 data.get('filename'))
+            job = suggestion_jobs.submit(('versions',) + versions, vcs.suggest_for_versions, *versions)
+        elif isinstance(conflicts, list) and len(conflicts) == 2:
+            source, target = conflicts
+            job = suggestion_jobs.submit(SuggestionJobs.content_key(source, target),
+                                         vcs.suggest_conflicts, source, target)
+        else:
+            return jsonify({"error": "Invalid data. Requires 'conflicts' as [source, target]."}), 400
+        return jsonify(job), 202
     except ValueError as e:
         return jsonify({"error": str(e)}), 400
+    except TooManyJobs as e:
+        return jsonify({"error": str(e)}), 429
+
+@app.route('/chat/<job_id>', methods=['GET'])
+def chat_result(job_id):
+    """
+    Return a suggestion job, long-polling for up to `wait` seconds until it finishes.
+    """
+    wait = request.args.get('wait', 0, type=float)
+    job = suggestion_jobs.get(job_id, wait=wait)
+    if job is None:
+        return jsonify({"error": f"Job '{job_id}' does not exist."}), 404
+    return jsonify(job), 200
+
+@app.route('/gc', methods=['POST'])
+def gc():
+    """
+    Sweep objects unreachable from every branch and optionally repack the rest.
+
+    Requires the admin token; 'grace_period' may not be below MIN_GC_GRACE_PERIOD.
+    """
+    if not is_admin(request.headers.get('X-Admin-Token')):
+        return jsonify({"error": "Admin token required."}), 403
+    data = request.get_json(silent=True) or {}
+    repack = bool(data.get('repack', False))
+    try:
+        grace_period = float(data.get('grace_period', GC_GRACE_PERIOD))
+    except (TypeError, ValueError):
+        return jsonify({"error": "'grace_period' must be a number."}), 400
+    # Written so that NaN is refused as well
+    if not grace_period >= MIN_GC_GRACE_PERIOD:
+        return jsonify({"error": f"'grace_period' must be at least {MIN_GC_GRACE_PERIOD:g} seconds."}), 400
+
+    try:
+        report = vcs.gc(grace_period=grace_period, repack=repack)
+        return jsonify(report), 200
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
+
+@app.route('/fsck', methods=['POST'])
+def fsck():
+    """
+    Check the integrity of stored objects and snapshot references. Requires the admin token.
+    """
+    if not is_admin(request.headers.get('X-Admin-Token')):
+        return jsonify({"error": "Admin token required."}), 403
+    data = request.get_json(silent=True) or {}
+    workers = data.get('workers')
+    incremental = bool(data.get('incremental', False))
+
+    try:
+        report = vcs.fsck(workers=int(workers) if workers else None, incremental=incremental)
+        return jsonify(report), 200
+    except (TypeError, ValueError) as e:
+        return jsonify({"error": str(e)}), 400
 
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=8888)  # Adjust port as needed
+    app.run(host='0.0.0.0', port=int(os.getenv('VCS_PORT', 8888)))
@@ -0,0 +1,63 @@
+"""
+Path filters for sparse pulls and clones.
+
+A filter is a list of patterns. A pattern with a glob character (* ? [)
+is matched against the whole '/'-separated path with fnmatch, where *
+also matches '/'. Any other pattern is a prefix: it selects the path
+itself and everything inside it as a directory. An empty filter selects
+every path.
+
+The same module is used by the server, to prune tree walks to what was
+asked for, and by the client, to keep a partial checkout partial.
+"""
+from fnmatch import fnmatchcase
+
+GLOB_CHARS = '*?['
+
+
+def is_glob(pattern):
+    return any(char in pattern for char in GLOB_CHARS)
+
+
+class PathFilter:
+    """Select paths by directory prefix or glob."""
+
+    def __init__(self, patterns=()):
+        self.patterns = [pattern.strip().strip('/') if not is_glob(pattern) else pattern.strip()
+                         for pattern in patterns if pattern and pattern.strip().strip('/')]
+
+    @classmethod
+    def parse(cls, value):
+        """Build a filter from a comma-separated list of patterns, as used in query strings."""
+        return cls((value or '').split(','))
+
+    def __bool__(self):
+        return bool(self.patterns)
+
+    def __str__(self):
+        return ','.join(self.patterns)
+
+    def matches(self, path):
+        if not self.patterns:
+            return True
+        for pattern in self.patterns:
+            if is_glob(pattern):
+                if fnmatchcase(path, pattern):
+                    return True
+            elif path == pattern or path.startswith(pattern + '/'):
+                return True
+        return False
+
+    def may_contain(self, directory):
+        """Check whether any path inside directory ('a/b/') can match, so other subtrees are skipped."""
+        if not self.patterns:
+            return True
+        for pattern in self.patterns:
+            if is_glob(pattern):
+                # Only the literal part before the first glob character constrains the directory
+                literal = pattern[:min(pattern.index(char) for char in GLOB_CHARS if char in pattern)]
+            else:
+                literal = pattern + '/'
+            if directory.startswith(literal) or literal.startswith(directory):
+                return True
+        return False
@@ -0,0 +1,204 @@
+import time
+import uuid
+import hashlib
+import threading
+from collections import OrderedDict, deque
+from metrics import CACHE_REQUESTS
+
+# Number of assistant calls allowed to run at the same time.
+DEFAULT_MAX_WORKERS = 2
+
+# Jobs queued or running beyond this count are rejected instead of queued.
+DEFAULT_MAX_PENDING = 32
+
+# Seconds a job may run before it is reported as timed out.
+DEFAULT_TIMEOUT = 60
+
+# Finished suggestions are cached by content hashes with these bounds.
+DEFAULT_CACHE_SIZE = 256
+DEFAULT_CACHE_TTL = 60 * 60
+
+# Finished jobs are kept this long so clients can still fetch the result.
+JOB_RETENTION = 10 * 60
+
+# Longest a single long-poll request may wait for a job to finish.
+MAX_WAIT = 30
+
+
+class TooManyJobs(Exception):
+    """Raised when the pending job limit is reached."""
+
+
+class SuggestionJobs:
+    """
+    Run conflict-assistant requests in the background.
+
+    submit() returns a job immediately; results are cached by the hashes of
+    the source and target content so repeated conflicts skip the model.
+
+    At most max_workers jobs hold a worker slot. A job that times out gives
+    its slot back straight away and its thread is left to finish on its own;
+    those abandoned threads count towards max_pending, so hung backend calls
+    cannot pile up without bound.
+    """
+
+    def __init__(self, max_workers=DEFAULT_MAX_WORKERS, max_pending=DEFAULT_MAX_PENDING,
+                 timeout=DEFAULT_TIMEOUT, cache_size=DEFAULT_CACHE_SIZE, cache_ttl=DEFAULT_CACHE_TTL):
+        self.max_pending = max_pending
+        self.timeout = timeout
+        self.cache_size = cache_size
+        self.cache_ttl = cache_ttl
+        self.max_workers = max(1, max_workers)
+        self.lock = threading.Lock()
+        self.queue = deque()
+        self.running = 0
+        self.abandoned = 0
+        self.jobs = {}
+        self.in_flight = {}
+        self.cache = OrderedDict()
+
+    @staticmethod
+    def content_key(*parts):
+        """Key a request by the content hashes of its parts."""
+        return tuple(hashlib.sha256(str(part).encode()).hexdigest() for part in parts)
+
+    def submit(self, key, suggest, *args):
+        """
+        Queue suggest(*args) as a job, reusing a cached result or an identical running job.
+
+        key must identify the content involved, normally by hash.
+        """
+        now = time.time()
+        with self.lock:
+            self.prune(now)
+            cached = self.cache.get(key)
+            if cached and cached[0] > now:
+                CACHE_REQUESTS.inc(cache='suggestion', result='hit')
+                self.cache.move_to_end(key)
+                job = self.new_job(key, now)
+                job.update(status='done', result=cached[1], cached=True, finished=now)
+                job['event'].set()
+                return self.view(job)
+
+            job_id = self.in_flight.get(key)
+            if job_id in self.jobs:
+                CACHE_REQUESTS.inc(cache='suggestion', result='joined')
+                return self.view(self.jobs[job_id])
+            CACHE_REQUESTS.inc(cache='suggestion', result='miss')
+
+            pending = self.abandoned + sum(1 for job in self.jobs.values()
+                                           if job['status'] in ('queued', 'running'))
+            if pending >= self.max_pending:
+                raise TooManyJobs(f"Too many pending suggestion jobs ({pending}).")
+            job = self.new_job(key, now)
+            job['call'] = (suggest, args)
+            self.in_flight[key] = job['id']
+            self.queue.append(job)
+            self.dispatch()
+        return self.view(job)
+
+    def new_job(self, key, now):
+        """Create and register a queued job."""
+        job = {'id': uuid.uuid4().hex, 'key': key, 'status': 'queued', 'created': now,
+               'started': None, 'finished': None, 'result': None, 'error': None,
+               'cached': False, 'slot': False, 'event': threading.Event()}
+        self.jobs[job['id']] = job
+        return job
+
+    def dispatch(self):
+        """Start queued jobs while worker slots are free. Called with the lock held."""
+        while self.queue and self.running < self.max_workers:
+            job = self.queue.popleft()
+            if job['status'] != 'queued':
+                continue
+            suggest, args = job.pop('call')
+            job.update(status='running', started=time.time(), slot=True)
+            self.running += 1
+            threading.Thread(target=self.run, args=(job, suggest, args),
+                             name='suggest', daemon=True).start()
+
+    def free_slot(self, job):
+        """Give a running job's worker slot to the next queued job. Called with the lock held."""
+        if job['slot']:
+            job['slot'] = False
+            self.running -= 1
+            self.dispatch()
+
+    def run(self, job, suggest, args):
+        """Worker body: call the assistant and publish the result."""
+        try:
+            result = suggest(*args)
+            error = None
+        except Exception as e:
+            result = None
+            error = str(e)
+
+        now = time.time()
+        with self.lock:
+            self.release(job)
+            if job['slot']:
+                self.free_slot(job)
+            else:
+                self.abandoned -= 1
+            if error is None:
+                self.cache[job['key']] = (now + self.cache_ttl, result)
+                self.cache.move_to_end(job['key'])
+                while len(self.cache) > self.cache_size:
+                    self.cache.popitem(last=False)
+            # A job that already timed out keeps its status, but the result is still cached
+            if job['status'] == 'running':
+                job.update(status='done' if error is None else 'error', result=result,
+                           error=error, finished=now)
+        job['event'].set()
+
+    def get(self, job_id, wait=0):
+        """Return a job, waiting up to `wait` seconds for it to finish."""
+        with self.lock:
+            job = self.jobs.get(job_id)
+        if job is None:
+            return None
+        job['event'].wait(min(max(wait, 0), MAX_WAIT))
+        with self.lock:
+            # Every poll also frees the slots of other hung jobs
+            for other in list(self.jobs.values()):
+                self.check_timeout(other, time.time())
+            return self.view(job)
+
+    def check_timeout(self, job, now):
+        """Mark a queued or running job as timed out once it exceeds the timeout."""
+        started = job['started'] if job['status'] == 'running' else job['created']
+        if job['status'] in ('queued', 'running') and now - started > self.timeout:
+            job.update(status='timeout', error=f"Suggestion timed out after {self.timeout} seconds.",
+                       finished=now)
+            job.pop('call', None)
+            self.release(job)
+            if job['slot']:
+                # The backend call keeps its thread until it returns, but not its slot
+                self.abandoned += 1
+                self.free_slot(job)
+            job['event'].set()
+
+    def release(self, job):
+        """Stop routing identical requests to a job that has finished or timed out."""
+        if self.in_flight.get(job['key']) == job['id']:
+            del self.in_flight[job['key']]
+
+    def prune(self, now):
+        """Drop expired cache entries and old finished jobs."""
+        for job in list(self.jobs.values()):
+            self.check_timeout(job, now)
+            if job['finished'] and now - job['finished'] > JOB_RETENTION:
+                del self.jobs[job['id']]
+        for key in [key for key, (expires, _) in self.cache.items() if expires <= now]:
+            del self.cache[key]
+
+    def view(self, job):
+        """Return the client-facing fields of a job."""
+        data = {'job_id': job['id'], 'status': job['status'], 'cached': job['cached']}
+        if isinstance(job['result'], dict):
+            data.update(job['result'])
+        elif job['result'] is not None:
+            data['message'] = job['result']
+        if job['error'] is not None:
+            data['error'] = job['error']
+        return data
@@ -0,0 +1,26 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+
+@pytest.fixture
+def vcs(tmp_path):
+    """A fresh repository under tmp_path with the main branch checked out."""
+    from vcs import VCS
+    return VCS(repo_path=str(tmp_path / 'repo'))
+
+
+@pytest.fixture
+def server(vcs, tmp_path_factory, monkeypatch):
+    """The server module, serving the vcs fixture's repository."""
+    if 'server' not in sys.modules:
+        # Importing the server opens ./repo, which must not be the checkout's
+        monkeypatch.chdir(tmp_path_factory.mktemp('server'))
+    import server
+    from group_commit import GroupCommitter
+    monkeypatch.setattr(server, 'vcs', vcs)
+    monkeypatch.setattr(server, 'group_commits', GroupCommitter(vcs))
+    return server
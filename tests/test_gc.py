@@ -0,0 +1,161 @@
+import io
+import os
+import time
+
+import pytest
+
+HOUR = 60 * 60
+
+
+def age(path, seconds):
+    """Move a file's mtime seconds into the past."""
+    then = time.time() - seconds
+    os.utime(path, (then, then))
+
+
+def object_path(vcs, name):
+    return os.path.join(vcs.versions_path, name)
+
+
+@pytest.fixture
+def repo(vcs):
+    vcs.add_file('kept.txt', 'kept\n')
+    vcs.add_file('dir/nested.txt', 'nested\n')
+    vcs.commit('initial')
+    return vcs
+
+
+def commit_on_branch(vcs, branch, content):
+    """Commit content as orphan.txt on a new branch and return its object."""
+    vcs.create_branch(branch)
+    vcs.switch_branch(branch)
+    vcs.add_file('orphan.txt', content)
+    vcs.commit('orphan')
+    vcs.switch_branch('main')
+    return vcs.tip_snapshot(branch)['orphan.txt']
+
+
+def delete_branch(vcs, branch):
+    del vcs.branches[branch]
+    vcs.save_branches()
+
+
+def packed_orphan(vcs):
+    """Repack with an object only a branch holds, then delete the branch; returns (object, pack file)."""
+    orphan = commit_on_branch(vcs, 'hold', 'orphan\n')
+    vcs.gc(grace_period=HOUR, repack=True)
+    (pack_file,) = {pack for pack, _, _ in vcs.packs.values()}
+    assert orphan in vcs.packs
+    delete_branch(vcs, 'hold')
+    return orphan, pack_file
+
+
+def assert_main_intact(vcs):
+    snapshot = vcs.tip_snapshot('main')
+    assert vcs.read_text(snapshot['kept.txt']) == 'kept\n'
+    assert vcs.read_text(snapshot['dir/nested.txt']) == 'nested\n'
+
+
+def test_gc_sweeps_only_unreachable_objects_past_the_grace_period(repo):
+    old = commit_on_branch(repo, 'old', 'old orphan\n')
+    young = commit_on_branch(repo, 'young', 'young orphan\n')
+    delete_branch(repo, 'old')
+    delete_branch(repo, 'young')
+    for name in repo.list_objects():
+        age(object_path(repo, name), 60 if name == young else 2 * HOUR)
+
+    report = repo.gc(grace_period=HOUR)
+    assert not repo.has_object(old)
+    assert repo.has_object(young)
+    assert report['swept'] > 0
+    assert_main_intact(repo)
+
+
+def test_uncommitted_upload_survives_gc(repo):
+    # Objects are uploaded before the push that references them commits
+    upload = repo.store_stream(io.BytesIO(b'uploaded for a pending push'))
+    repo.gc()
+    assert repo.has_object(upload)
+
+
+def test_repack_moves_reachable_objects_into_one_pack(repo):
+    names = repo.list_objects()
+    report = repo.gc(grace_period=HOUR, repack=True)
+    assert report['packed'] == report['reachable'] == len(names)
+    assert len(os.listdir(repo.packs_path)) == 2
+    for name in names:
+        assert not os.path.exists(object_path(repo, name))
+        assert repo.has_object(name)
+    assert_main_intact(repo)
+
+
+def test_dropped_young_pack_gives_its_other_objects_the_grace_period(repo):
+    orphan, pack_file = packed_orphan(repo)
+    age(pack_file, 600)
+    packed_at = os.path.getmtime(pack_file)
+    repo.gc(grace_period=HOUR, repack=True)
+
+    # The old pack is gone, but the object it alone held is loose again with the pack's age
+    assert not os.path.exists(pack_file)
+    assert orphan not in repo.packs
+    assert os.path.getmtime(object_path(repo, orphan)) == pytest.approx(packed_at, abs=0.01)
+    assert repo.read_text(orphan) == 'orphan\n'
+    assert_main_intact(repo)
+
+    # From there it ages like any loose object
+    repo.gc(grace_period=300)
+    assert not repo.has_object(orphan)
+
+
+def test_dropped_old_pack_loses_its_unreachable_objects(repo):
+    orphan, pack_file = packed_orphan(repo)
+    age(pack_file, 2 * HOUR)
+    repo.gc(grace_period=HOUR, repack=True)
+
+    assert not os.path.exists(pack_file)
+    assert not repo.has_object(orphan)
+    assert_main_intact(repo)
+
+
+def test_repack_with_nothing_new_keeps_the_pack(repo):
+    repo.gc(grace_period=HOUR, repack=True)
+    packs = sorted(os.listdir(repo.packs_path))
+    report = repo.gc(grace_period=HOUR, repack=True)
+    assert report['packed'] == 0
+    assert sorted(os.listdir(repo.packs_path)) == packs
+    assert_main_intact(repo)
+
+
+@pytest.fixture
+def admin(server, monkeypatch):
+    monkeypatch.setattr(server, 'ADMIN_TOKEN', 'secret')
+    return {'X-Admin-Token': 'secret'}
+
+
+@pytest.mark.parametrize('route', ['/gc', '/fsck'])
+@pytest.mark.parametrize('headers', [{}, {'X-Admin-Token': 'wrong'}])
+def test_maintenance_endpoints_require_the_admin_token(server, admin, route, headers):
+    assert server.app.test_client().post(route, json={}, headers=headers).status_code == 403
+
+
+def test_maintenance_endpoints_are_closed_without_a_configured_token(server, monkeypatch):
+    monkeypatch.setattr(server, 'ADMIN_TOKEN', None)
+    client = server.app.test_client()
+    assert client.post('/gc', json={}, headers={'X-Admin-Token': ''}).status_code == 403
+    assert client.post('/fsck', json={}).status_code == 403
+
+
+@pytest.mark.parametrize('grace_period', [0, -1, 1, 'NaN', 'soon', None])
+def test_gc_refuses_short_grace_periods(server, admin, grace_period):
+    upload = server.vcs.store_stream(io.BytesIO(b'uploaded for a pending push'))
+    age(object_path(server.vcs, upload), 2 * HOUR)
+    response = server.app.test_client().post('/gc', json={'grace_period': grace_period}, headers=admin)
+    assert response.status_code == 400
+    assert server.vcs.has_object(upload)
+
+
+def test_gc_and_fsck_run_for_the_admin(server, admin):
+    client = server.app.test_client()
+    response = client.post('/gc', json={'grace_period': server.MIN_GC_GRACE_PERIOD}, headers=admin)
+    assert response.status_code == 200
+    assert client.post('/fsck', json={'workers': 1}, headers=admin).status_code == 200
@@ -0,0 +1,149 @@
+import os
+import threading
+
+import pytest
+
+from group_commit import GroupCommitter
+from vcs import VCS
+
+
+def submit_all(committer, pushes):
+    """Submit (branch, message, apply) pushes from one thread each; returns their commits or errors."""
+    results = [None] * len(pushes)
+
+    def push(i, branch, message, apply):
+        try:
+            results[i] = committer.submit(branch, message, apply)
+        except Exception as e:
+            results[i] = e
+
+    threads = [threading.Thread(target=push, args=(i,) + tuple(p)) for i, p in enumerate(pushes)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(10)
+    return results
+
+
+@pytest.fixture
+def repo(vcs):
+    vcs.add_file('base.txt', 'base\n')
+    vcs.commit('initial')
+    for name in ('one', 'two'):
+        vcs.create_branch(name)
+    return vcs
+
+
+def counting(monkeypatch, obj, name, calls):
+    """Record calls to obj.name in calls before running it."""
+    original = getattr(obj, name)
+
+    def wrapper(*args, **kwargs):
+        calls.append(name)
+        return original(*args, **kwargs)
+    monkeypatch.setattr(obj, name, wrapper)
+
+
+def test_concurrent_pushes_share_one_metadata_write(repo, monkeypatch):
+    calls = []
+    counting(monkeypatch, repo, 'save_branches', calls)
+    committer = GroupCommitter(repo, window=5, max_batch=3)
+    results = submit_all(committer, [
+        (branch, f'push to {branch}', lambda branch=branch: repo.add_file(f'{branch}.txt', branch))
+        for branch in ('main', 'one', 'two')])
+
+    assert [type(result).__name__ for result in results] == ['Commit'] * 3
+    assert calls == ['save_branches']
+    for branch in ('main', 'one', 'two'):
+        assert repo.branches.count(branch) == 2
+        assert repo.tip_snapshot(branch).keys() == {'base.txt', f'{branch}.txt'}
+
+
+def test_pushes_to_one_branch_commit_in_order(repo):
+    committer = GroupCommitter(repo, window=0)
+    for i in range(3):
+        committer.submit('main', f'edit {i}', lambda i=i: repo.add_file('base.txt', f'edit {i}\n'))
+    assert [commit['message'] for commit in repo.branches['main']][-3:] == ['edit 0', 'edit 1', 'edit 2']
+    assert repo.read_text(repo.tip_snapshot('main')['base.txt']) == 'edit 2\n'
+
+
+def test_failed_push_only_fails_itself_and_leaves_no_trace(repo):
+    def broken():
+        repo.add_file('partial.txt', 'half written\n')
+        repo.add_file('base.txt', 'changed\n')
+        raise RuntimeError('upload went away')
+
+    committer = GroupCommitter(repo, window=5, max_batch=2)
+    results = submit_all(committer, [
+        ('one', 'broken push', broken),
+        ('two', 'good push', lambda: repo.add_file('good.txt', 'good\n'))])
+
+    assert isinstance(results[0], RuntimeError)
+    assert type(results[1]).__name__ == 'Commit'
+    assert repo.branches.count('one') == 1
+    assert repo.tip_snapshot('two').keys() == {'base.txt', 'good.txt'}
+
+    # The worktree is back at the tip, so the next push does not pick up the failed one
+    worktree = repo.worktree_path('one')
+    assert not os.path.exists(os.path.join(worktree, 'partial.txt'))
+    with open(os.path.join(worktree, 'base.txt')) as f:
+        assert f.read() == 'base\n'
+    GroupCommitter(repo, window=0).submit('one', 'next push', lambda: repo.add_file('next.txt', 'next\n'))
+    assert repo.tip_snapshot('one').keys() == {'base.txt', 'next.txt'}
+
+
+def test_push_to_missing_branch_raises(repo):
+    with pytest.raises(ValueError):
+        GroupCommitter(repo, window=0).submit('missing', 'push', None)
+
+
+def test_failed_save_fails_the_batch_and_publishes_nothing(repo, monkeypatch):
+    calls = []
+    counting(monkeypatch, repo, 'publish_ref', calls)
+
+    def failing_save(sync=False):
+        raise OSError('disk full')
+    monkeypatch.setattr(repo, 'save_branches', failing_save)
+
+    with pytest.raises(OSError):
+        GroupCommitter(repo, window=0).submit('main', 'push', lambda: repo.add_file('x.txt', 'x'))
+    assert calls == []
+
+
+@pytest.mark.parametrize('failing', ['write_history', 'write_refs'])
+def test_failed_save_leaves_no_commit_behind(repo, monkeypatch, failing):
+    def disk_full(*args, **kwargs):
+        raise OSError('disk full')
+    # write_refs fails after the history file was already replaced
+    monkeypatch.setattr(repo.branches, failing, disk_full)
+    committer = GroupCommitter(repo, window=0)
+    with pytest.raises(OSError):
+        committer.submit('main', 'push x', lambda: repo.add_file('x.txt', 'x'))
+    assert repo.branches.count('main') == 1
+    assert not os.path.exists(os.path.join(repo.worktree_path('main'), 'x.txt'))
+
+    monkeypatch.undo()
+    committer.submit('main', 'push y', lambda: repo.add_file('y.txt', 'y'))
+    reopened = VCS(repo_path=repo.repo_path)
+    assert [commit['message'] for commit in reopened.branches['main']] == ['initial', 'push y']
+    assert reopened.tip_snapshot('main').keys() == {'base.txt', 'y.txt'}
+
+
+def test_commits_are_published_after_they_are_saved(repo, monkeypatch):
+    calls = []
+    counting(monkeypatch, repo, 'save_branches', calls)
+    counting(monkeypatch, repo, 'publish_ref', calls)
+    committer = GroupCommitter(repo, window=5, max_batch=2)
+    submit_all(committer, [(branch, 'push', lambda branch=branch: repo.add_file('x.txt', branch))
+                           for branch in ('one', 'two')])
+    assert calls == ['save_branches', 'publish_ref', 'publish_ref']
+
+
+def test_push_of_file_and_directory_on_one_path_is_rejected(server):
+    client = server.app.test_client()
+    response = client.post('/push', json={'branch': 'main', 'files': {'a': 'file', 'a/b': 'nested'}})
+    assert response.status_code == 400
+
+    response = client.post('/push', json={'branch': 'main', 'files': {'c.txt': 'c'}})
+    assert response.status_code == 200
+    assert server.vcs.tip_snapshot('main').keys() == {'c.txt'}
@@ -0,0 +1,98 @@
+import os
+import sys
+
+import pytest
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'Client'))
+
+from checkout import Checkout
+from object_cache import ObjectCache
+from status import StatusEngine
+
+
+class ClientResponse:
+    def __init__(self, response):
+        self.status_code = response.status_code
+        self.headers = response.headers
+        self.content = response.get_data()
+        self.json = response.get_json
+
+
+class ClientApi:
+    """Enough of the client's Api for the object cache, on the server's test client."""
+
+    def __init__(self, client):
+        self.client = client
+
+    def get(self, path, params=None, headers=None):
+        return ClientResponse(self.client.get(path, query_string=params, headers=headers))
+
+
+@pytest.fixture
+def client(server):
+    server.vcs.add_file('shared.txt', 'v1\n')
+    server.vcs.commit('initial')
+    return server.app.test_client()
+
+
+@pytest.fixture
+def checkout(server, tmp_path):
+    root = str(tmp_path / 'files')
+    status = StatusEngine(root, cache_path=str(tmp_path / 'status.json'))
+    return Checkout(ObjectCache(str(tmp_path / 'cache')), status, root,
+                    journal_path=str(tmp_path / 'journal.json'), base_path=str(tmp_path / 'base.json'))
+
+
+def push(client, base, **changes):
+    return client.post('/push', json=dict({'branch': 'main', 'base': base}, **changes))
+
+
+def test_push_on_the_current_tip_returns_the_new_tree(server, client):
+    tip = server.vcs.tip_tree('main')
+    response = push(client, tip, files={'new.txt': 'new\n'})
+    assert response.status_code == 200
+    assert response.get_json()['tree'] == server.vcs.tip_tree('main') != tip
+
+
+def test_push_on_a_moved_branch_is_refused(server, client):
+    stale = server.vcs.tip_tree('main')
+    assert push(client, stale, files={'theirs.txt': 'theirs\n'}).status_code == 200
+    tip = server.vcs.tip_tree('main')
+
+    response = push(client, stale, files={'shared.txt': 'mine\n'}, deleted=['theirs.txt'])
+    assert response.status_code == 409
+    assert server.vcs.tip_tree('main') == tip
+    assert server.vcs.branches.count('main') == 2
+    # The refused push left nothing behind for the next one
+    assert push(client, tip, files={'next.txt': 'next\n'}).status_code == 200
+    assert server.vcs.tip_snapshot('main').keys() == {'shared.txt', 'theirs.txt', 'next.txt'}
+
+
+def test_empty_base_only_fits_an_empty_branch(server, client):
+    assert push(client, 'empty', files={'x.txt': 'x'}).status_code == 409
+    assert client.post('/create_branch', json={'branch_name': 'fresh'}).status_code == 200
+    server.vcs.branches['fresh'] = []
+    assert client.post('/push', json={'branch': 'fresh', 'base': 'empty',
+                                      'files': {'x.txt': 'x'}}).status_code == 200
+    assert push(client, 'not a tree').status_code == 400
+
+
+def test_status_is_taken_against_the_pulled_base(server, client, checkout):
+    api = ClientApi(client)
+    tree, manifest = checkout.cache.fetch_tip(api, 'main')
+    checkout.pull(api, manifest, base=('main', '', tree))
+    assert checkout.base() == (tree, manifest)
+
+    # Another client adds a file; this checkout has not pulled it
+    assert push(client, tree, files={'theirs.txt': 'theirs\n'}).status_code == 200
+    with open(os.path.join(checkout.root, 'shared.txt'), 'w') as f:
+        f.write('mine\n')
+    status = checkout.status.status(checkout.base()[1])
+    assert status['deleted'] == [] and status['added'] == [] and status['modified'] == ['shared.txt']
+    # A push of that change on the old base is refused instead of reverting the other push
+    assert push(client, tree, files={'shared.txt': 'mine\n'}).status_code == 409
+
+    tree, manifest = checkout.cache.fetch_tip(api, 'main')
+    checkout.pull(api, manifest, base=('main', '', tree))
+    assert checkout.base() == (tree, manifest)
+    assert checkout.base('other/**') is None
@@ -0,0 +1,161 @@
+import io
+import os
+import threading
+from urllib.parse import urlsplit
+
+import pytest
+import requests
+
+from replica import Replica
+from vcs import VCS
+
+PRIMARY_URL = 'http://primary'
+
+
+class ClientResponse:
+    """Enough of requests.Response for the replica, around a Flask test response."""
+
+    def __init__(self, response):
+        self.status_code = response.status_code
+        self.content = response.get_data()
+        self.raw = io.BytesIO(self.content)
+        self.response = response
+
+    def json(self):
+        return self.response.get_json()
+
+    def raise_for_status(self):
+        if self.status_code >= 400:
+            raise requests.HTTPError(f"{self.status_code} error")
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+class ClientSession:
+    """A requests.Session stand-in that sends GETs to the server's test client."""
+
+    def __init__(self, client):
+        self.client = client
+        self.paths = []
+
+    def get(self, url, params=None, timeout=None, stream=False):
+        path = urlsplit(url).path
+        self.paths.append((path, params))
+        return ClientResponse(self.client.get(path, query_string=params))
+
+
+@pytest.fixture
+def primary(server):
+    vcs = server.vcs
+    vcs.add_file('README', 'hello\n')
+    vcs.add_file('src/app.py', 'app\n')
+    vcs.commit('initial')
+    vcs.create_branch('feature')
+    vcs.switch_branch('feature')
+    vcs.add_file('src/feature.py', 'feature\n')
+    vcs.commit('feature work')
+    vcs.switch_branch('main')
+    return vcs
+
+
+@pytest.fixture
+def replica(server, tmp_path):
+    replica = Replica(VCS(repo_path=str(tmp_path / 'mirror')), PRIMARY_URL)
+    replica.session = ClientSession(server.app.test_client())
+    return replica
+
+
+def history(vcs, branch):
+    return [commit.to_dict() for commit in vcs.branches[branch]]
+
+
+def assert_mirrors(primary, mirror):
+    assert set(mirror.branches) == set(primary.branches)
+    for branch in primary.branches:
+        assert history(mirror, branch) == history(primary, branch)
+        snapshot = mirror.tip_snapshot(branch)
+        assert snapshot == primary.tip_snapshot(branch)
+        for file_hash in snapshot.values():
+            assert mirror.read_text(file_hash) == primary.read_text(file_hash)
+
+
+def test_first_sync_copies_every_branch(primary, replica):
+    assert replica.sync() == 3
+    assert_mirrors(primary, replica.vcs)
+    assert replica.status()['last_error'] is None
+    assert replica.lag_seconds() is not None
+
+
+def test_catch_up_fetches_only_new_commits(primary, replica):
+    replica.sync()
+    primary.add_file('src/app.py', 'app v2\n')
+    primary.commit('main edit')
+    replica.session.paths.clear()
+
+    assert replica.sync() == 1
+    assert_mirrors(primary, replica.vcs)
+    assert ('/history/main', {'since': 1}) in replica.session.paths
+    assert not any(path.startswith('/history/feature') for path, _ in replica.session.paths)
+    # Only the commit's diff log, the changed file and the two trees above it are downloaded
+    fetched = {path for path, _ in replica.session.paths if path.startswith('/objects/')}
+    assert len(fetched) == 4
+
+    replica.session.paths.clear()
+    assert replica.sync() == 0
+    assert [path for path, _ in replica.session.paths] == ['/refs']
+
+
+@pytest.mark.parametrize('extra_commits', [0, 1])
+def test_rewritten_branch_is_fetched_again(primary, replica, extra_commits):
+    replica.sync()
+    # Rebuild feature from main with different work, keeping or growing its length
+    primary.branches['feature'] = primary.branches['main'].copy()
+    primary.switch_branch('feature')
+    primary.reset_worktree('feature')
+    for i in range(1 + extra_commits):
+        primary.add_file('other.txt', f'rewrite {i}\n')
+        primary.commit(f'rewrite {i}')
+    primary.switch_branch('main')
+
+    replica.session.paths.clear()
+    assert replica.sync() == 2 + extra_commits
+    assert ('/history/feature', {'since': 0}) in replica.session.paths
+    assert_mirrors(primary, replica.vcs)
+
+
+def test_deleted_branch_and_its_worktree_are_removed(primary, replica):
+    replica.sync()
+    replica.vcs.ensure_worktree('feature')
+    worktree = replica.vcs.worktree_path('feature')
+    assert os.path.isdir(worktree)
+
+    del primary.branches['feature']
+    primary.save_branches()
+    replica.sync()
+    assert 'feature' not in replica.vcs.branches
+    assert not os.path.exists(worktree)
+
+
+def test_polling_survives_any_error(replica, monkeypatch):
+    calls = []
+    recovered = threading.Event()
+    finished = threading.Event()
+
+    def sync():
+        calls.append(None)
+        if len(calls) == 1:
+            raise ValueError('bad data from primary')
+        recovered.set()
+        # Park the daemon thread so it does not poll on after the test
+        finished.wait()
+        return 0
+    monkeypatch.setattr(replica, 'sync', sync)
+    replica.interval = 0.01
+    replica.start()
+    assert recovered.wait(5)
+    assert len(calls) == 2
+    assert replica.status()['last_error'] == 'ValueError: bad data from primary'
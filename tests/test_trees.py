@@ -0,0 +1,149 @@
+import hashlib
+
+import pytest
+
+from trees import build_tree, decode_tree, diff_trees, file_count, flatten, lookup, merge_trees
+
+
+class MemoryStore:
+    """In-memory tree store that counts reads."""
+
+    def __init__(self):
+        self.objects = {}
+        self.reads = 0
+
+    def write_tree(self, data):
+        name = hashlib.sha256(data).hexdigest()
+        self.objects[name] = data
+        return name
+
+    def read_tree(self, name):
+        self.reads += 1
+        return decode_tree(self.objects[name])
+
+
+@pytest.fixture
+def store():
+    return MemoryStore()
+
+
+def blob(text):
+    return hashlib.sha256(text.encode()).hexdigest()
+
+
+def build(store, files):
+    return build_tree({path: blob(text) for path, text in files.items()}, store.write_tree)
+
+
+def test_build_and_flatten_round_trip(store):
+    snapshot = {'a.txt': blob('a'), 'src/main.py': blob('main'), 'src/lib/util.py': blob('util')}
+    root = build_tree(snapshot, store.write_tree)
+    assert flatten(root, store.read_tree) == snapshot
+    assert file_count(root, store.read_tree) == 3
+    assert lookup(root, 'src/lib/util.py', store.read_tree) == blob('util')
+    assert lookup(root, 'src/lib', store.read_tree) is None
+    assert lookup(root, 'missing.txt', store.read_tree) is None
+
+
+def test_build_is_canonical_and_shares_equal_directories(store):
+    first = build(store, {'x/f': '1', 'y/f': '1', 'z': '2'})
+    second = build(store, {'z': '2', 'y/f': '1', 'x/f': '1'})
+    assert first == second
+    # Root, plus one tree shared by x/ and y/
+    assert len(store.objects) == 2
+
+
+def test_empty_snapshot_and_none_tree(store):
+    root = build_tree({}, store.write_tree)
+    assert flatten(root, store.read_tree) == {}
+    assert flatten(None, store.read_tree) == {}
+    assert file_count(None, store.read_tree) == 0
+
+
+@pytest.mark.parametrize('snapshot', [{'a': blob('1'), 'a/b': blob('2')}, {'a/b': blob('2'), 'a': blob('1')}])
+def test_build_rejects_file_and_directory_on_one_path(store, snapshot):
+    with pytest.raises(ValueError):
+        build_tree(snapshot, store.write_tree)
+
+
+def test_diff_reports_changes_additions_and_deletions(store):
+    old = build(store, {'keep.txt': 'k', 'edit.txt': 'old', 'gone.txt': 'g', 'dir/a': 'a'})
+    new = build(store, {'keep.txt': 'k', 'edit.txt': 'new', 'dir/a': 'a', 'dir/b': 'b'})
+    assert list(diff_trees(old, new, store.read_tree)) == [
+        ('dir/b', None, blob('b')),
+        ('edit.txt', blob('old'), blob('new')),
+        ('gone.txt', blob('g'), None),
+    ]
+    assert list(diff_trees(new, new, store.read_tree)) == []
+    assert list(diff_trees(None, new, store.read_tree)) == sorted(
+        (path, None, file_hash) for path, file_hash in flatten(new, store.read_tree).items())
+
+
+def test_diff_skips_equal_subtrees(store):
+    files = {f'big/{i}': str(i) for i in range(50)}
+    old = build(store, dict(files, top='1'))
+    new = build(store, dict(files, top='2'))
+    store.reads = 0
+    assert list(diff_trees(old, new, store.read_tree)) == [('top', blob('1'), blob('2'))]
+    # Only the two roots are read, not the unchanged big/ tree
+    assert store.reads == 2
+
+
+def test_diff_file_replaced_by_directory(store):
+    old = build(store, {'a': 'file'})
+    new = build(store, {'a/b': 'nested'})
+    assert sorted(diff_trees(old, new, store.read_tree)) == [
+        ('a', blob('file'), None),
+        ('a/b', None, blob('nested')),
+    ]
+
+
+def test_merge_combines_disjoint_changes(store):
+    source = build(store, {'shared': 's', 'src/new.py': 'n', 'docs/a': 'a'})
+    target = build(store, {'shared': 's', 'docs/a': 'a', 'docs/b': 'b'})
+    merged, conflicts = merge_trees(source, target, store.read_tree, store.write_tree)
+    assert conflicts == []
+    assert flatten(merged, store.read_tree) == {
+        'shared': blob('s'), 'src/new.py': blob('n'), 'docs/a': blob('a'), 'docs/b': blob('b')}
+    assert file_count(merged, store.read_tree) == 4
+
+
+def test_merge_conflicts_keep_target_version(store):
+    source = build(store, {'dir/file': 'source', 'other': 'x', 'clash': 'file'})
+    target = build(store, {'dir/file': 'target', 'other': 'x', 'clash/inner': 'dir'})
+    merged, conflicts = merge_trees(source, target, store.read_tree, store.write_tree)
+    assert sorted(conflicts) == ['clash', 'dir/file']
+    assert flatten(merged, store.read_tree) == {
+        'dir/file': blob('target'), 'other': blob('x'), 'clash/inner': blob('dir')}
+
+
+def test_merge_with_missing_or_equal_side(store):
+    tree = build(store, {'a': '1'})
+    assert merge_trees(None, tree, store.read_tree, store.write_tree) == (tree, [])
+    assert merge_trees(tree, None, store.read_tree, store.write_tree) == (tree, [])
+    assert merge_trees(tree, tree, store.read_tree, store.write_tree) == (tree, [])
+
+
+def test_vcs_commit_builds_nested_trees_and_merges_branches(vcs):
+    vcs.add_file('README', 'hello\n')
+    vcs.add_file('src/app.py', 'print(1)\n')
+    first = vcs.commit('initial')
+    assert vcs.snapshot(first).keys() == {'README', 'src/app.py'}
+
+    vcs.create_branch('feature')
+    vcs.switch_branch('feature')
+    vcs.add_file('src/feature.py', 'feature\n')
+    vcs.add_file('README', 'feature readme\n')
+    vcs.commit('feature work')
+
+    vcs.switch_branch('main')
+    vcs.add_file('README', 'main readme\n')
+    vcs.commit('main work')
+
+    vcs.merge('feature', 'main')
+    merged = vcs.tip_snapshot('main')
+    assert merged.keys() == {'README', 'src/app.py', 'src/feature.py'}
+    assert vcs.read_text(merged['README']) == 'main readme\n'
+    # The merge is checked out in main's worktree
+    with open(f'{vcs.worktree_path("main")}/src/feature.py') as f:
+        assert f.read() == 'feature\n'
@@ -0,0 +1,204 @@
+"""
+Hierarchical tree objects for snapshots.
+
+A tree object lists one directory: sorted [name, kind, hash] entries, where
+kind is 'blob' for a file and 'tree' for a subdirectory, plus the number of
+files below it. Trees are stored like any other object under the SHA-256 of
+their canonical encoding, so identical directories share one object and two
+snapshots can be compared by skipping every subtree whose hash is equal.
+
+The functions here only need read_tree(hash) and write_tree(data) callables,
+so they work against any object store.
+"""
+import json
+import hashlib
+
+BLOB = 'blob'
+TREE = 'tree'
+
+
+def encode_tree(entries, files):
+    """Serialise sorted entries and a file count in the canonical on-disk form."""
+    return json.dumps({'entries': entries, 'files': files}, separators=(',', ':')).encode()
+
+
+def decode_tree(data):
+    """Parse a stored tree; raises ValueError if the object is not a tree."""
+    tree = json.loads(data)
+    if not isinstance(tree, dict) or not isinstance(tree.get('entries'), list):
+        raise ValueError("Object is not a tree.")
+    return tree
+
+
+def tree_hash(data):
+    return hashlib.sha256(data).hexdigest()
+
+
+def split_path(path):
+    return path.split('/')
+
+
+def build_tree(snapshot, write_tree):
+    """
+    Write the trees for a flat {path: hash} snapshot bottom-up and return the root hash.
+
+    Paths use '/' as separator. write_tree(data) stores one encoded tree and
+    returns its hash.
+    """
+    root = {}
+    for path, file_hash in snapshot.items():
+        node = root
+        parts = split_path(path)
+        for part in parts[:-1]:
+            node = node.setdefault(part, {})
+            if not isinstance(node, dict):
+                raise ValueError(f"'{path}' is below a file.")
+        if isinstance(node.get(parts[-1]), dict):
+            raise ValueError(f"'{path}' is also a directory.")
+        node[parts[-1]] = file_hash
+
+    def write(node):
+        entries = []
+        files = 0
+        for name in sorted(node):
+            child = node[name]
+            if isinstance(child, dict):
+                child_hash, child_files = write(child)
+                entries.append([name, TREE, child_hash])
+                files += child_files
+            else:
+                entries.append([name, BLOB, child])
+                files += 1
+        return write_tree(encode_tree(entries, files)), files
+
+    return write(root)[0]
+
+
+def flatten(root, read_tree, prefix='', include=None):
+    """
+    Return the flat {path: hash} snapshot of a tree; None is the empty tree.
+
+    With include (a sparse.PathFilter) only matching paths are returned and
+    subtrees that cannot contain any are not read.
+    """
+    snapshot = {}
+    if root is None:
+        return snapshot
+    stack = [(root, prefix)]
+    while stack:
+        current, current_prefix = stack.pop()
+        for name, kind, child in read_tree(current)['entries']:
+            if kind == TREE:
+                if include is None or include.may_contain(current_prefix + name + '/'):
+                    stack.append((child, current_prefix + name + '/'))
+            elif include is None or include.matches(current_prefix + name):
+                snapshot[current_prefix + name] = child
+    return snapshot
+
+
+def file_count(root, read_tree):
+    return read_tree(root)['files'] if root else 0
+
+
+def lookup(root, path, read_tree):
+    """Return the blob hash at path, or None if the tree has no such file."""
+    current = root
+    parts = split_path(path)
+    for i, part in enumerate(parts):
+        if current is None:
+            return None
+        found = None
+        for name, kind, child in read_tree(current)['entries']:
+            if name == part:
+                found = (kind, child)
+                break
+        if found is None:
+            return None
+        kind, child = found
+        if i == len(parts) - 1:
+            return child if kind == BLOB else None
+        if kind != TREE:
+            return None
+        current = child
+    return None
+
+
+def diff_trees(old, new, read_tree, prefix='', include=None):
+    """
+    Yield (path, old_hash, new_hash) for every file that differs between two trees.
+
+    A side that lacks the file has None. Subtrees with equal hashes are
+    skipped without being read, as are subtrees outside include.
+    """
+    if old == new:
+        return
+    old_entries = {name: (kind, child) for name, kind, child in read_tree(old)['entries']} if old else {}
+    new_entries = {name: (kind, child) for name, kind, child in read_tree(new)['entries']} if new else {}
+    for name in sorted(old_entries.keys() | new_entries.keys()):
+        old_kind, old_hash = old_entries.get(name, (None, None))
+        new_kind, new_hash = new_entries.get(name, (None, None))
+        if old_kind == new_kind and old_hash == new_hash:
+            continue
+        path = prefix + name
+        # A directory on either side is walked; a blob on the same path is its own change
+        old_tree = old_hash if old_kind == TREE else None
+        new_tree = new_hash if new_kind == TREE else None
+        if (old_tree or new_tree) and (include is None or include.may_contain(path + '/')):
+            yield from diff_trees(old_tree, new_tree, read_tree, path + '/', include)
+        old_blob = old_hash if old_kind == BLOB else None
+        new_blob = new_hash if new_kind == BLOB else None
+        if old_blob != new_blob and (include is None or include.matches(path)):
+            yield path, old_blob, new_blob
+
+
+def merge_trees(source, target, read_tree, write_tree, prefix=''):
+    """
+    Merge source into target, keeping target's version where both changed a file.
+
+    Returns (tree_hash, conflicting_paths). Equal subtrees and subtrees present
+    on one side only are reused as they are.
+    """
+    if source == target or source is None:
+        return target, []
+    if target is None:
+        return source, []
+
+    source_entries = {name: (kind, child) for name, kind, child in read_tree(source)['entries']}
+    target_entries = {name: (kind, child) for name, kind, child in read_tree(target)['entries']}
+    entries = []
+    files = 0
+    conflicts = []
+    for name in sorted(source_entries.keys() | target_entries.keys()):
+        source_entry = source_entries.get(name)
+        target_entry = target_entries.get(name)
+        if target_entry is None or source_entry == target_entry:
+            kind, child = source_entry or target_entry
+        elif source_entry is None:
+            kind, child = target_entry
+        elif source_entry[0] == TREE and target_entry[0] == TREE:
+            child, child_conflicts = merge_trees(source_entry[1], target_entry[1], read_tree, write_tree,
+                                                 prefix + name + '/')
+            kind = TREE
+            conflicts.extend(child_conflicts)
+        else:
+            kind, child = target_entry
+            conflicts.append(prefix + name)
+        entries.append([name, kind, child])
+        files += read_tree(child)['files'] if kind == TREE else 1
+    return write_tree(encode_tree(entries, files)), conflicts
+
+
+def walk_trees(root, read_tree, seen):
+    """Yield (tree_hash, tree) for every tree below root that is not in seen, adding them to it."""
+    if root is None or root in seen:
+        return
+    stack = [root]
+    seen.add(root)
+    while stack:
+        current = stack.pop()
+        tree = read_tree(current)
+        yield current, tree
+        for _, kind, child in tree['entries']:
+            if kind == TREE and child not in seen:
+                seen.add(child)
+                stack.append(child)
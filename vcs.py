@@ -1,91 +1,304 @@
 import os
+import io
+import time
 import hashlib
 import json
-from datetime import datetime
+import re
+import threading
+import uuid
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
 from dataclasses import dataclass
 import shutil
-import requests
-import difflib
+from bisect import bisect_left
 from typing import List, Dict, Tuple
-import google.generativeai as genai
-from dotenv import load_dotenv
+from diff_engine import DiffEngine, decode_lines, diff_bytes_pair, conflict_hunks, is_binary
+from chunking import CHUNK_THRESHOLD, iter_chunks, dump_manifest
+from ai_backends import SYSTEM_PROMPT, load_backend
+from collections import OrderedDict
+from metrics import (phase, OBJECT_READS, OBJECT_READ_BYTES, OBJECT_WRITES, OBJECT_WRITE_BYTES,
+                     CACHE_REQUESTS, WORK_SECONDS, WORKTREE_FILES)
+from profiling import profiled
+from commits import Commit, current_time
+from histories import BranchHistories
+from events import EVENTS, MAX_EVENT_PATHS
+from worktrees import TEMP_PREFIX, Materializer, write_file
+from trees import BLOB, TREE, build_tree, decode_tree, diff_trees, file_count, flatten, lookup, merge_trees, \
+    tree_hash, walk_trees
 
-load_dotenv()
-api_key = os.getenv("GEMINI_API")
-genai.configure(api_key=api_key)
+# Objects younger than this are never swept by gc, so blobs written by an
+# in-flight commit survive even though no branch references them yet.
+GC_GRACE_PERIOD = 24 * 60 * 60
 
-class GemBot():
+# Maximum number of deletions done per lock acquisition while sweeping.
+GC_SWEEP_BATCH = 256
 
-    model = genai.GenerativeModel("gemini-1.5-flash")
-    
-    def __init__(self):
-        self.conversation = []
+# Block size used when streaming object contents through a hasher.
+HASH_BLOCK_SIZE = 1024 * 1024
+
+class ObjectTooLarge(Exception):
+    """Raised when streamed content goes past its size limit."""
+
+
+class BranchMoved(Exception):
+    """Raised when a change was made against a branch tip that is no longer the tip."""
+
+
+def is_object_name(name):
+    """Check that a name is a SHA-256 hex digest and therefore safe to use as a path."""
+    return bool(re.fullmatch(r'[0-9a-f]{64}', name or ''))
+
+def is_safe_path(path):
+    """Check that a '/'-separated relative path stays inside the working files."""
+    if not isinstance(path, str) or not path or '\\' in path or '\0' in path:
+        return False
+    return all(part not in ('', '.', '..') for part in path.split('/'))
+
+def is_branch_name(name):
+    """Check that a branch name can be used as a file name inside the repository."""
+    if not isinstance(name, str) or not name or name.startswith('.') or '..' in name:
+        return False
+    return not any(char in name for char in '/\\\0')
+
+def hash_object_slice(task):
+    """
+    Hash an object in a worker process and return (name, digest, size).
+
+    The task lists the (path, offset, length) segments making up the object;
+    a length of None reads to the end of the file.
+    """
+    name, segments = task
+    hasher = hashlib.sha256()
+    size = 0
+    for path, offset, length in segments:
+        read = 0
+        with open(path, 'rb') as f:
+            f.seek(offset)
+            while length is None or read < length:
+                block_size = HASH_BLOCK_SIZE if length is None else min(HASH_BLOCK_SIZE, length - read)
+                block = f.read(block_size)
+                if not block:
+                    break
+                hasher.update(block)
+                read += len(block)
+        size += read
+    return name, hasher.hexdigest(), size
+
+# Worker processes shared by commit diffs and fsck hashing.
+PROCESS_POOL_WORKERS = os.cpu_count() or 1
+
+_process_pool = None
+_process_pool_lock = threading.Lock()
+
+def process_pool():
+    """
+    Return the process pool shared by every VCS, starting it on first use.
 
-    def system(self, text):
-        self.conversation = []
-        self.conversation.append({'role': 'system', 'content': text})
+    Workers are spawned rather than forked: forking a multithreaded server
+    can copy locks held by other threads, and a long-lived pool only pays
+    the start-up once.
+    """
+    global _process_pool
+    with _process_pool_lock:
+        if _process_pool is None:
+            _process_pool = ProcessPoolExecutor(max_workers=PROCESS_POOL_WORKERS,
+                                                mp_context=multiprocessing.get_context('spawn'))
+        return _process_pool
 
-    def sys_up(self):
-        self.conversation.append(("human", "{user_input}"))
-        self.bind()
+def process_map(fn, tasks, chunksize=1):
+    """Run fn over tasks in the shared worker processes and return the results in order."""
+    global _process_pool
+    pool = process_pool()
+    try:
+        return list(pool.map(fn, tasks, chunksize=chunksize))
+    except BrokenProcessPool:
+        # A worker died; the next call starts a new pool
+        with _process_pool_lock:
+            if _process_pool is pool:
+                _process_pool = None
+        pool.shutdown(wait=False)
+        raise
 
-    def bind(self):
-        pass  # No need to bind anything for Gemini
+# Lines of unchanged context sent around each conflicting hunk.
+CONFLICT_CONTEXT = 3
 
-    def gen_out(self, text):
-        self.conversation.append({'role': 'user', 'content': text})
-        conv = self.build_conversation()
-        response = self.model.generate_content(conv)
-        output = response.text  # Adjust this based on Gemini's response structure
-        # print(output, '\n')
-        self.conversation.append({'role': 'assistant', 'content': output})
-        # self.sys_up()
-        return output
+# Hunks are batched into assistant requests of at most this many characters.
+CONFLICT_PROMPT_BUDGET = 12000
 
-    def build_conversation(self):
-        return "\n\n".join(f"{msg['role'].capitalize()}: {msg['content']}" for msg in self.conversation)
+# Default number of worker threads used to hash and store files during commit.
+DEFAULT_COMMIT_WORKERS = min(8, os.cpu_count() or 1)
 
-cb1 = GemBot()
-sys_text = "You are an AI assitant that will receive two pieces of texts that will have conflicts and your task is to give the user suggestions on merging the first text into the second resolving the conflict."
-cb1.system(sys_text)
+# Diffs are only sent to the process pool when the changed files hold at least
+# this many bytes in total; below it sending them to the workers costs more than it saves.
+DIFF_POOL_MIN_BYTES = 1024 * 1024
+
+# Recently read objects are kept in memory up to this many bytes.
+OBJECT_CACHE_BYTES = 16 * 1024 * 1024
+
+# Objects larger than this are never kept in the read cache.
+OBJECT_CACHE_MAX_OBJECT = 1024 * 1024
+
+# Number of decoded tree objects and flattened snapshots kept in memory.
+TREE_CACHE_ENTRIES = 4096
+SNAPSHOT_CACHE_ENTRIES = 8
+
+# A cached file hash is only trusted when the file's mtime is at least this
+# much older than the scan that recorded it; a write within the same mtime
+# tick as the scan could otherwise go unnoticed.
+RACY_WINDOW_NS = 2 * 10 ** 9
+
+class ObjectReadCache:
+    """
+    Byte-bounded LRU of object contents.
+
+    Objects are immutable, so entries only have to be dropped when gc
+    deletes the object.
+    """
+
+    def __init__(self, max_bytes=OBJECT_CACHE_BYTES, max_object=OBJECT_CACHE_MAX_OBJECT):
+        self.max_bytes = max_bytes
+        self.max_object = max_object
+        self.entries = OrderedDict()
+        self.size = 0
+        self.lock = threading.Lock()
+
+    def get(self, file_hash):
+        with self.lock:
+            data = self.entries.get(file_hash)
+            if data is not None:
+                self.entries.move_to_end(file_hash)
+        CACHE_REQUESTS.inc(cache='object', result='hit' if data is not None else 'miss')
+        return data
+
+    def put(self, file_hash, data):
+        if len(data) > self.max_object:
+            return
+        with self.lock:
+            if file_hash in self.entries:
+                return
+            self.entries[file_hash] = data
+            self.size += len(data)
+            while self.size > self.max_bytes:
+                _, evicted = self.entries.popitem(last=False)
+                self.size -= len(evicted)
+
+    def discard(self, file_hash):
+        with self.lock:
+            data = self.entries.pop(file_hash, None)
+            if data is not None:
+                self.size -= len(data)
+
+    def clear(self):
+        with self.lock:
+            self.entries.clear()
+            self.size = 0
 
 class VCS:
-    def __init__(self, repo_path='repo'):
+    def __init__(self, repo_path='repo', commit_workers=DEFAULT_COMMIT_WORKERS, diff_engine=None,
+                 chunk_threshold=CHUNK_THRESHOLD, assistant=None):
         self.repo_path = repo_path
+        self.assistant = assistant
+        self.commit_workers = commit_workers
+        self.diff_engine = diff_engine or DiffEngine()
+        self.chunk_threshold = chunk_threshold
         self.commits_path = os.path.join(self.repo_path, 'commits')
-        self.files_path = os.path.join(self.repo_path, 'files')
+        self.worktrees_path = os.path.join(self.repo_path, 'worktrees')
         self.versions_path = os.path.join(self.repo_path, 'versions')
+        self.packs_path = os.path.join(self.repo_path, 'packs')
+        self.manifests_path = os.path.join(self.repo_path, 'manifests')
         self.branches_path = os.path.join(self.repo_path, 'branches.json')
+        self.refs_path = os.path.join(self.repo_path, 'refs.json')
+        self.fsck_checkpoint_path = os.path.join(self.repo_path, 'fsck_checkpoint.json')
         self.current_branch = 'main'
+        self.lock = threading.RLock()
+        self.object_cache = ObjectReadCache()
+        self.tree_cache = OrderedDict()
+        self.snapshot_cache = OrderedDict()
+        self.tree_lock = threading.Lock()
+        self.materializer = Materializer()
+        # Branch -> {relative path: (size, mtime_ns, inode, hash, recorded_ns)} of its worktree files
+        self.stat_caches = {}
 
         os.makedirs(self.commits_path, exist_ok=True)
-        os.makedirs(self.files_path, exist_ok=True)
+        os.makedirs(self.worktrees_path, exist_ok=True)
         os.makedirs(self.versions_path, exist_ok=True)
+        os.makedirs(self.packs_path, exist_ok=True)
+        os.makedirs(self.manifests_path, exist_ok=True)
+        self.load_packs()
         self.load_branches()
+        self.ensure_worktree(self.current_branch)
 
-    def load_commits(self):
-        """Load existing commits from the commits log."""
-        self.commits = []
-        commits_file = os.path.join(self.commits_path, 'commits.json')
-        if os.path.exists(commits_file):
-            with open(commits_file, 'r') as f:
-                self.commits = json.load(f)
-
-    def save_commits(self):
-        """Save the commits log to a file."""
-        commits_file = os.path.join(self.commits_path, 'commits.json')
-        with open(commits_file, 'w') as f:
-            json.dump(self.commits, f, indent=4)
+    @property
+    def files_path(self):
+        """The current branch's worktree."""
+        return self.worktree_path(self.current_branch)
 
     def hash_file(self, filepath):
         """Generate a hash for the file content to track changes."""
         hasher = hashlib.sha256()
         with open(filepath, 'rb') as f:
-            hasher.update(f.read())
+            for block in iter(lambda: f.read(HASH_BLOCK_SIZE), b''):
+                hasher.update(block)
         return hasher.hexdigest()
 
+    def hash_and_store(self, filename):
+        """Hash a working file and store it as a version in a single read pass."""
+        filepath = os.path.join(self.files_path, filename)
+        if os.path.getsize(filepath) >= self.chunk_threshold:
+            return self.store_chunked(filepath)
+        with open(filepath, 'rb') as f:
+            return self.store_stream(f)
+
+    def store_stream(self, stream, max_size=None):
+        """
+        Store everything read from a binary stream and return its hash.
+
+        The content is hashed while it is written to a temporary file in the
+        object store, so it is never held in memory as a whole. Once more than
+        max_size bytes arrive ObjectTooLarge is raised and the partial file is
+        removed. Content at or above the chunk threshold is stored chunked.
+        """
+        temp_path = os.path.join(self.versions_path, f'.tmp-{uuid.uuid4().hex}')
+        hasher = hashlib.sha256()
+        hash_seconds = 0.0
+        started = time.perf_counter()
+        size = 0
+        try:
+            with open(temp_path, 'wb') as vf:
+                for block in iter(lambda: stream.read(HASH_BLOCK_SIZE), b''):
+                    size += len(block)
+                    if max_size is not None and size > max_size:
+                        raise ObjectTooLarge(f"Content is larger than the {max_size} byte limit.")
+                    before = time.perf_counter()
+                    hasher.update(block)
+                    hash_seconds += time.perf_counter() - before
+                    vf.write(block)
+            if size >= self.chunk_threshold:
+                file_hash = self.store_chunked(temp_path)
+                os.remove(temp_path)
+                return file_hash
+            file_hash = hasher.hexdigest()
+            if self.freshen_object(file_hash):
+                os.remove(temp_path)
+                OBJECT_WRITES.inc(result='existing')
+            else:
+                os.replace(temp_path, os.path.join(self.versions_path, file_hash))
+                OBJECT_WRITES.inc(result='written')
+                OBJECT_WRITE_BYTES.inc(size)
+        except BaseException:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+        # Hashing and copying share one pass; split its time between the two
+        WORK_SECONDS.inc(hash_seconds, work='hash')
+        WORK_SECONDS.inc(time.perf_counter() - started - hash_seconds, work='store')
+        return file_hash
+
     def save_version(self, filename, file_hash):
         """Save a version of the file with a unique hash."""
+        if self.freshen_object(file_hash):
+            return
         filepath = os.path.join(self.files_path, filename)
         version_path = os.path.join(self.versions_path, file_hash)
         with open(filepath, 'rb') as f:
@@ -93,15 +306,399 @@ class VCS:
         with open(version_path, 'wb') as vf:
             vf.write(content)
 
-    def restore_version(self, filename, file_hash):
-        """Restore a file to a previous version using its hash."""
+    def write_object(self, file_hash, content):
+        """Store raw bytes under their hash unless the object already exists."""
+        if self.freshen_object(file_hash):
+            OBJECT_WRITES.inc(result='existing')
+            return
+        temp_path = os.path.join(self.versions_path, f'.tmp-{uuid.uuid4().hex}')
+        with open(temp_path, 'wb') as vf:
+            vf.write(content)
+        os.replace(temp_path, os.path.join(self.versions_path, file_hash))
+        OBJECT_WRITES.inc(result='written')
+        OBJECT_WRITE_BYTES.inc(len(content))
+
+    def store_chunked(self, filepath):
+        """Store a large file as content-defined chunks plus a manifest and return its hash."""
+        hasher = hashlib.sha256()
+        entries = []
+        size = 0
+        with open(filepath, 'rb') as f:
+            for data in iter_chunks(f):
+                chunk_hash = hashlib.sha256(data).hexdigest()
+                self.write_object(chunk_hash, data)
+                hasher.update(data)
+                entries.append([chunk_hash, len(data)])
+                size += len(data)
+        file_hash = hasher.hexdigest()
+        self.write_manifest(file_hash, {'size': size, 'chunks': entries})
+        return file_hash
+
+    def write_manifest(self, file_hash, manifest):
+        """Write the chunk manifest for a file unless it already exists."""
+        manifest_path = os.path.join(self.manifests_path, file_hash)
+        try:
+            os.utime(manifest_path)
+            return
+        except FileNotFoundError:
+            pass
+        temp_path = os.path.join(self.manifests_path, f'.tmp-{uuid.uuid4().hex}')
+        with open(temp_path, 'wb') as f:
+            f.write(dump_manifest(manifest))
+        os.replace(temp_path, manifest_path)
+
+    def store_manifest(self, file_hash, manifest):
+        """
+        Record an uploaded manifest after checking its chunks reassemble to file_hash.
+
+        Raises ValueError if a chunk is missing or the content does not match.
+        """
+        chunks = manifest.get('chunks', [])
+        for chunk_hash, _ in chunks:
+            if not is_object_name(chunk_hash) or not self.has_object(chunk_hash):
+                raise ValueError(f"Chunk '{chunk_hash}' has not been uploaded.")
+        hasher = hashlib.sha256()
+        size = 0
+        for chunk_hash, _ in chunks:
+            data = self.read_object(chunk_hash)
+            hasher.update(data)
+            size += len(data)
+        if hasher.hexdigest() != file_hash:
+            raise ValueError(f"Chunks do not reassemble to '{file_hash}'.")
+        self.write_manifest(file_hash, {'size': size, 'chunks': [[h, n] for h, n in chunks]})
+
+    def read_manifest(self, file_hash):
+        """Return the chunk manifest of a chunked object, or None."""
+        try:
+            with open(os.path.join(self.manifests_path, file_hash), 'r') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def load_packs(self):
+        """Index every pack in the store by the objects it contains."""
+        self.packs = {}
+        for name in sorted(os.listdir(self.packs_path)):
+            if not name.endswith('.idx'):
+                continue
+            pack_file = os.path.join(self.packs_path, name[:-4] + '.pack')
+            with open(os.path.join(self.packs_path, name), 'r') as f:
+                index = json.load(f)
+            for file_hash, (offset, length) in index.items():
+                self.packs[file_hash] = (pack_file, offset, length)
+
+    def has_object(self, file_hash):
+        """Check whether an object is stored loose or in a pack."""
+        return (file_hash in self.packs
+                or os.path.exists(os.path.join(self.versions_path, file_hash))
+                or os.path.exists(os.path.join(self.manifests_path, file_hash)))
+
+    def object_size(self, file_hash):
+        """Return the content size of an object, or None if it is not stored."""
+        try:
+            return os.path.getsize(os.path.join(self.versions_path, file_hash))
+        except FileNotFoundError:
+            pass
+        packed = self.packs.get(file_hash)
+        if packed:
+            return packed[2]
+        manifest = self.read_manifest(file_hash)
+        return manifest['size'] if manifest else None
+
+    def freshen_object(self, file_hash):
+        """Bump the mtime of an existing object so a running gc keeps it."""
         version_path = os.path.join(self.versions_path, file_hash)
-        filepath = os.path.join(self.files_path, filename)
-        if os.path.exists(version_path):
+        try:
+            os.utime(version_path)
+            return True
+        except FileNotFoundError:
+            pass
+        packed = self.packs.get(file_hash)
+        if packed:
+            try:
+                os.utime(packed[0])
+                return True
+            except FileNotFoundError:
+                pass
+        try:
+            os.utime(os.path.join(self.manifests_path, file_hash))
+            return True
+        except FileNotFoundError:
+            pass
+        return False
+
+    def read_object(self, file_hash):
+        """Return the raw bytes of an object, or None if it is not stored."""
+        data = self.object_cache.get(file_hash)
+        if data is not None:
+            OBJECT_READS.inc(source='cache')
+            return data
+        data = self.load_object(file_hash)
+        if data is not None:
+            self.object_cache.put(file_hash, data)
+        return data
+
+    def load_object(self, file_hash):
+        """Read an object from disk, bypassing the read cache."""
+        version_path = os.path.join(self.versions_path, file_hash)
+        try:
             with open(version_path, 'rb') as vf:
-                content = vf.read()
-            with open(filepath, 'wb') as f:
-                f.write(content)
+                data = vf.read()
+            OBJECT_READS.inc(source='loose')
+            OBJECT_READ_BYTES.inc(len(data))
+            return data
+        except FileNotFoundError:
+            pass
+        packed = self.packs.get(file_hash)
+        if packed:
+            pack_file, offset, length = packed
+            with open(pack_file, 'rb') as pf:
+                pf.seek(offset)
+                data = pf.read(length)
+            OBJECT_READS.inc(source='pack')
+            OBJECT_READ_BYTES.inc(len(data))
+            return data
+        if self.read_manifest(file_hash) is None:
+            OBJECT_READS.inc(source='missing')
+            return None
+        OBJECT_READS.inc(source='chunked')
+        return b''.join(self.iter_object(file_hash))
+
+    def iter_object(self, file_hash):
+        """Yield the content of an object in blocks, reassembling chunked objects as a stream."""
+        manifest = self.read_manifest(file_hash)
+        if manifest is None:
+            content = self.read_object(file_hash)
+            if content is not None:
+                yield content
+            return
+        for chunk_hash, _ in manifest['chunks']:
+            chunk = self.read_object(chunk_hash)
+            if chunk is None:
+                raise FileNotFoundError(f"Chunk {chunk_hash} of {file_hash} is missing.")
+            yield chunk
+
+    def write_tree(self, data):
+        """Store an encoded tree object and return its hash."""
+        name = tree_hash(data)
+        self.write_object(name, data)
+        return name
+
+    def read_tree(self, name):
+        """Return a decoded tree object; raises FileNotFoundError if it is not stored."""
+        with self.tree_lock:
+            tree = self.tree_cache.get(name)
+            if tree is not None:
+                self.tree_cache.move_to_end(name)
+        CACHE_REQUESTS.inc(cache='tree', result='hit' if tree is not None else 'miss')
+        if tree is not None:
+            return tree
+        data = self.read_object(name)
+        if data is None:
+            raise FileNotFoundError(f"Tree {name} is missing.")
+        tree = decode_tree(data)
+        with self.tree_lock:
+            self.tree_cache[name] = tree
+            if len(self.tree_cache) > TREE_CACHE_ENTRIES:
+                self.tree_cache.popitem(last=False)
+        return tree
+
+    def commit_tree(self, commit):
+        """Return the root tree hash of a commit, writing the trees of a pre-tree flat snapshot."""
+        if 'tree' in commit:
+            return commit['tree']
+        return build_tree(commit.get('snapshot', {}), self.write_tree)
+
+    def snapshot(self, commit, include=None):
+        """
+        Return the flat {path: hash} snapshot of a commit. The dict is shared and must not be modified.
+
+        With include (a sparse.PathFilter) only matching paths are returned,
+        reading only the subtrees that can hold them.
+        """
+        if 'tree' not in commit:
+            snapshot = commit.get('snapshot', {})
+            return {path: file_hash for path, file_hash in snapshot.items() if include.matches(path)} \
+                if include else snapshot
+        if include:
+            return flatten(commit['tree'], self.read_tree, include=include)
+        return self.flatten_tree(commit['tree'])
+
+    def flatten_tree(self, root):
+        """Return the flat {path: hash} snapshot of a root tree, keeping the last few in memory."""
+        with self.tree_lock:
+            snapshot = self.snapshot_cache.get(root)
+            if snapshot is not None:
+                self.snapshot_cache.move_to_end(root)
+                return snapshot
+        snapshot = flatten(root, self.read_tree)
+        with self.tree_lock:
+            self.snapshot_cache[root] = snapshot
+            if len(self.snapshot_cache) > SNAPSHOT_CACHE_ENTRIES:
+                self.snapshot_cache.popitem(last=False)
+        return snapshot
+
+    def working_files(self, root=None):
+        """Return {path: stat} for every working file, keyed by '/'-separated relative path."""
+        root = root or self.files_path
+        files = {}
+        stack = ['']
+        while stack:
+            prefix = stack.pop()
+            with os.scandir(os.path.join(root, prefix)) as entries:
+                for entry in entries:
+                    if entry.name.startswith(TEMP_PREFIX):
+                        continue
+                    if entry.is_dir(follow_symlinks=False):
+                        stack.append(prefix + entry.name + '/')
+                    elif entry.is_file(follow_symlinks=False):
+                        files[prefix + entry.name] = entry.stat(follow_symlinks=False)
+        return files
+
+    def hash_working_file(self, path, stat, scanned_at, stat_cache):
+        """
+        Return the stored hash of a working file, reusing the cached hash if the file is unchanged.
+
+        A cached hash is trusted when the file's size, mtime and inode are
+        unchanged and it was either last modified well before the hash was
+        recorded or is still a read-only hardlink to that object. Otherwise,
+        or if the object has since been removed, the file is read and stored
+        again.
+        """
+        cached = self.stat_caches.get(self.current_branch, {}).get(path)
+        if (cached is not None and cached[:3] == (stat.st_size, stat.st_mtime_ns, stat.st_ino)
+                and (stat.st_mtime_ns < cached[4] - RACY_WINDOW_NS or self.is_object_link(stat, cached[3]))
+                and self.freshen_object(cached[3])):
+            CACHE_REQUESTS.inc(cache='stat', result='hit')
+            file_hash = cached[3]
+            if self.is_object_link(stat, file_hash):
+                # Freshening the object also moved the mtime of the file sharing its inode
+                stat = os.stat(os.path.join(self.files_path, path))
+        else:
+            CACHE_REQUESTS.inc(cache='stat', result='miss')
+            file_hash = self.hash_and_store(path)
+        stat_cache[path] = (stat.st_size, stat.st_mtime_ns, stat.st_ino, file_hash, scanned_at)
+        return file_hash
+
+    def is_object_link(self, stat, file_hash):
+        """Check whether a file with this stat is a read-only hardlink to the loose object file_hash."""
+        if stat.st_mode & 0o222:
+            return False
+        try:
+            object_stat = os.stat(os.path.join(self.versions_path, file_hash))
+        except FileNotFoundError:
+            return False
+        return (object_stat.st_ino, object_stat.st_dev) == (stat.st_ino, stat.st_dev)
+
+    def worktree_path(self, branch):
+        return os.path.join(self.worktrees_path, branch)
+
+    def ensure_worktree(self, branch):
+        """
+        Create a branch's worktree from its latest commit unless it already exists.
+
+        The files are placed in a temporary directory that is renamed into
+        place, so a worktree is either complete or absent.
+        """
+        path = self.worktree_path(branch)
+        if os.path.isdir(path):
+            return path
+        temp = os.path.join(self.worktrees_path, TEMP_PREFIX + uuid.uuid4().hex)
+        stat_cache = {}
+        try:
+            os.makedirs(temp)
+            for file_path, file_hash in self.tip_snapshot(branch).items():
+                self.place_object(file_hash, temp, file_path, stat_cache)
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+            os.rename(temp, path)
+        except OSError:
+            shutil.rmtree(temp, ignore_errors=True)
+            # Another thread may have created it first
+            if not os.path.isdir(path):
+                raise
+            return path
+        self.stat_caches[branch] = stat_cache
+        return path
+
+    def remove_worktree(self, branch):
+        """Delete a branch's worktree, first renaming it out of the way so it is never seen half removed."""
+        self.stat_caches.pop(branch, None)
+        path = self.worktree_path(branch)
+        if not os.path.isdir(path):
+            return
+        temp = os.path.join(self.worktrees_path, TEMP_PREFIX + uuid.uuid4().hex)
+        os.rename(path, temp)
+        shutil.rmtree(temp, ignore_errors=True)
+
+    def place_object(self, file_hash, root, file_path, stat_cache=None):
+        """Put a stored version at root/file_path by reflink, hardlink or copy, and cache its hash."""
+        dest = os.path.join(root, file_path)
+        try:
+            method = self.materializer.place(os.path.join(self.versions_path, file_hash), dest)
+        except FileNotFoundError:
+            # Packed and chunked objects have no file of their own to link to
+            if not self.has_object(file_hash):
+                raise
+            write_file(dest, self.iter_object(file_hash), 'wb')
+            method = 'copy'
+        WORKTREE_FILES.inc(method=method)
+        if stat_cache is not None:
+            stat = os.stat(dest)
+            stat_cache[file_path] = (stat.st_size, stat.st_mtime_ns, stat.st_ino, file_hash, time.time_ns())
+
+    def update_worktree(self, branch, old_tree, new_tree):
+        """Bring an existing worktree from one tree to another, touching only the files that differ."""
+        root = self.worktree_path(branch)
+        if not os.path.isdir(root):
+            return
+        stat_cache = self.stat_caches.setdefault(branch, {})
+        for file_path, _, new_hash in diff_trees(old_tree, new_tree, self.read_tree):
+            if new_hash is None:
+                stat_cache.pop(file_path, None)
+                try:
+                    os.remove(os.path.join(root, file_path))
+                except FileNotFoundError:
+                    pass
+            else:
+                self.place_object(new_hash, root, file_path, stat_cache)
+
+    def reset_worktree(self, branch):
+        """
+        Throw away uncommitted changes in a branch's worktree, bringing it back to the branch tip.
+
+        Files the tip does not have are removed, along with directories left
+        empty, and files whose stat no longer matches the stat cache are
+        placed again. Every change made through write_file, place_object or
+        remove_file replaces the file's inode, so the inode alone tells them apart.
+        """
+        root = self.worktree_path(branch)
+        if not os.path.isdir(root):
+            return
+        snapshot = self.tip_snapshot(branch)
+        files = self.working_files(root)
+        stat_cache = self.stat_caches.setdefault(branch, {})
+        for file_path in files:
+            if file_path not in snapshot:
+                stat_cache.pop(file_path, None)
+                os.remove(os.path.join(root, file_path))
+        for directory, _, _ in sorted(os.walk(root), reverse=True):
+            if directory != root and not os.listdir(directory):
+                os.rmdir(directory)
+        for file_path, file_hash in snapshot.items():
+            stat = files.get(file_path)
+            cached = stat_cache.get(file_path)
+            if stat is not None and cached is not None and \
+                    cached[:4] == (stat.st_size, stat.st_mtime_ns, stat.st_ino, file_hash):
+                continue
+            dest = os.path.join(root, file_path)
+            if os.path.isdir(dest):
+                shutil.rmtree(dest)
+            self.place_object(file_hash, root, file_path, stat_cache)
+
+    def restore_version(self, filename, file_hash):
+        """Restore a file to a previous version using its hash, linking it from the store where possible."""
+        if self.has_object(file_hash):
+            self.place_object(file_hash, self.files_path, filename, self.stat_caches.setdefault(self.current_branch, {}))
             # print(f"Restored '{filename}' to version with hash {file_hash}.")
         else:
             print(f"Version with hash {file_hash} not found.")
@@ -113,38 +710,109 @@ class VCS:
                 return f.readlines()
         return []
     
+    @profiled('vcs.get_file_content_by_hash')
     def get_file_content_by_hash(self, file_hash):
-        """Retrieve file content based on its hash."""
-        # Create a temporary file path to restore the version
-        temp_filename = f"temp_{file_hash}"
-        self.restore_version(temp_filename, file_hash)  # Restore the version to a temporary file
-
-        # Read the content from the temporary file
-        temp_file_path = os.path.join(self.files_path, temp_filename)
-        content = self.get_file_content(temp_file_path)
-
-        # Clean up the temporary file after reading
-        if os.path.exists(temp_file_path):
-            os.remove(temp_file_path)
+        """Retrieve file content based on its hash, or None if it is missing, empty or not text."""
+        data = self.read_object(file_hash)
+        if data is None:
+            print(f"Version with hash {file_hash} not found.")
+            return None
+        if is_binary(data):
+            return None
 
+        # Decode the same way get_file_content reads files in text mode
+        try:
+            content = decode_lines(data)
+        except UnicodeDecodeError:
+            return None
         return content if content else None
 
     
     def load_branches(self):
-        """Load branches and set current branch commit history."""
+        """
+        Load the branch refs; each branch's history is read on first access.
+
+        A repository still keeping every history in branches.json is split
+        into per-branch files and a refs file the first time it is opened.
+        """
+        self.branches = BranchHistories(self.commits_path, self.refs_path, self.load_commit)
+        if self.branches.load_refs():
+            return
         if os.path.exists(self.branches_path):
             with open(self.branches_path, 'r') as f:
-                self.branches = json.load(f)
+                data = json.load(f)
+            for branch, history in data.items():
+                self.branches[branch] = [self.branches.share(entry) for entry in history]
+            self.save_branches()
+            os.remove(self.branches_path)
         else:
-            self.branches = {'main': []}
+            self.branches['main'] = []
             self.save_branches()
 
-        self.commits = self.branches.get(self.current_branch, [])
+    @property
+    def commits(self):
+        """The current branch's history."""
+        return self.branches[self.current_branch]
+
+    def load_commit(self, entry):
+        """Build a Commit from its JSON form, moving an inline diff log (older branch files) into the store."""
+        if 'diff_log' in entry:
+            entry = dict(entry)
+            entry['diff'] = self.write_diff_log(entry.pop('diff_log'))
+        return Commit.from_dict(entry)
 
-    def save_branches(self):
-        """Save the branches log to a file."""
-        with open(self.branches_path, 'w') as f:
-            json.dump(self.branches, f, indent=4)
+    def export_branches(self, depth=None, include=None):
+        """
+        Return the branch histories in their JSON form.
+
+        depth keeps only the latest commits of each branch. With include (a
+        sparse.PathFilter) only commits that changed a matching path are kept.
+        """
+        exported = {}
+        for branch in self.branches:
+            history = self.branches[branch]
+            if include:
+                history = self.commits_touching(history, include, depth)
+            elif depth is not None:
+                history = history[len(history) - depth:] if depth else []
+            exported[branch] = [commit.to_dict() for commit in history]
+        return exported
+
+    def commits_touching(self, history, include, limit=None):
+        """
+        Return the commits of a history that changed a path matching include, oldest first.
+
+        The history is walked from the newest commit and stops after limit
+        matches; each commit's tree is compared with its parent's only inside
+        the filter.
+        """
+        found = []
+        for i in range(len(history) - 1, -1, -1):
+            if limit is not None and len(found) >= limit:
+                break
+            tree = self.commit_tree(history[i])
+            parent = self.commit_tree(history[i - 1]) if i else None
+            if next(diff_trees(parent, tree, self.read_tree, include=include), None) is not None:
+                found.append(history[i])
+        found.reverse()
+        return found
+
+    def save_branches(self, sync=False):
+        """Write every changed branch history and the refs file, flushed to disk with sync."""
+        self.branches.save(sync=sync)
+
+    def write_diff_log(self, diff_log):
+        """Store a diff log as an object and return its hash."""
+        data = json.dumps(diff_log, separators=(',', ':')).encode()
+        name = hashlib.sha256(data).hexdigest()
+        self.write_object(name, data)
+        return name
+
+    def diff_log(self, commit):
+        """Read the diff log of a commit from the object store."""
+        name = commit.get('diff')
+        data = self.read_object(name) if name else None
+        return json.loads(data) if data else {}
 
     def switch_branch(self, branch_name):
         """Switch to another branch."""
@@ -152,83 +820,158 @@ class VCS:
             print(f"Branch '{branch_name}' does not exist.")
             return
 
-        # Save the current branch's commit history before switching
-        self.branches[self.current_branch] = self.commits
         self.current_branch = branch_name
-        self.commits = self.branches[branch_name]
+        self.ensure_worktree(branch_name)
         return f"Switched to branch '{branch_name}'."
 
     def create_branch(self, branch_name):
-        """Create a new branch."""
+        """Create a new branch; raises ValueError for a name that cannot be a file name."""
+        if not is_branch_name(branch_name):
+            raise ValueError(f"Invalid branch name '{branch_name}'.")
         if branch_name in self.branches:
             print(f"Branch '{branch_name}' already exists.")
             return
 
         self.branches[branch_name] = self.branches[self.current_branch].copy()  # Copy the current branch's history
-        self.save_branches()
+        try:
+            self.save_branches()
+        except BaseException:
+            # Otherwise every later save would fail on the same branch
+            self.branches.discard(branch_name)
+            raise
+        self.publish_ref(branch_name, None, self.tip_tree(branch_name))
         return f"Branch '{branch_name}' created."
 
-    def commit(self, message):
-        """Create a new commit with a message."""
-        snapshot = {}
-        diff_log = {}
-        for filename in os.listdir(self.files_path):
-            filepath = os.path.join(self.files_path, filename)
-            file_hash = self.hash_file(filepath)
-
-            # Read current version of the file
-            new_content = self.get_file_content(filepath)
-
-            # Try to get previous version of the file (from the last commit)
-            if self.commits:
-                last_commit = self.commits[-1]
-                old_file_hash = last_commit['snapshot'].get(filename)
-                old_version_path = os.path.join(self.versions_path, old_file_hash) if old_file_hash else None
-                old_content = self.get_file_content(old_version_path) if old_version_path else []
+    def publish_ref(self, branch, old_tree, new_tree, changes=None):
+        """
+        Announce that a branch moved from one tip tree to another.
+
+        changes are the (path, old_hash, new_hash) differences between the
+        trees when the caller already has them. Past MAX_EVENT_PATHS paths the
+        event leaves them out and clients fetch the manifest delta instead.
+        """
+        if changes is None:
+            changes = diff_trees(old_tree, new_tree, self.read_tree)
+        changed = []
+        deleted = []
+        for path, _, new_hash in changes:
+            if len(changed) + len(deleted) >= MAX_EVENT_PATHS:
+                changed = deleted = None
+                break
+            (deleted if new_hash is None else changed).append(path)
+        EVENTS.publish({'type': 'ref', 'branch': branch, 'old': old_tree, 'new': new_tree,
+                        'count': self.branches.count(branch), 'changed': changed, 'deleted': deleted})
+
+    @profiled('vcs.commit')
+    def commit(self, message, workers=None, save=True):
+        """
+        Create a new commit with a message and return it.
+
+        The working files are walked recursively and each directory becomes a
+        tree object; the commit records only the root tree hash. Files whose
+        stat is unchanged since the last commit are not read again, and the
+        changed files are found by comparing trees, skipping equal subtrees.
+
+        Changed files are hashed and stored across a thread pool of `workers`
+        threads (hashlib releases the GIL), and large diffs run in the shared process
+        pool. With a single worker everything runs serially; the tree is identical.
+
+        With save=False the commit is only added in memory and the caller
+        writes it later with save_branches() and then announces it with
+        publish_ref(), as group commits do.
+        """
+        workers = self.commit_workers if workers is None else workers
+        scanned_at = time.time_ns()
+        files = self.working_files()
+        filenames = sorted(files)
+        tip = self.branches.tip(self.current_branch)
+        last_tree = self.commit_tree(tip) if tip is not None else None
+
+        # Hash and save every file version
+        stat_cache = {}
+        with phase('commit', 'hash_store'):
+            def hash_file(filename):
+                return self.hash_working_file(filename, files[filename], scanned_at, stat_cache)
+            if workers > 1 and len(filenames) > 1:
+                with ThreadPoolExecutor(max_workers=workers) as pool:
+                    hashes = list(pool.map(hash_file, filenames))
             else:
-                old_content = []
-
-            # Save file version and generate diff
-            self.save_version(filename, file_hash)
-            snapshot[filename] = file_hash
-
-            diff = self.generate_diff(old_content, new_content)
-            if diff:
-                diff_log[filename] = diff
-
-        commit_data = {
-            'id': len(self.commits) + 1,
-            'timestamp': datetime.now().isoformat(),
-            'message': message,
-            'snapshot': snapshot,
-            'diff_log': diff_log
-        }
-        self.commits.append(commit_data)
-        self.save_commits()
-        print(f"Commit {commit_data['id']} created: {message}")
+                hashes = [hash_file(filename) for filename in filenames]
+        self.stat_caches[self.current_branch] = stat_cache
+
+        # Only files whose hash changed since the last commit can have a diff
+        with phase('commit', 'tree'):
+            tree = build_tree(dict(zip(filenames, hashes)), self.write_tree)
+            changes = list(diff_trees(last_tree, tree, self.read_tree))
+        last_snapshot = {filename: old_hash for filename, old_hash, new_hash in changes if old_hash}
+        changed = [filename for filename, _, new_hash in changes if new_hash]
+        diffs = {}
+        to_diff = []
+        with phase('commit', 'diff'):
+            for filename in changed:
+                # Oversized files get a summary without reading their content
+                old_file_hash = last_snapshot.get(filename)
+                old_size = (self.object_size(old_file_hash) or 0) if old_file_hash else 0
+                new_size = os.path.getsize(os.path.join(self.files_path, filename))
+                summary = self.diff_engine.oversized(old_size, new_size)
+                if summary:
+                    diffs[filename] = summary
+                else:
+                    to_diff.append(filename)
+            pairs = [self.read_diff_pair(filename, last_snapshot.get(filename)) for filename in to_diff]
+
+            total_bytes = sum(len(old) + len(new) for old, new in pairs)
+            if workers > 1 and len(pairs) > 1 and total_bytes >= DIFF_POOL_MIN_BYTES:
+                tasks = [(self.diff_engine, old, new) for old, new in pairs]
+                diffs.update(zip(to_diff, process_map(diff_bytes_pair, tasks)))
+            else:
+                diffs.update((filename, self.diff_engine.diff_bytes(old, new))
+                             for filename, (old, new) in zip(to_diff, pairs))
+        diff_log = {filename: diffs[filename] for filename in changed if diffs[filename]}
+
+        history = self.commits
+        commit_data = Commit(message, current_time(), id=len(history) + 1, tree=bytes.fromhex(tree),
+                             diff=bytes.fromhex(self.write_diff_log(diff_log)))
+        history.append(commit_data)
 
         # Save commits to the current branch
-        self.branches[self.current_branch] = self.commits
-        self.save_branches()
+        self.branches[self.current_branch] = history
+        if save:
+            with phase('commit', 'metadata'):
+                self.save_commits()
+                self.save_branches()
+            self.publish_ref(self.current_branch, last_tree, tree, changes)
+        print(f"Commit {commit_data.id} created: {message}")
+        return commit_data
 
     def save_commits(self):
-        """Save the current branch's commits to the file."""
-        branch_commits_file = os.path.join(self.commits_path, f'{self.current_branch}_commits.json')
-        with open(branch_commits_file, 'w') as f:
-            json.dump(self.commits, f, indent=4)
+        """Save the current branch's commits to its history file."""
+        self.branches.save([self.current_branch], refs=False)
+
+    def read_diff_pair(self, filename, old_file_hash):
+        """Read the previous and current raw content of a file for diffing."""
+        old_data = (self.read_object(old_file_hash) or b'') if old_file_hash else b''
+        with open(os.path.join(self.files_path, filename), 'rb') as f:
+            new_data = f.read()
+        return old_data, new_data
 
     def generate_diff(self, old_content, new_content):
             """Generate a diff between two versions of file content."""
-            diff = list(difflib.unified_diff(old_content, new_content, lineterm=''))
-            return diff if diff else None
+            return self.diff_engine.unified_diff(old_content, new_content)
 
     def add_file(self, filename, content):
         """Add a new file to the VCS."""
-        filepath = os.path.join(self.files_path, filename)
-        with open(filepath, 'w') as f:
-            f.write(content)
+        # Replaced rather than written in place: the old file may be a hardlink into the store
+        write_file(os.path.join(self.files_path, filename), content)
         print(f"File '{filename}' added to repository.")
 
+    def remove_file(self, filename):
+        """Remove a file from the working files, so the next commit drops it."""
+        filepath = os.path.join(self.files_path, filename)
+        if os.path.exists(filepath):
+            os.remove(filepath)
+            print(f"File '{filename}' removed from repository.")
+
     def view_history(self):
         """Display the commit history in a human-readable format."""
         if not self.commits:
@@ -239,7 +982,7 @@ class VCS:
             print(f"Timestamp: {commit['timestamp']}")
             print(f"Message: {commit['message']}")
             print("Changes:")
-            for filename, diff in commit.get('diff_log', {}).items():
+            for filename, diff in self.diff_log(commit).items():
                 print(f"  File: {filename}")
                 self.format_diff(diff)
             print('-' * 30)
@@ -269,6 +1012,9 @@ class VCS:
                 removed_lines.append(line[1:].strip())  # Remove the "-" and strip whitespace
             elif line.startswith('+'):
                 added_lines.append(line[1:].strip())  # Remove the "+" and strip whitespace
+            elif not line.startswith(' '):
+                # Summary recorded instead of a line diff (binary or oversized file)
+                print(f"  {line}")
         
         if removed_lines:
             print(f"  Removed lines:")
@@ -282,11 +1028,13 @@ class VCS:
 
     def push_changes(self, remote_url):
         """Push changes to the remote server."""
-        response = requests.post(remote_url, data={"commits": json.dumps(self.commits)})
+        import requests
+        response = requests.post(remote_url, data={"commits": json.dumps([commit.to_dict() for commit in self.commits])})
         print(response.text)
 
     def pull_changes(self, remote_url):
         """Pull changes from the remote server."""
+        import requests
         response = requests.get(remote_url)
         remote_commits = json.loads(response.text)
         # Apply the new commits here, you could also check for conflicts
@@ -305,63 +1053,560 @@ class VCS:
         # Switch to the target branch
         self.switch_branch(target_branch)
 
-        # Get snapshots of both branches
-        target_snapshot = self.branches[target_branch][-1]['snapshot']
-        source_snapshot = self.branches[source_branch][-1]['snapshot']
+        # Get the root trees of both branches
+        target_tree = self.commit_tree(self.branches.tip(target_branch))
+        source_tree = self.commit_tree(self.branches.tip(source_branch))
 
-        # Identify conflicting files (files modified in both branches)
-        conflicting_files = []
-        merged_files = {}
+        # Files modified in both branches are conflicts; the merge only descends
+        # into subtrees whose hashes differ and reuses everything else as is.
+        # For simplicity, conflicts keep the target branch's version for now.
+        with phase('merge', 'compare'):
+            merged_tree, conflicting_files = merge_trees(source_tree, target_tree, self.read_tree, self.write_tree)
 
-        for filename, target_hash in target_snapshot.items():
-            source_hash = source_snapshot.get(filename)
-
-            # If file exists in both branches and has different content, it's a conflict
-            if source_hash and source_hash != target_hash:
-                conflicting_files.append(filename)
-            else:
-                # Use target file or new file from source
-                merged_files[filename] = target_hash or source_hash
-
-        # Merge files that have no conflicts
-        for filename, source_hash in source_snapshot.items():
-            if filename not in merged_files:
-                merged_files[filename] = source_hash
-
-        if conflicting_files:
-            print("Merge conflicts detected in the following files:")
-            for conflict in conflicting_files:
-                print(f"- {conflict}")
-            
-            # Resolve conflicts (in a real system, you would handle conflicts here)
-            # For simplicity, we'll choose the target branch's version for now.
-            print("Resolving conflicts by keeping target branch versions.")
-            for conflict in conflicting_files:
-                merged_files[conflict] = target_snapshot[conflict]
+        with phase('merge', 'resolve'):
+            if conflicting_files:
+                print("Merge conflicts detected in the following files:")
+                for conflict in conflicting_files:
+                    print(f"- {conflict}")
+                print("Resolving conflicts by keeping target branch versions.")
 
         # Update the snapshot of the target branch
-        self.branches[target_branch].append({
-            'message': f"Merged branch '{source_branch}' into '{target_branch}'",
-            'snapshot': merged_files,
-            'timestamp': datetime.now().isoformat()
-        })
+        history = self.branches[target_branch]
+        history.append(Commit(f"Merged branch '{source_branch}' into '{target_branch}'", current_time(),
+                              tree=bytes.fromhex(merged_tree)))
+        self.branches[target_branch] = history
+        self.save_branches()
+        self.update_worktree(target_branch, target_tree, merged_tree)
+        self.publish_ref(target_branch, target_tree, merged_tree)
         
         print(f"Branch '{source_branch}' merged into '{target_branch}' successfully.")
 
-    def chat(self, conflicts):
-        for i in conflicts:
-            print(i)
-        cb = GemBot()
-        cb.system(sys_text)
-        s = f"""
-        the source file is "{conflicts[0]}"
-        the target file is "{conflicts[1]}"
+    def tip_tree(self, branch):
+        """Return the root tree hash of a branch's latest commit, or None for an empty branch."""
+        if branch not in self.branches:
+            raise ValueError(f"Branch '{branch}' does not exist.")
+        tip = self.branches.tip(branch)
+        return self.commit_tree(tip) if tip is not None else None
+
+    def check_tip(self, branch, tree):
+        """Raise BranchMoved unless tree (a root tree hash, None for an empty branch) is still the branch's tip."""
+        if self.tip_tree(branch) != tree:
+            raise BranchMoved(f"Branch '{branch}' has changed since it was pulled. Pull it and push again.")
+
+    def tip_snapshot(self, branch):
+        """Return the snapshot of a branch's latest commit, or {} for an empty branch."""
+        if branch not in self.branches:
+            raise ValueError(f"Branch '{branch}' does not exist.")
+        tip = self.branches.tip(branch)
+        return self.snapshot(tip) if tip is not None else {}
+
+    def branch_info(self, branch):
+        """Summarise a branch without reading any file content or its history."""
+        root = self.tip_tree(branch)
+        tip = self.branches.tip(branch)
+        return {
+            'branch': branch,
+            'commits': self.branches.count(branch),
+            'files': file_count(root, self.read_tree),
+            'tip': {'id': tip.get('id'), 'message': tip['message'], 'timestamp': tip['timestamp']} if tip else None
+        }
+
+    def compare_branches(self, source_branch, target_branch, paths=(), content=False):
+        """
+        Compare the tip trees of two branches by hash.
+
+        Lists the paths only in the source, only in the target and modified on
+        both; subtrees with equal hashes are skipped without being read. Diffs
+        (target to source) are only computed for the given paths, and with
+        content=True their text on both branches is included too.
+        """
+        source_tree = self.tip_tree(source_branch)
+        target_tree = self.tip_tree(target_branch)
+        source_only = []
+        target_only = []
+        modified = []
+        for path, target_hash, source_hash in diff_trees(target_tree, source_tree, self.read_tree):
+            if target_hash is None:
+                source_only.append(path)
+            elif source_hash is None:
+                target_only.append(path)
+            else:
+                modified.append(path)
+        source_only.sort()
+        target_only.sort()
+        modified.sort()
+        result = {
+            'source_branch': source_branch,
+            'target_branch': target_branch,
+            'source_only': source_only,
+            'target_only': target_only,
+            'modified': modified,
+            'counts': {
+                'source_only': len(source_only),
+                'target_only': len(target_only),
+                'modified': len(modified),
+                'unchanged': file_count(source_tree, self.read_tree) - len(source_only) - len(modified),
+            }
+        }
+
+        files = {}
+        for path in paths:
+            source_hash = lookup(source_tree, path, self.read_tree)
+            target_hash = lookup(target_tree, path, self.read_tree)
+            if source_hash is None and target_hash is None:
+                continue
+            entry = {'source_hash': source_hash, 'target_hash': target_hash,
+                     'diff': self.diff_versions(target_hash, source_hash)}
+            if content:
+                entry['source'] = self.read_text(source_hash)
+                entry['target'] = self.read_text(target_hash)
+            files[path] = entry
+        if paths:
+            result['files'] = files
+        return result
+
+    def diff_versions(self, old_hash, new_hash):
+        """Diff two stored versions by hash; a missing side counts as empty."""
+        if old_hash == new_hash:
+            return []
+        old_size = (self.object_size(old_hash) or 0) if old_hash else 0
+        new_size = (self.object_size(new_hash) or 0) if new_hash else 0
+        summary = self.diff_engine.oversized(old_size, new_size)
+        if summary:
+            return summary
+        old_data = (self.read_object(old_hash) or b'') if old_hash else b''
+        new_data = (self.read_object(new_hash) or b'') if new_hash else b''
+        return self.diff_engine.diff_bytes(old_data, new_data)
+
+    def read_text(self, file_hash):
+        """Return a stored version as text, or None if it is not stored."""
+        data = self.read_object(file_hash) if file_hash else None
+        if data is None:
+            return None
+        return io.TextIOWrapper(io.BytesIO(data), errors='replace').read()
+
+    def list_objects(self):
+        """Return the sorted names of all loose and packed objects."""
+        names = set(self.packs)
+        names.update(name for name in os.listdir(self.versions_path) if not name.startswith('.'))
+        return sorted(names)
+
+    def list_manifests(self):
+        """Return the sorted hashes of all chunked objects."""
+        return sorted(name for name in os.listdir(self.manifests_path) if not name.startswith('.'))
+
+    def mark_reachable(self, names, histories, roots=()):
+        """
+        Build a bitmap over the sorted names with a bit set for every object reachable from histories.
+
+        An object's bit is found by binary search in names, so nothing but
+        the bitmap is built beside the list. Tree objects are followed down to
+        their files, each distinct tree only once, and chunks are reachable
+        through the manifest of a reachable file. Returns the bitmap and the
+        set of reachable manifests.
+        """
+        bitmap = bytearray((len(names) + 7) // 8)
+        manifests = set(self.list_manifests())
+        reachable_manifests = set()
+
+        def mark(file_hash):
+            i = bisect_left(names, file_hash)
+            if i < len(names) and names[i] == file_hash:
+                bitmap[i >> 3] |= 1 << (i & 7)
+            if file_hash in manifests and file_hash not in reachable_manifests:
+                reachable_manifests.add(file_hash)
+                manifest = self.read_manifest(file_hash) or {'chunks': []}
+                for chunk_hash, _ in manifest['chunks']:
+                    mark(chunk_hash)
+
+        def read_tree(name):
+            # A missing tree is reported by fsck; here it just marks nothing
+            try:
+                return self.read_tree(name)
+            except (FileNotFoundError, ValueError):
+                return {'entries': [], 'files': 0}
+
+        for file_hash in roots:
+            mark(file_hash)
+        seen_trees = set()
+        seen_commits = set()
+        for commits in histories:
+            for commit in commits:
+                # Branches copied from each other share commit objects; mark each only once
+                if id(commit) in seen_commits:
+                    continue
+                seen_commits.add(id(commit))
+                if 'diff' in commit:
+                    mark(commit['diff'])
+                if 'tree' in commit:
+                    for name, tree in walk_trees(commit['tree'], read_tree, seen_trees):
+                        mark(name)
+                        for _, kind, child in tree['entries']:
+                            if kind == BLOB:
+                                mark(child)
+                    continue
+                for file_hash in commit.get('snapshot', {}).values():
+                    mark(file_hash)
+        return bitmap, reachable_manifests
+
+    def gc(self, grace_period=GC_GRACE_PERIOD, repack=False):
+        """
+        Remove objects that no branch references and optionally repack the survivors.
+
+        The repository lock is only held to copy the branch histories and to
+        delete or swap files; marking and repacking run without it.
+        """
+        started = time.time()
+        with self.lock:
+            histories = [list(commits) for commits in self.branches.values()]
+            old_packs = sorted({pack_file for pack_file, _, _ in self.packs.values()})
+
+        # Manifests written within the grace period keep their chunks alive
+        names = self.list_objects()
+        young_manifests = [name for name in self.list_manifests()
+                           if started - os.path.getmtime(os.path.join(self.manifests_path, name)) < grace_period]
+        bitmap, reachable_manifests = self.mark_reachable(names, histories, young_manifests)
+        reachable = [name for i, name in enumerate(names) if bitmap[i >> 3] & (1 << (i & 7))]
+
+        # Sweep unreachable loose objects and manifests older than the grace period
+        candidates = [os.path.join(self.versions_path, name) for i, name in enumerate(names)
+                      if not bitmap[i >> 3] & (1 << (i & 7)) and name not in self.packs]
+        candidates.extend(os.path.join(self.manifests_path, name) for name in self.list_manifests()
+                          if name not in reachable_manifests)
+        swept = 0
+        reclaimed = 0
+        for start in range(0, len(candidates), GC_SWEEP_BATCH):
+            with self.lock:
+                for version_path in candidates[start:start + GC_SWEEP_BATCH]:
+                    try:
+                        stat = os.stat(version_path)
+                    except FileNotFoundError:
+                        continue
+                    # The mtime is re-checked under the lock because commits freshen reused objects
+                    if started - stat.st_mtime < grace_period:
+                        continue
+                    os.remove(version_path)
+                    self.object_cache.discard(os.path.basename(version_path))
+                    swept += 1
+                    reclaimed += stat.st_size
+
+        packed = 0
+        if repack and reachable:
+            packed, repack_reclaimed = self.repack(reachable, old_packs, started, grace_period)
+            reclaimed += repack_reclaimed
+
+        report = {
+            'objects': len(names),
+            'reachable': len(reachable),
+            'manifests': len(reachable_manifests),
+            'swept': swept,
+            'packed': packed,
+            'reclaimed_bytes': reclaimed,
+            'seconds': round(time.time() - started, 3)
+        }
+        print(f"GC removed {swept} object(s) and reclaimed {reclaimed} bytes.")
+        return report
+
+    def repack(self, names, old_packs, started, grace_period=GC_GRACE_PERIOD):
+        """
+        Write names into a single new pack and drop the loose copies and old packs.
+
+        Other objects in a dropped pack that was modified within the grace
+        period are written back as loose objects with the pack's mtime, so
+        they get the same grace as any loose object, e.g. one uploaded for a
+        push that has not committed yet.
+        """
+        index = {}
+        pack_name = 'pack-' + hashlib.sha256('\n'.join(names).encode()).hexdigest()
+        pack_file = os.path.join(self.packs_path, pack_name + '.pack')
+        idx_file = os.path.join(self.packs_path, pack_name + '.idx')
+        if os.path.exists(idx_file):
+            return 0, 0
+
+        offset = 0
+        with open(pack_file + '.tmp', 'wb') as pf:
+            for name in names:
+                # Read past the cache so repacking does not evict the working set
+                content = self.load_object(name)
+                if content is None:
+                    continue
+                pf.write(content)
+                index[name] = [offset, len(content)]
+                offset += len(content)
+            pf.flush()
+            os.fsync(pf.fileno())
+        with open(idx_file + '.tmp', 'w') as f:
+            json.dump(index, f)
+
+        reclaimed = -offset
+        with self.lock:
+            os.replace(pack_file + '.tmp', pack_file)
+            os.replace(idx_file + '.tmp', idx_file)
+            for name in index:
+                version_path = os.path.join(self.versions_path, name)
+                if os.path.exists(version_path):
+                    reclaimed += os.path.getsize(version_path)
+                    os.remove(version_path)
+            for old_pack in old_packs:
+                # A pack freshened by a commit during gc may hold newly referenced objects
+                packed_at = os.path.getmtime(old_pack)
+                if packed_at >= started:
+                    continue
+                if started - packed_at < grace_period:
+                    reclaimed -= self.unpack_young(old_pack, index, packed_at)
+                reclaimed += os.path.getsize(old_pack)
+                os.remove(old_pack)
+                os.remove(old_pack[:-5] + '.idx')
+            self.load_packs()
+            # Objects only held by a dropped pack must not be served from memory
+            self.object_cache.clear()
+        return len(index), reclaimed
+
+    def unpack_young(self, pack_file, keep, packed_at):
+        """Write the objects of a pack that are not in keep back as loose objects; returns their bytes."""
+        written = 0
+        with open(pack_file, 'rb') as pf:
+            for name, (entry_pack, offset, length) in list(self.packs.items()):
+                if entry_pack != pack_file or name in keep:
+                    continue
+                version_path = os.path.join(self.versions_path, name)
+                if os.path.exists(version_path):
+                    continue
+                pf.seek(offset)
+                temp_path = os.path.join(self.versions_path, f'.tmp-{uuid.uuid4().hex}')
+                with open(temp_path, 'wb') as vf:
+                    vf.write(pf.read(length))
+                os.utime(temp_path, (packed_at, packed_at))
+                os.replace(temp_path, version_path)
+                written += length
+        return written
+
+    def fsck(self, workers=None, incremental=False):
+        """
+        Verify that every object hashes to its name and every snapshot reference exists.
+
+        Objects are re-hashed in the shared process pool, in batches sized for
+        `workers` processes. In incremental mode only loose objects modified
+        since the last clean run and packs not verified before are re-hashed;
+        snapshot references are always cross-checked.
+        """
+        started = time.time()
+        checkpoint = {'checked_at': 0, 'packs': []}
+        if incremental and os.path.exists(self.fsck_checkpoint_path):
+            with open(self.fsck_checkpoint_path, 'r') as f:
+                checkpoint = json.load(f)
+
+        with self.lock:
+            histories = {branch: list(commits) for branch, commits in self.branches.items()}
+            packs = dict(self.packs)
+
+        # Collect hashing tasks for loose objects and packed slices
+        tasks = []
+        for name in os.listdir(self.versions_path):
+            if name.startswith('.'):
+                continue
+            version_path = os.path.join(self.versions_path, name)
+            if incremental and os.path.getmtime(version_path) < checkpoint['checked_at']:
+                continue
+            tasks.append((name, [(version_path, 0, None)]))
+        verified_packs = set(checkpoint['packs'])
+        for name, (pack_file, offset, length) in packs.items():
+            if incremental and os.path.basename(pack_file) in verified_packs:
+                continue
+            tasks.append((name, [(pack_file, offset, length)]))
+
+        # Chunked objects are verified by hashing their reassembled chunks
+        missing = []
+        for name in self.list_manifests():
+            manifest_path = os.path.join(self.manifests_path, name)
+            if incremental and os.path.getmtime(manifest_path) < checkpoint['checked_at']:
+                continue
+            segments = []
+            for chunk_hash, _ in self.read_manifest(name)['chunks']:
+                if os.path.exists(os.path.join(self.versions_path, chunk_hash)):
+                    segments.append((os.path.join(self.versions_path, chunk_hash), 0, None))
+                elif chunk_hash in packs:
+                    segments.append(packs[chunk_hash])
+                else:
+                    missing.append({'hash': chunk_hash, 'manifest': name})
+                    segments = None
+                    break
+            if segments is not None:
+                tasks.append((name, segments))
+
+        corrupt = []
+        checked_bytes = 0
+        if tasks:
+            workers = workers or PROCESS_POOL_WORKERS
+            chunksize = max(1, len(tasks) // (workers * 4))
+            for name, digest, size in process_map(hash_object_slice, tasks, chunksize=chunksize):
+                checked_bytes += size
+                if digest != name:
+                    corrupt.append(name)
+
+        # Cross-check every tree and snapshot reference against the store
+        reported = set()
+        seen_trees = set()
+        for branch, commits in histories.items():
+            for commit in commits:
+                references = list(commit.get('snapshot', {}).items())
+                if 'diff' in commit:
+                    references.append(('diff log', commit['diff']))
+                stack = [('', commit['tree'])] if 'tree' in commit else []
+                while stack:
+                    prefix, name = stack.pop()
+                    if name in seen_trees:
+                        continue
+                    seen_trees.add(name)
+                    try:
+                        tree = self.read_tree(name)
+                    except (FileNotFoundError, ValueError):
+                        references.append((prefix or '/', name))
+                        continue
+                    for entry_name, kind, child in tree['entries']:
+                        if kind == TREE:
+                            stack.append((prefix + entry_name + '/', child))
+                        else:
+                            references.append((prefix + entry_name, child))
+                for filename, file_hash in references:
+                    if (branch, file_hash) in reported or self.has_object(file_hash):
+                        continue
+                    reported.add((branch, file_hash))
+                    missing.append({'hash': file_hash, 'branch': branch,
+                                    'commit': commit.get('id'), 'file': filename})
+
+        names = self.list_objects()
+        bitmap, reachable_manifests = self.mark_reachable(names, histories.values())
+        orphaned = [name for i, name in enumerate(names) if not bitmap[i >> 3] & (1 << (i & 7))]
+        orphaned.extend(name for name in self.list_manifests() if name not in reachable_manifests)
+
+        if not corrupt and not missing:
+            with open(self.fsck_checkpoint_path, 'w') as f:
+                json.dump({
+                    'checked_at': started,
+                    'packs': sorted({os.path.basename(pack_file) for pack_file, _, _ in packs.values()})
+                }, f, indent=4)
+
+        report = {
+            'incremental': incremental,
+            'checked': len(tasks),
+            'checked_bytes': checked_bytes,
+            'corrupt': sorted(corrupt),
+            'missing': missing,
+            'orphaned': orphaned,
+            'seconds': round(time.time() - started, 3)
+        }
+        print(f"fsck checked {len(tasks)} object(s): {len(corrupt)} corrupt, "
+              f"{len(missing)} missing, {len(orphaned)} orphaned.")
+        return report
+
+    def get_assistant(self):
+        """Load the conflict-assistant backend the first time it is needed."""
+        if self.assistant is None or isinstance(self.assistant, str):
+            self.assistant = load_backend(self.assistant)
+        return self.assistant
+
+    def merge_base(self, source_branch, target_branch):
+        """Return the last commit both branches share, or None if their histories diverge from the start."""
+        base = None
+        for source_commit, target_commit in zip(self.branches[source_branch], self.branches[target_branch]):
+            if (source_commit.get('id'), source_commit.get('timestamp')) != \
+                    (target_commit.get('id'), target_commit.get('timestamp')):
+                break
+            base = source_commit
+        return base
+
+    def conflict_versions(self, source_branch, target_branch, filename):
+        """Return the (source, target, base) hashes of a file; base is '' if the base lacks it and None without a base."""
+        for branch in (source_branch, target_branch):
+            if branch not in self.branches:
+                raise ValueError(f"Branch '{branch}' does not exist.")
+            if not self.branches.count(branch):
+                raise ValueError(f"Branch '{branch}' has no commits.")
+        source_hash = lookup(self.tip_tree(source_branch), filename, self.read_tree)
+        target_hash = lookup(self.tip_tree(target_branch), filename, self.read_tree)
+        if not source_hash or not target_hash:
+            raise ValueError(f"File '{filename}' is not on both branches.")
+        base = self.merge_base(source_branch, target_branch)
+        base_hash = (lookup(self.commit_tree(base), filename, self.read_tree) or '') if base else None
+        return source_hash, target_hash, base_hash
+
+    def suggest_for_versions(self, source_hash, target_hash, base_hash=None):
+        """Run the conflict assistant on stored versions of a file."""
+        source = ''.join(self.get_file_content_by_hash(source_hash) or [])
+        target = ''.join(self.get_file_content_by_hash(target_hash) or [])
+        base = None
+        if base_hash is not None:
+            base = ''.join(self.get_file_content_by_hash(base_hash) or []) if base_hash else ''
+        return self.suggest_conflicts(source, target, base)
+
+    def suggest_conflicts(self, source, target, base=None):
+        """
+        Ask the assistant about the conflicting hunks between two versions of a file.
+
+        Only the hunks (with a few lines of context) are sent, batched into as
+        few requests as fit the prompt budget. Returns the combined message and
+        the hunks with their suggestions and 0-based line ranges.
+        """
+        hunks = conflict_hunks(source.splitlines(keepends=True), target.splitlines(keepends=True),
+                               base.splitlines(keepends=True) if base is not None else None,
+                               CONFLICT_CONTEXT, self.diff_engine)
+        if not hunks:
+            return {'message': "No conflicting changes found.", 'hunks': []}
+
+        batches = [[]]
+        size = 0
+        for hunk in hunks:
+            text = self.format_hunk(hunk)
+            if batches[-1] and size + len(text) > CONFLICT_PROMPT_BUDGET:
+                batches.append([])
+                size = 0
+            batches[-1].append((hunk, text))
+            size += len(text)
+
+        for batch in batches:
+            s = f"""
         the source file is to be merged into the target file.
-        detect any conflicts that might arise during the merge and give a suggestion to resolve
-        the conflict.
+        below are only the conflicting hunks, each with a few lines of context from the target file.
+        for every hunk give a suggestion to resolve the conflict under a heading "### Hunk <number>".
 
+        {''.join(text for _, text in batch)}
         """
-        return cb.gen_out(s)
+            answer = self.get_assistant().complete(SYSTEM_PROMPT, s)
+            self.assign_suggestions([hunk for hunk, _ in batch], answer)
+
+        message = "\n\n".join(
+            f"**Hunk {hunk['id']}** (target lines {hunk['target_start'] + 1}-{hunk['target_end']}, "
+            f"source lines {hunk['source_start'] + 1}-{hunk['source_end']})\n{hunk['suggestion']}"
+            for hunk in hunks)
+        return {'message': message, 'hunks': hunks}
+
+    def format_hunk(self, hunk):
+        """Render a conflict hunk for the assistant prompt."""
+        parts = [f"### Hunk {hunk['id']} (target lines {hunk['target_start'] + 1}-{hunk['target_end']}, "
+                 f"source lines {hunk['source_start'] + 1}-{hunk['source_end']})\n"]
+        sections = [('Context before', hunk['context_before']), ('Base', hunk.get('base')),
+                    ('Target', hunk['target']), ('Source', hunk['source']),
+                    ('Context after', hunk['context_after'])]
+        for title, lines in sections:
+            if lines is None:
+                continue
+            parts.append(f"{title}:\n{''.join(lines)}")
+            if lines and not lines[-1].endswith('\n'):
+                parts.append('\n')
+        return ''.join(parts) + '\n'
 
-# Example usage
-vcs = VCS()
\ No newline at end of file
+    def assign_suggestions(self, hunks, answer):
+        """Split an assistant answer on its "Hunk <n>" headings and attach each part to its hunk."""
+        parts = {}
+        matches = list(re.finditer(r'^\W*Hunk\s+(\d+)\b.*$', answer, re.MULTILINE | re.IGNORECASE))
+        for match, following in zip(matches, matches[1:] + [None]):
+            end = following.start() if following else len(answer)
+            parts[int(match.group(1))] = answer[match.end():end].strip()
+        for hunk in hunks:
+            hunk['suggestion'] = parts.get(hunk['id'], '' if parts else answer.strip())
+
+    def chat(self, conflicts, base=None):
+        for i in conflicts:
+            print(i)
+        return self.suggest_conflicts(conflicts[0], conflicts[1], base)['message']
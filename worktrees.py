@@ -0,0 +1,118 @@
+"""
+Materialise stored objects into branch worktrees.
+
+Each branch has its own working directory under repo/worktrees/<branch>,
+filled from the object store. A file is placed as a copy-on-write clone
+(reflink) where the filesystem supports it, otherwise as a hardlink to the
+loose object, and only otherwise copied byte for byte.
+
+Hardlinked files share their inode with the stored object, so they are
+made read-only: writing one in place would change the object under every
+commit that references it. Since permission bits do not stop root, files
+are never hardlinked when running as root. Files are always placed by
+renaming a temporary file over the target, and anything writing into a
+worktree has to do the same (see write_file).
+"""
+import os
+import sys
+import uuid
+import errno
+import shutil
+import threading
+
+# ioctl request that clones a whole file on Linux filesystems with reflinks (btrfs, XFS).
+FICLONE = 0x40049409
+
+# Temporary files in a worktree start with this and are never committed.
+TEMP_PREFIX = '.vcs-tmp-'
+
+# Mode of hardlinked worktree files, and so of the objects they share an inode with.
+READ_ONLY = 0o444
+
+
+def reflink(source, dest):
+    """Create dest as a copy-on-write clone of source; raises OSError if the filesystem cannot."""
+    if not sys.platform.startswith('linux'):
+        raise OSError(errno.EOPNOTSUPP, "Reflinks are only supported on Linux.")
+    import fcntl
+    with open(source, 'rb') as src, open(dest, 'wb') as dst:
+        fcntl.ioctl(dst.fileno(), FICLONE, src.fileno())
+
+
+def temp_path(dest):
+    return os.path.join(os.path.dirname(dest), TEMP_PREFIX + uuid.uuid4().hex)
+
+
+def remove_quietly(path):
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
+def write_file(dest, content, mode='w'):
+    """Replace dest with new content through a temporary file."""
+    os.makedirs(os.path.dirname(dest), exist_ok=True)
+    temp = temp_path(dest)
+    try:
+        with open(temp, mode) as f:
+            if isinstance(content, (str, bytes)):
+                f.write(content)
+            else:
+                for block in content:
+                    f.write(block)
+        os.replace(temp, dest)
+    except BaseException:
+        remove_quietly(temp)
+        raise
+
+
+class Materializer:
+    """Place loose objects into worktrees, remembering which methods the filesystem refused."""
+
+    def __init__(self):
+        self.disabled = set()
+        self.lock = threading.Lock()
+        # Read-only files do not protect objects from root
+        if hasattr(os, 'geteuid') and os.geteuid() == 0:
+            self.disabled.add('hardlink')
+
+    def disable(self, method):
+        with self.lock:
+            self.disabled.add(method)
+
+    def place(self, source, dest):
+        """Put the object file at source at dest and return the method used."""
+        os.makedirs(os.path.dirname(dest), exist_ok=True)
+        temp = temp_path(dest)
+        try:
+            method = self.link(source, temp)
+            os.replace(temp, dest)
+        except BaseException:
+            remove_quietly(temp)
+            raise
+        return method
+
+    def link(self, source, temp):
+        if 'reflink' not in self.disabled:
+            try:
+                reflink(source, temp)
+                return 'reflink'
+            except FileNotFoundError:
+                raise
+            except OSError:
+                remove_quietly(temp)
+                self.disable('reflink')
+        if 'hardlink' not in self.disabled:
+            try:
+                os.link(source, temp)
+                os.chmod(temp, READ_ONLY)
+                return 'hardlink'
+            except FileNotFoundError:
+                raise
+            except OSError as e:
+                # Too many links is a limit of this one object, not of the filesystem
+                if e.errno != errno.EMLINK:
+                    self.disable('hardlink')
+        shutil.copyfile(source, temp)
+        return 'copy'